@@ -5,3 +5,9 @@ class BaseConfig(AppConfig):
 
     def ready(self):
         from . import signals
+        from .logs import (
+            LOG_QUEUE_ROOT,
+            start_queue,
+        )
+        # write log records of the app on a background thread, leaving the root logger to the project unless configured otherwise
+        start_queue("base", *([""] if LOG_QUEUE_ROOT else []))
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from django.conf import settings
+from base.logs import log_except
+logger = logging.getLogger("base")
+
+
+#====================SETTINGS: GETATTR====================#
+CACHE_DIR = getattr(settings, "CACHE_DIR")
+
+
+#====================CACHE: MISSING====================#
+# sentinel that distinguishes a cache miss from a cached None
+MISSING = object()
+
+
+#====================CACHE: MEMORY CACHE====================#
+class MemoryCache:
+    def __init__(self, **kwargs):
+        self.max_size = kwargs.get("max_size", 128)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expiry, value = entry
+            # evict expired entry
+            if expiry is not None and expiry <= time.time():
+                del self.entries[key]
+                return default
+            # mark entry as most recently used
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expiry=None):
+        with self.lock:
+            self.entries[key] = (expiry, value)
+            self.entries.move_to_end(key)
+            # evict least recently used entries
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+#====================CACHE: FILE CACHE====================#
+class FileCache:
+    def __init__(self, cache_dir, **kwargs):
+        self.cache_dir = Path(cache_dir)
+        self.prune_interval = kwargs.get("prune_interval", 100)
+        self.writes = 0
+
+    def get_path(self, key):
+        return self.cache_dir / hashlib.sha256(str(key).encode()).hexdigest()
+
+    def get_entry(self, key):
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as f:
+                expiry, value = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log_except(logger, "Cache entry has failed to be read", exception=e, object=path, level=logging.WARNING)
+            return
+        # evict expired entry
+        if expiry is not None and expiry <= time.time():
+            path.unlink(missing_ok=True)
+            return
+        return expiry, value
+
+    def get(self, key, default=MISSING):
+        entry = self.get_entry(key)
+        return entry[1] if entry else default
+
+    def set(self, key, value, expiry=None):
+        path = self.get_path(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first so that readers never see a partial entry
+            temp_path = path.with_name("%s.%s.%s.tmp" % (path.name, os.getpid(), threading.get_ident()))
+            with open(temp_path, "wb") as f:
+                pickle.dump((expiry, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception as e:
+            log_except(logger, "Cache entry has failed to be written", exception=e, object=path, level=logging.WARNING)
+            return
+        # periodically remove expired entries
+        self.writes += 1
+        if self.writes % self.prune_interval == 0:
+            self.prune()
+
+    def delete(self, key):
+        self.get_path(key).unlink(missing_ok=True)
+
+    def prune(self):
+        now = time.time()
+        for path in self.cache_dir.glob("*"):
+            try:
+                with open(path, "rb") as f:
+                    expiry, _ = pickle.load(f)
+                if expiry is not None and expiry <= now:
+                    path.unlink(missing_ok=True)
+            except Exception:
+                continue
+
+
+#====================CACHE: TIERED CACHE====================#
+class TieredCache:
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self.ttl = kwargs.get("ttl")
+        self.negative_ttl = kwargs.get("negative_ttl", self.ttl)
+        self.memory = MemoryCache(max_size=kwargs.get("max_size", 128))
+        cache_dir = kwargs.get("cache_dir", os.path.join(CACHE_DIR, name) if CACHE_DIR else None)
+        self.disk = FileCache(cache_dir) if kwargs.get("persist", True) and cache_dir else None
+        self.locks = dict()
+        self.locks_lock = threading.Lock()
+        self.tasks = dict()
+
+    def get_expiry(self, value, ttl=None):
+        # cache negative results for a shorter period
+        ttl = ttl if ttl is not None else (self.ttl if value is not None else self.negative_ttl)
+        return time.time() + ttl if ttl is not None else None
+
+    def get(self, key, default=MISSING):
+        value = self.memory.get(key)
+        if value is MISSING and self.disk:
+            # promote persisted entry to memory
+            if entry := self.disk.get_entry(key):
+                expiry, value = entry
+                self.memory.set(key, value, expiry)
+        return default if value is MISSING else value
+
+    def set(self, key, value, ttl=None):
+        expiry = self.get_expiry(value, ttl)
+        self.memory.set(key, value, expiry)
+        if self.disk:
+            self.disk.set(key, value, expiry)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk:
+            self.disk.delete(key)
+
+    def get_lock(self, key):
+        with self.locks_lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def get_or_set(self, key, func, ttl=None):
+        if (value := self.get(key)) is not MISSING:
+            return value
+        # let only one caller compute a missing value while the others wait for it
+        lock = self.get_lock(key)
+        with lock:
+            if (value := self.get(key)) is MISSING:
+                value = func()
+                self.set(key, value, ttl)
+        with self.locks_lock:
+            self.locks.pop(key, None)
+        return value
+
+    async def async_get_or_set(self, key, func, ttl=None):
+        if (value := self.get(key)) is not MISSING:
+            return value
+        # let only one task compute a missing value while the others await it
+        if not (task := self.tasks.get(key)) or task.get_loop() is not asyncio.get_running_loop():
+            task = self.tasks[key] = asyncio.ensure_future(func())
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            if task.done() and self.tasks.get(key) is task:
+                del self.tasks[key]
+        if self.get(key) is MISSING:
+            self.set(key, value, ttl)
+        return value
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import (
+    datetime,
+    timezone as dt_timezone,
+)
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+from django.utils import timezone
+from base.logs import (
+    log_event,
+    log_except,
+)
+from base.methods import get_active_accounts
+from base.metrics import get_last_success
+from base.scheduler import (
+    async_close_client,
+    async_instantiate_client,
+    async_verify_client,
+    get_account_id,
+)
+from lib.scheduler import get_queue_status
+logger = logging.getLogger("base")
+
+
+#====================SETTINGS: GETATTR====================#
+HEALTH_INTERVAL = getattr(settings, "HEALTH_INTERVAL")
+HEALTH_TIMEOUT = getattr(settings, "HEALTH_TIMEOUT")
+
+
+#====================HEALTH: FORMAT TIMESTAMP====================#
+def format_timestamp(value):
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromtimestamp(value, dt_timezone.utc)
+    return value.isoformat()
+
+
+#====================HEALTH: GET HEALTH====================#
+def get_health(**kwargs):
+    command = kwargs.get("command", "post_scheduler")
+    now = timezone.now()
+    health = dict(database=False, checked_at=now.isoformat())
+    try:
+        connection.ensure_connection()
+        health["database"] = True
+        status = get_queue_status()
+    except Exception as e:
+        log_except(logger, "Health snapshot has failed to be refreshed", exception=e, level=logging.WARNING)
+        return health
+    oldest_pending = status.get("oldest_pending")
+    health.update(
+        pending=status.get("pending"),
+        updating=status.get("updating"),
+        oldest_pending_age=(now - oldest_pending).total_seconds() if oldest_pending else None,
+        last_sent=format_timestamp(status.get("last_sent")),
+        last_scheduler_success=format_timestamp(get_last_success(command)),
+    )
+    return health
+
+
+#====================HEALTH: HEALTH SNAPSHOT====================#
+class HealthSnapshot:
+    def __init__(self, func, **kwargs):
+        self.func = func
+        self.interval = kwargs.get("interval", HEALTH_INTERVAL)
+        self.data = None
+        self.updated = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def get_age(self):
+        return time.monotonic() - self.updated if self.updated is not None else None
+
+    def refresh(self):
+        data = self.func()
+        with self.lock:
+            self.data = data
+            self.updated = time.monotonic()
+
+    def refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            # the thread has its own database connection that would otherwise be left open
+            connection.close()
+            with self.lock:
+                self.refreshing = False
+
+    def get(self):
+        updated = self.updated
+        age = self.get_age()
+        # refresh in place if there is no snapshot yet or it has gone unused for a while, so that an outdated one is never served
+        if age is None or age > self.interval * 3:
+            with self.lock:
+                # skip if another request has refreshed it in the meantime
+                if self.updated == updated:
+                    self.data = self.func()
+                    self.updated = time.monotonic()
+        elif age > self.interval:
+            with self.lock:
+                start = not self.refreshing
+                self.refreshing = True
+            if start:
+                threading.Thread(target=self.refresh_in_background, daemon=True).start()
+        with self.lock:
+            return dict(self.data, age=round(self.get_age(), 3))
+
+
+#====================HEALTH: SNAPSHOT INSTANCE====================#
+SNAPSHOT = HealthSnapshot(get_health)
+
+
+#====================HEALTH: HEALTH VIEW====================#
+def health_view(request):
+    # serve the database status of the snapshot rather than connecting on every probe
+    if SNAPSHOT.get().get("database"):
+        return JsonResponse({"status": "ok", "message": "Database connection successful"}, status=200)
+    return JsonResponse({"status": "error", "message": "Database connection failed"}, status=503)
+
+
+#====================HEALTH: READINESS VIEW====================#
+def readiness_view(request):
+    health = SNAPSHOT.get()
+    return JsonResponse(dict(health, status="ok" if health.get("database") else "error"), status=200 if health.get("database") else 503)
+
+
+#====================HEALTH: ASYNC VERIFY ACCOUNT====================#
+async def async_verify_account(account, result, start):
+    account_client = None
+    try:
+        account_client = await async_instantiate_client(account)
+        if not account_client.get("client"):
+            raise ValueError("Client has failed to be instantiated")
+        result["name"] = await async_verify_client(account_client)
+        result["status"] = "ok"
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+    finally:
+        # accounts that run out of time keep the status of timeout
+        result["latency"] = time.perf_counter() - start
+        if account_client and account_client.get("client"):
+            await async_close_client(account_client)
+
+
+#====================HEALTH: ASYNC VERIFY ACCOUNTS====================#
+async def async_verify_accounts(account_objects, **kwargs):
+    timeout = kwargs.get("timeout", HEALTH_TIMEOUT)
+    results = [dict(account_id=get_account_id(account), host=getattr(account, "host", None), name=None, status="timeout", latency=None, error=None) for account in account_objects]
+    start = time.perf_counter()
+    # verify every account at once so that the check takes as long as the slowest account rather than all of them
+    tasks = [asyncio.create_task(async_verify_account(account, result, start)) for account, result in zip(account_objects, results)]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout if timeout and timeout > 0 else None)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return results
+
+
+#====================HEALTH: VERIFY ACCOUNTS====================#
+def verify_accounts(**kwargs):
+    account_objects = list(kwargs.get("account_objects", get_active_accounts()))
+    timeout = kwargs.get("timeout", HEALTH_TIMEOUT)
+
+    if not account_objects:
+        log_event(logger, "No active account objects were found")
+        return []
+
+    results = asyncio.run(async_verify_accounts(account_objects, timeout=timeout))
+    for result in results:
+        if result["status"] == "ok":
+            log_event(logger, 'Credentials of "%s" have been verified in %.3fs', result["account_id"], result["latency"])
+        else:
+            log_except(logger, 'Credentials of "%s" have failed to be verified (%s)', result["account_id"], result["status"], exception=result["error"], object=result["host"])
+    return results
+
+
+#====================HEALTH: FORMAT VERIFY RESULTS====================#
+def format_verify_results(results):
+    lines = ["%-40s %-10s %-8s %12s  %s" % ("account", "host", "status", "latency (ms)", "error")]
+    for result in results:
+        lines.append("%-40s %-10s %-8s %12s  %s" % (
+            result["account_id"],
+            result["host"],
+            result["status"],
+            "%.3f" % (result["latency"] * 1000) if result["latency"] is not None else "-",
+            result["error"] or "",
+        ))
+    return "\n".join(lines)
@@ -0,0 +1,199 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+from datetime import (
+    datetime,
+    timezone,
+)
+from itertools import islice
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+)
+from django.conf import settings
+from django.db import models
+from lib.messages import MESSAGES
+
+
+#====================SETTINGS: GETATTR====================#
+LOG_MAX_ITEMS = getattr(settings, "LOG_MAX_ITEMS")
+LOG_MAX_LENGTH = getattr(settings, "LOG_MAX_LENGTH")
+LOG_QUEUE = getattr(settings, "LOG_QUEUE")
+LOG_QUEUE_ROOT = getattr(settings, "LOG_QUEUE_ROOT")
+
+
+#====================LOGS: LISTENERS====================#
+# background threads that write the records of queued loggers, with the handlers they write them with
+LISTENERS = dict()
+
+
+#====================LOGS: LOG LIST====================#
+class LogList:
+    # the first few items of a list, joined as string_list does
+    def __init__(self, items, **kwargs):
+        limit = kwargs.get("limit", LOG_MAX_ITEMS)
+        self.items = [cap_value(item) for item in islice(items, limit)]
+        self.total = len(items)
+
+    def __str__(self):
+        if not self.items:
+            return "None"
+        text = ", ".join(map(str, self.items))
+        return "%s and %s more" % (text, self.total - len(self.items)) if self.total > len(self.items) else text
+
+
+#====================LOGS: LOG TEXT====================#
+class LogText:
+    # text formatted from a template and its arguments only once it is read
+    def __init__(self, template, args):
+        self.template = template
+        self.args = tuple(cap_value(arg) for arg in args)
+
+    def __str__(self):
+        return cap_text(self.template % self.args if self.args else self.template)
+
+
+#====================LOGS: LOG MESSAGE====================#
+class LogMessage:
+    # message formatted only once its record is written
+    def __init__(self, key, **kwargs):
+        self.key = key
+        self.kwargs = {k: cap_value(v) for k, v in kwargs.items()}
+
+    def get_fields(self):
+        # keep templates apart from their arguments so that records of the same event can be grouped
+        fields = dict()
+        for k, v in self.kwargs.items():
+            if isinstance(v, LogText):
+                fields[k] = v.template
+                fields["%s_args" % k] = [str(arg) for arg in v.args]
+            else:
+                fields[k] = v if v is None or isinstance(v, (bool, int, float, str)) else str(v)
+        return fields
+
+    def __str__(self):
+        return MESSAGES[self.key].format(**{k: cap_text(str(v)) for k, v in self.kwargs.items()})
+
+
+#====================LOGS: CAP TEXT====================#
+def cap_text(text, **kwargs):
+    limit = kwargs.get("limit", LOG_MAX_LENGTH)
+    return "%s... (%s more characters)" % (text[:limit], len(text) - limit) if limit and len(text) > limit else text
+
+
+#====================LOGS: CAP VALUE====================#
+def cap_value(value):
+    # keep oversized payloads short and take a snapshot of anything that could change before it is written
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return LogList(value)
+    if isinstance(value, str):
+        return cap_text(value)
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, models.Model):
+        # NOTE: model objects lose their primary key once deleted
+        return str(value)
+    return value
+
+
+#====================LOGS: EVENT MESSAGE====================#
+def event_message(event, *args):
+    return LogMessage("LOG_EVENT", event=LogText(event, args))
+
+
+#====================LOGS: EXCEPT MESSAGE====================#
+def except_message(verbose, *args, **kwargs):
+    exception = kwargs.get("exception")
+    obj = kwargs.get("object")
+    return LogMessage("LOG_EXCEPT", exception=exception, verbose=LogText(verbose, args), object=obj)
+
+
+#====================LOGS: LOG====================#
+def log(logger, level, log_message):
+    logger.log(level, log_message, extra=dict(log_key=log_message.key))
+
+
+#====================LOGS: LOG EVENT====================#
+def log_event(logger, event, *args, **kwargs):
+    level = kwargs.get("level", logging.INFO)
+    # skip building the message altogether if it would not be written
+    if logger.isEnabledFor(level):
+        log(logger, level, event_message(event, *args))
+
+
+#====================LOGS: LOG EXCEPT====================#
+def log_except(logger, verbose, *args, **kwargs):
+    level = kwargs.get("level", logging.ERROR)
+    # skip building the message altogether if it would not be written
+    if logger.isEnabledFor(level):
+        log(logger, level, except_message(verbose, *args, **kwargs))
+
+
+#====================LOGS: LAZY QUEUE HANDLER====================#
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # leave lazy messages to be formatted by the background thread as their arguments are snapshots
+        if isinstance(record.msg, LogMessage):
+            return copy.copy(record)
+        return super().prepare(record)
+
+
+#====================LOGS: STRUCTURED FORMATTER====================#
+class StructuredFormatter(logging.Formatter):
+    # format records as JSON lines, keeping the fields of lazy messages apart from the message
+    def format(self, record):
+        data = dict(
+            time=datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            level=record.levelname,
+            logger=record.name,
+            key=getattr(record, "log_key", None),
+            message=record.getMessage(),
+        )
+        if isinstance(record.msg, LogMessage):
+            data["fields"] = record.msg.get_fields()
+        if record.exc_info:
+            data["traceback"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+#====================LOGS: QUEUE LOGGER====================#
+def queue_logger(name, handlers):
+    # hand records over to a background thread that writes them with the given handlers
+    record_queue = queue.SimpleQueue()
+    listener = QueueListener(record_queue, *handlers, respect_handler_level=True)
+    logging.getLogger(name).handlers = [LazyQueueHandler(record_queue)]
+    LISTENERS[name] = (listener, handlers)
+    listener.start()
+
+
+#====================LOGS: START QUEUE====================#
+def start_queue(*logger_names, **kwargs):
+    enabled = kwargs.get("enabled", LOG_QUEUE)
+    if not enabled:
+        return
+    for name in logger_names:
+        if name in LISTENERS or not (handlers := list(logging.getLogger(name).handlers)):
+            continue
+        if not LISTENERS:
+            atexit.register(stop_queue)
+            # background threads do not survive a fork, e.g. into celery workers
+            os.register_at_fork(after_in_child=restart_queue)
+        queue_logger(name, handlers)
+
+
+#====================LOGS: RESTART QUEUE====================#
+def restart_queue():
+    for name, (_, handlers) in list(LISTENERS.items()):
+        queue_logger(name, handlers)
+
+
+#====================LOGS: STOP QUEUE====================#
+def stop_queue():
+    # write any records left in the queue and give the handlers back to their loggers
+    for name, (listener, handlers) in list(LISTENERS.items()):
+        listener.stop()
+        logging.getLogger(name).handlers = list(handlers)
+        del LISTENERS[name]
@@ -1,9 +1,14 @@
+import asyncio
 import emoji
+import hashlib
 import json
 import logging
 import os
 import re
+import threading
 import urllib.request
+from asgiref.sync import sync_to_async
+from functools import lru_cache
 from datetime import (
     datetime,
     timedelta,
@@ -15,12 +20,23 @@ from dateutil import (
 from urllib.parse import urlparse
 from django.apps import apps as django_apps
 from django.conf import settings
-from django.db import connection
+from django.db import (
+    close_old_connections,
+    connection,
+    models,
+    transaction,
+)
+from django.db.models.signals import post_save
 from django.http import JsonResponse
+from django.utils import timezone
 from django.core.exceptions import (
     ImproperlyConfigured,
     ValidationError,
 )
+from base.logs import (
+    log_event,
+    log_except,
+)
 from lib.messages import (
     ICONS,
     MESSAGES,
@@ -28,13 +44,39 @@ from lib.messages import (
 logger = logging.getLogger("base")
 
 
+#====================PATTERNS: TEXT====================#
+# split text into links, whitespace, and words in a single scan - links may start in the middle of a word
+TEXT_PATTERN = re.compile(r"(?P<url>http[s]?://\S+)|(?P<space>\s+)|(?P<word>(?:(?!http[s]?://\S)\S)+)")
+HASHTAG_PATTERN = re.compile(r"#\w")
+MENTION_PATTERN = re.compile(r"@\w")
+WHITESPACE_PATTERN = re.compile(r"\s*")
+
+
+#====================PATTERNS: JSON====================#
+# characters that may end a string, a container, or a number or literal outside of a container
+JSON_STRING_PATTERN = re.compile(r'["\\]')
+JSON_STRUCTURE_PATTERN = re.compile(r'["\[\]{}]')
+JSON_SCALAR_END_PATTERN = re.compile(r"[\s,\]}]")
+
+
+#====================PATTERNS: EMOJI====================#
+# every emoji contains at least one of these non-ASCII codepoints, so text without any of them has no emoji
+EMOJI_CHAR_PATTERN = re.compile("[%s]" % "".join(sorted({re.escape(c) for key in emoji.EMOJI_DATA for c in key if not c.isascii()})))
+
+
 #====================SETTINGS: GETATTR====================#
 DEBUG = getattr(settings, "DEBUG")
+EMOJI_CACHE_SIZE = getattr(settings, "EMOJI_CACHE_SIZE")
 ACCOUNT_MODEL = getattr(settings, "ACCOUNT_MODEL")
+DELIVERY_MODEL = getattr(settings, "DELIVERY_MODEL")
 FEED_MODEL = getattr(settings, "FEED_MODEL")
 POST_MODEL = getattr(settings, "POST_MODEL")
 SCHEDULE_MODEL = getattr(settings, "SCHEDULE_MODEL")
+SYNC_BATCH_SIZE = getattr(settings, "SYNC_BATCH_SIZE", 500)
+SYNC_BULK = getattr(settings, "SYNC_BULK", True)
+SYNC_CHUNK_SIZE = getattr(settings, "SYNC_CHUNK_SIZE", 5000)
 SYNC_CONFIG = getattr(settings, "SYNC_CONFIG", dict())
+SYNC_INCREMENTAL = getattr(settings, "SYNC_INCREMENTAL", True)
 TIME_ZONE = getattr(settings, "TIME_ZONE")
 
 
@@ -65,24 +107,141 @@ def get_active_feeds(**kwargs):
 
 
 #====================BASE: SYNC DATA====================#
-def sync_data(sync_dict=SYNC_CONFIG):
+def sync_data(sync_dict=SYNC_CONFIG, **kwargs):
+    bulk = kwargs.get("bulk", SYNC_BULK)
+    chunk_size = kwargs.get("chunk_size", SYNC_CHUNK_SIZE)
+    force = kwargs.get("force", False)
+    incremental = kwargs.get("incremental", SYNC_INCREMENTAL)
+    results = dict()
     for k, v in sync_dict.items():
         model = v.get("model")
         data = v.get("data")
         object_id = v.get("object_id")
         if not (model and data):
             verbose_warning = 'Sync dictionary was improperly configured. Each key must be a valid JSON dictionary key and its value must be a dictionary with "model" and "data" keys.'
-            log_message = message("LOG_EXCEPT", exception=None, verbose=verbose_warning, object=k)
-            logger.warning(log_message)
+            log_except(logger, verbose_warning, object=k, level=logging.WARNING)
             continue
         model_object = get_model(model)
         if os.path.isfile(data):
-            data_dicts = get_json_dicts(data, key=k)
-            dicts_to_models(data_dicts, model_object, object_id=object_id)
+            # read records incrementally and sync them in fixed-size chunks
+            data_dicts = iter_json_dicts(data, key=k)
+            if not bulk:
+                counts = dicts_to_models(data_dicts, model_object, object_id=object_id)
+            elif incremental:
+                counts = sync_source(k, v, model_object, chunk_size=chunk_size, force=force)
+            else:
+                counts = dict(created=0, updated=0, unchanged=0)
+                for chunk in iter_chunks(data_dicts, chunk_size):
+                    for count_key, count in bulk_dicts_to_models(chunk, model_object, object_id=object_id).items():
+                        counts[count_key] += count
+            results[k] = counts
+            if counts.get("skipped"):
+                log_event(logger, '%s objects have not been synced as data file "%s" has not changed', model_object.__name__, data)
+            else:
+                log_event(logger, "%s objects have been synced (%s created, %s updated, %s unchanged)", model_object.__name__, counts["created"], counts["updated"], counts["unchanged"])
         else:
-            verbose_warning = 'Data file "%s" does not exist' % data
-            log_message = message("LOG_EXCEPT", exception=None, verbose=verbose_warning, object=data)
-            logger.warning(log_message)
+            log_except(logger, 'Data file "%s" does not exist', data, object=data, level=logging.WARNING)
+    return results
+
+
+#====================BASE: SYNC SOURCE====================#
+def sync_source(name, config, model_object, **kwargs):
+    chunk_size = kwargs.get("chunk_size", SYNC_CHUNK_SIZE)
+    force = kwargs.get("force", False)
+    data = config.get("data")
+    object_id = config.get("object_id") or ("uid",)
+    SyncSource = get_model("base.SyncSource")
+    SyncRecord = get_model("base.SyncRecord")
+    counts = dict(created=0, updated=0, unchanged=0)
+    stat = os.stat(data)
+    source = SyncSource.objects.filter(name=name).first()
+    config_digest = get_sync_config_digest(config, model_object)
+    # a source is only unchanged if it is read from the same file with the same configuration
+    unchanged_path = source and not force and source.path == data and source.config_digest == config_digest
+
+    # skip source if its file has not been modified since it was last synced
+    if unchanged_path and (source.mtime, source.size) == (stat.st_mtime, stat.st_size):
+        counts["skipped"] = True
+        return counts
+    digest = get_file_digest(data, salt=config_digest)
+    if unchanged_path and source.digest == digest:
+        source.mtime, source.size = stat.st_mtime, stat.st_size
+        source.save(update_fields=["mtime", "size"])
+        counts["skipped"] = True
+        return counts
+    if not source:
+        source = SyncSource.objects.create(name=name, path=data)
+
+    for chunk in iter_chunks(iter_json_dicts(data, key=name), chunk_size):
+        # hash each record together with the sync configuration
+        record_digests = dict()
+        for d in chunk:
+            if all(d.get(i) for i in object_id):
+                record_digests[get_record_identifier(d, object_id)] = get_record_digest(d, salt=config_digest)
+        identifiers = list(record_digests)
+        known_records = dict()
+        for n in range(0, len(identifiers), SYNC_BATCH_SIZE):
+            known_records.update({record.identifier: record for record in SyncRecord.objects.filter(source=source, identifier__in=identifiers[n:n + SYNC_BATCH_SIZE])})
+        # sync only records that are new or have been modified since they were last synced
+        changed_dicts = [d for d in chunk if (identifier := get_record_identifier(d, object_id)) in record_digests and (force or getattr(known_records.get(identifier), "digest", None) != record_digests[identifier])]
+        counts["unchanged"] += len(record_digests) - len({get_record_identifier(d, object_id) for d in changed_dicts})
+        synced = set()
+        for count_key, count in bulk_dicts_to_models(changed_dicts, model_object, object_id=object_id, synced=synced).items():
+            counts[count_key] += count
+        # remember the hashes of the synced records, leaving out those that have been rejected so that they are tried again
+        new_records = []
+        changed_records = []
+        for d in changed_dicts:
+            if tuple(d.get(i) for i in object_id) not in synced:
+                continue
+            identifier = get_record_identifier(d, object_id)
+            if record := known_records.get(identifier):
+                if record.digest != record_digests[identifier]:
+                    record.digest = record_digests[identifier]
+                    changed_records.append(record)
+            else:
+                known_records[identifier] = SyncRecord(source=source, identifier=identifier, digest=record_digests[identifier])
+                new_records.append(known_records[identifier])
+        with transaction.atomic():
+            SyncRecord.objects.bulk_create(new_records, batch_size=SYNC_BATCH_SIZE)
+            SyncRecord.objects.bulk_update(changed_records, ["digest"], batch_size=SYNC_BATCH_SIZE)
+
+    # remember the fingerprint of the synced file
+    source.path = data
+    source.mtime, source.size = stat.st_mtime, stat.st_size
+    source.config_digest = config_digest
+    source.digest = digest
+    source.date_synced = timezone.now()
+    source.save()
+    return counts
+
+
+#====================BASE: GET SYNC CONFIG DIGEST====================#
+def get_sync_config_digest(config, model_object):
+    # records are synced again whenever the model or its unique identifiers change
+    config_values = [model_object._meta.label, list(config.get("object_id") or ("uid",))]
+    return hashlib.sha256(json.dumps(config_values).encode()).hexdigest()
+
+
+#====================BASE: GET FILE DIGEST====================#
+def get_file_digest(file_path, **kwargs):
+    salt = kwargs.get("salt", "")
+    digest = hashlib.sha256(salt.encode())
+    with open(file_path, "rb") as f:
+        while data := f.read(1048576):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+#====================BASE: GET RECORD IDENTIFIER====================#
+def get_record_identifier(d, object_id):
+    return hashlib.sha256(json.dumps([d.get(i) for i in object_id], default=str).encode()).hexdigest()
+
+
+#====================BASE: GET RECORD DIGEST====================#
+def get_record_digest(d, **kwargs):
+    salt = kwargs.get("salt", "")
+    return hashlib.sha256((salt + json.dumps(d, sort_keys=True, default=str)).encode()).hexdigest()
 
 
 #====================MODELS: GET MODEL====================#
@@ -111,6 +270,12 @@ def get_schedule_model():
     return get_model(SCHEDULE_MODEL, model_variable="SCHEDULE_MODEL")
 
 
+#====================MODELS: GET DELIVERY MODEL====================#
+def get_delivery_model():
+    # return the Delivery model that is active in this project
+    return get_model(DELIVERY_MODEL, model_variable="DELIVERY_MODEL")
+
+
 #====================MODELS: GET FEED MODEL====================#
 def get_feed_model():
     # return the Feed model that is active in this project
@@ -153,6 +318,7 @@ def get_values(*fields, **kwargs) -> list:
 #====================MODELS: DICTS TO MODELS====================#
 def dicts_to_models(dicts, model_object, **kwargs):
     object_id = kwargs.get("object_id", ("uid",))
+    counts = dict(created=0, updated=0, unchanged=0)
     # iterate through list of dicts to sync
     for d in dicts:
         identifier = dict()
@@ -170,9 +336,7 @@ def dicts_to_models(dicts, model_object, **kwargs):
                 # create or get object if already exists
                 obj, created = model_object.objects.get_or_create(**identifier)
             except ValidationError as e:
-                verbose_error = 'Failed to create or get %s object with identifier "%s"' % (model_object.__name__, identifier)
-                log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=d)
-                logger.error(log_error)
+                log_except(logger, 'Failed to create or get %s object with identifier "%s"', model_object.__name__, identifier, exception=e, object=d)
                 continue
             # iterate through dict field and value pairs
             for k, v in d.items():
@@ -181,14 +345,98 @@ def dicts_to_models(dicts, model_object, **kwargs):
                     continue
                 # update value if field exists in object and its value is different from json value
                 if hasattr(obj, k) and getattr(obj, k) != sanitise_value(v):
-                    log_message = message("LOG_EVENT", event='Updating %s object "%s.%s" from "%s" to "%s"' % (model_object.__name__, obj.pk, k, getattr(obj, k), sanitise_value(v)))
-                    logger.info(log_message)
+                    log_event(logger, 'Updating %s object "%s.%s" from "%s" to "%s"', model_object.__name__, obj.pk, k, getattr(obj, k), sanitise_value(v))
                     setattr(obj, k, sanitise_value(v))
                     update = True
+            counts["created" if created else "updated" if update else "unchanged"] += 1
         if update:
             obj.save()
-            log_message = message("LOG_EVENT", event='%s object "%s" has been updated' % (model_object.__name__, obj.pk))
-            logger.info(log_message)
+            log_event(logger, '%s object "%s" has been updated', model_object.__name__, obj.pk)
+    return counts
+
+
+#====================MODELS: BULK DICTS TO MODELS====================#
+def bulk_dicts_to_models(dicts, model_object, **kwargs):
+    batch_size = kwargs.get("batch_size", SYNC_BATCH_SIZE)
+    object_id = kwargs.get("object_id", ("uid",))
+    synced = kwargs.get("synced")
+    field_names = {f.attname for f in model_object._meta.concrete_fields} | {f.name for f in model_object._meta.concrete_fields}
+    # models with their own uniqueness checks are validated per created or updated object, as saving them would have
+    validate_unique = model_object.validate_unique is not models.Model.validate_unique
+    rows = dict()
+    # collect rows by their unique identifiers, skipping those without a value for any of them
+    for d in dicts:
+        if not all(d.get(i) for i in object_id):
+            continue
+        identifier = tuple(d.get(i) for i in object_id)
+        rows.setdefault(identifier, []).append(d)
+    identifiers = list(rows)
+
+    # fetch existing objects in batches, matching the full identifier in memory
+    existing_objects = dict()
+    for n in range(0, len(identifiers), batch_size):
+        batch = identifiers[n:n + batch_size]
+        queryset = model_object.objects.filter(**{"%s__in" % object_id[0]: {i[0] for i in batch}})
+        for obj in queryset:
+            existing_objects[tuple(getattr(obj, i) for i in object_id)] = obj
+
+    created_objects = []
+    updated_objects = []
+    rejected = set()
+    unchanged = 0
+    for identifier in identifiers:
+        obj = existing_objects.get(identifier)
+        created = obj is None
+        if created:
+            obj = model_object(**dict(zip(object_id, identifier)))
+        changed_fields = set()
+        for d in rows[identifier]:
+            # update value if field exists in object and its value is different from json value
+            for k, v in d.items():
+                if k in object_id or k not in field_names:
+                    continue
+                value = sanitise_value(v)
+                if getattr(obj, k) != value:
+                    if not created:
+                        log_event(logger, 'Updating %s object "%s.%s" from "%s" to "%s"', model_object.__name__, obj.pk, k, getattr(obj, k), value)
+                    setattr(obj, k, value)
+                    changed_fields.add(k)
+        if not (created or changed_fields):
+            unchanged += 1
+            continue
+        try:
+            # leave the object itself out of its uniqueness check, as ObjectAccount.save does
+            if validate_unique:
+                obj.validate_unique(exclude=obj.pk)
+            obj.clean()
+        except ValidationError as e:
+            log_except(logger, 'Failed to %s %s object with identifier "%s"', "create" if created else "update", model_object.__name__, dict(zip(object_id, identifier)), exception=e, object=rows[identifier][-1])
+            rejected.add(identifier)
+            continue
+        if created:
+            created_objects.append(obj)
+        else:
+            updated_objects.append((obj, changed_fields))
+
+    # apply all changes at once
+    update_fields = sorted({k for _, changed_fields in updated_objects for k in changed_fields})
+    with transaction.atomic():
+        model_object.objects.bulk_create(created_objects, batch_size=batch_size)
+        if update_fields:
+            model_object.objects.bulk_update([obj for obj, _ in updated_objects], update_fields, batch_size=batch_size)
+
+    # note the identifiers of objects that are now up to date with their records
+    if synced is not None:
+        synced.update(identifier for identifier in identifiers if identifier not in rejected)
+
+    # notify receivers as saving each object would have
+    for obj in created_objects:
+        post_save.send(sender=model_object, instance=obj, created=True, update_fields=None, raw=False, using=model_object.objects.db)
+    for obj, changed_fields in updated_objects:
+        post_save.send(sender=model_object, instance=obj, created=False, update_fields=frozenset(changed_fields), raw=False, using=model_object.objects.db)
+        log_event(logger, '%s object "%s" has been updated', model_object.__name__, obj.pk)
+
+    return dict(created=len(created_objects), updated=len(updated_objects), unchanged=unchanged)
 
 
 #====================UTILS: ESCAPE MARKDOWN====================#
@@ -198,9 +446,7 @@ def escape_md(text):
         escape_chars = r'_*['
         text = re.sub(f"([{re.escape(escape_chars)}])", r'\\\1', text)
     except Exception as e:
-        verbose_warning = "Failed to escape markdown characters"
-        log_message = message("LOG_EXCEPT", exception=e, verbose=verbose_warning, object=text)
-        logger.warning(log_message)
+        log_except(logger, "Failed to escape markdown characters", exception=e, object=text, level=logging.WARNING)
     return text
 
 
@@ -214,13 +460,182 @@ def get_json_dicts(json_file, **kwargs):
         return json_dict.get(key) if json_dict.get(key) else list()
 
 
+#====================UTILS: JSON STREAM====================#
+class JSONStream:
+    def __init__(self, f, **kwargs):
+        self.f = f
+        self.read_size = kwargs.get("read_size", 65536)
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        # scanning state of a value that spans several parts of the file
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def read(self):
+        if self.eof:
+            return ""
+        data = self.f.read(self.read_size)
+        self.eof = not data
+        return data
+
+    def fill(self):
+        # append the next part of the file to the unread part of the buffer
+        if not (data := self.read()):
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # return the next non-whitespace character without consuming it
+        while True:
+            self.pos = WHITESPACE_PATTERN.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, *chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError("Expected %s but found %r at position %s" % (" or ".join(repr(c) for c in chars), char, self.pos))
+        self.pos += 1
+        return char
+
+    def scan(self, text, i):
+        # advance over the text from i and return the end of the value once it is complete, keeping the state between parts of the file
+        while i < len(text):
+            if self.escape:
+                self.escape = False
+                i += 1
+            elif self.in_string:
+                if not (match := JSON_STRING_PATTERN.search(text, i)):
+                    return
+                i = match.end()
+                if match.group() == "\\":
+                    self.escape = True
+                    continue
+                self.in_string = False
+                if not self.depth:
+                    return i
+            elif not self.depth and text[i] not in '"[{':
+                # a number or literal ends at the next delimiter
+                if match := JSON_SCALAR_END_PATTERN.search(text, i):
+                    return match.start()
+                return
+            else:
+                if not (match := JSON_STRUCTURE_PATTERN.search(text, i)):
+                    return
+                i = match.end()
+                char = match.group()
+                if char == '"':
+                    self.in_string = True
+                elif char in "[{":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if not self.depth:
+                        return i
+
+    def decode(self):
+        # decode the next value directly if it is complete within the buffer
+        self.peek()
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            # a number or literal at the end of the buffer may continue in the next part of the file until a delimiter follows it
+            if self.eof or isinstance(value, (dict, list, str)) or JSON_SCALAR_END_PATTERN.match(self.buffer, end):
+                self.pos = end
+                return value
+        except json.JSONDecodeError:
+            pass
+
+        # otherwise read until the value is complete before decoding it once, rather than decoding it again after every read
+        self.depth, self.in_string, self.escape = 0, False, False
+        parts = [self.buffer[self.pos:]]
+        size = len(parts[0])
+        end = self.scan(parts[0], 0)
+        while end is None and (data := self.read()):
+            if (end := self.scan(data, 0)) is not None:
+                end += size
+            parts.append(data)
+            size += len(data)
+        self.buffer, self.pos = "".join(parts), 0
+        value, self.pos = self.decoder.raw_decode(self.buffer)
+        return value
+
+    def iter_array(self):
+        # yield the elements of the array starting at the current position one at a time
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(",", "]") == "]":
+                return
+
+    def iter_key(self, key):
+        # yield the elements of the array or the value of the given key of the top-level object
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            name = self.decode()
+            self.expect(":")
+            if name == key:
+                if self.peek() == "[":
+                    yield from self.iter_array()
+                elif value := self.decode():
+                    yield value
+                return
+            # skip values of other keys
+            self.decode()
+            if self.expect(",", "}") == "}":
+                return
+
+
+#====================UTILS: ITER JSON DICTS====================#
+def iter_json_dicts(json_file, **kwargs):
+    key = kwargs.get("key")
+    # yield one record per line of NDJSON files
+    if os.path.splitext(json_file)[1].lower() in (".ndjson", ".jsonl"):
+        with open(json_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(json_file, "r") as f:
+        stream = JSONStream(f)
+        if stream.peek() == "[":
+            yield from stream.iter_array()
+        elif key:
+            yield from stream.iter_key(key)
+        else:
+            yield stream.decode()
+
+
+#====================UTILS: ITER CHUNKS====================#
+def iter_chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 #====================UTILS: GET KEY VALUES====================#
 def get_key_values(**kwargs):
     json_file = kwargs.get("json_file")
     key = kwargs.get("key")
     settings_dict = kwargs.get("settings_dict")
     if json_file:
-        settings_dict = get_json_dicts(json_file, key=key)
+        settings_dict = iter_json_dicts(json_file, key=key)
     # cast empty strings to None
     return [sanitise_value(d.get(key)) for d in settings_dict if key in d]
 
@@ -247,11 +662,59 @@ def sanitise_value(v):
     return v if str(v).strip() != "" else None
 
 
+#====================UTILS: ANALYSE EMOJI====================#
+@lru_cache(maxsize=EMOJI_CACHE_SIZE)
+def analyse_emoji(text):
+    # skip texts that cannot contain any emoji
+    if text.isascii() or not EMOJI_CHAR_PATTERN.search(text):
+        return 0, 0, text
+    emoji_count, emoji_length, parts = 0, 0, []
+    # count emoji and replace them by their names in the same scan of the text
+    for token in emoji.analyze(text, non_emoji=True):
+        if isinstance(token.value, str):
+            parts.append(token.value)
+            continue
+        emoji_count += 1
+        emoji_length += len(token.value.emoji)
+        # emoji joined into an unknown sequence are named one by one, as emoji.replace_emoji does
+        matches = token.value.emojis if isinstance(token.value, emoji.EmojiMatchZWJNonRGI) else [token.value]
+        parts.extend(match.data["en"] for match in matches)
+    # return count, length of emoji, and the demojized text
+    return emoji_count, emoji_length, "".join(parts)
+
+
 #====================UTILS: COUNT EMOJI====================#
 def count_emoji(text):
-    tokens = list(emoji.analyze(text))
     # return count, length of emoji
-    return len(tokens), sum([len(t.value.emoji) for t in tokens])
+    return analyse_emoji(text)[:2]
+
+
+#====================UTILS: ANALYSE TEXT====================#
+def analyse_text(text, **kwargs):
+    emoji_stats = kwargs.get("emoji_stats", True)
+    tokens = []
+    for match in TEXT_PATTERN.finditer(text):
+        kind = match.lastgroup
+        value = match.group()
+        # classify words
+        if kind == "word":
+            kind = "hashtag" if HASHTAG_PATTERN.match(value) else "mention" if MENTION_PATTERN.match(value) else "text"
+        elif kind == "space":
+            kind = "text"
+        # merge consecutive text
+        if kind == "text" and tokens and tokens[-1][0] == "text":
+            tokens[-1] = ("text", tokens[-1][1] + value)
+        else:
+            tokens.append((kind, value))
+    # count emoji only if the text may contain any
+    emoji_count, emoji_length = count_emoji(text) if emoji_stats else (0, 0)
+    # return tokens, count and length of emoji, and number of characters with each emoji counted once
+    return dict(
+        tokens=tokens,
+        emoji_count=emoji_count,
+        emoji_length=emoji_length,
+        graphemes=len(text) - emoji_length + emoji_count,
+    )
 
 
 #====================UTILS: HAS EMOJI====================#
@@ -266,7 +729,7 @@ def emojize(text):
 
 #====================UTILS: DEMOJIZE====================#
 def demojize(text):
-    return emoji.replace_emoji(text, replace=lambda chars, data_dict: data_dict["en"]) if has_emoji(text) else text
+    return analyse_emoji(text)[2]
 
 
 #====================UTILS: MESSAGE====================#
@@ -298,6 +761,47 @@ def read_url(url):
     return urllib.request.urlopen(urllib.request.Request(url, headers={"User-Agent" : "Mozilla/5.0"})).read()
 
 
+#====================UTILS: EVENT LOOPS====================#
+# event loops kept running in the background per process, as threads do not survive a fork
+EVENT_LOOPS = dict()
+EVENT_LOOPS_LOCK = threading.Lock()
+
+
+#====================UTILS: GET EVENT LOOP====================#
+def get_event_loop():
+    with EVENT_LOOPS_LOCK:
+        if not (loop := EVENT_LOOPS.get(os.getpid())):
+            loop = EVENT_LOOPS[os.getpid()] = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="event-loop", daemon=True).start()
+    return loop
+
+
+#====================UTILS: RUN SYNC====================#
+def run_sync(coroutine):
+    # run on a single long-lived event loop rather than a new one per call, so that clients and their connections can be reused between calls
+    loop = get_event_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coroutine.close()
+        raise RuntimeError("Coroutine cannot be run synchronously from within its own event loop")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+#====================UTILS: DATABASE SYNC TO ASYNC====================#
+def database_sync_to_async(func):
+    # close stale connections of the thread that runs database calls for the event loop before and after each call, as it outlives database restarts and CONN_MAX_AGE
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call)
+
+
 #====================UTILS: REMOVE DICTIONARY KEYS====================#
 def remove_dict_keys(dictvar, keys):
     for k in keys:
@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from base.logs import log_except
+logger = logging.getLogger("base")
+
+
+#====================SETTINGS: GETATTR====================#
+METRICS_DIR = getattr(settings, "METRICS_DIR")
+
+
+#====================METRICS: BUCKETS====================#
+# upper bounds in seconds, long enough to cover posts that waited for their rate limit budget
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+#====================METRICS: ESCAPE====================#
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+#====================METRICS: FORMAT LABELS====================#
+def format_labels(labels):
+    return "{%s}" % ",".join('%s="%s"' % (key, escape(value)) for key, value in labels) if labels else ""
+
+
+#====================METRICS: FORMAT VALUE====================#
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+#====================METRICS: METRIC====================#
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def get_key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def get_samples(self):
+        # yield the name, labels, and value of every sample of the metric
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(type=self.type, help=self.documentation, labelnames=list(self.labelnames), samples=[[list(key), value] for key, value in self.values.items()])
+
+    def merge(self, key, value):
+        # counters and histograms accumulate over runs while gauges keep the latest value
+        with self.lock:
+            self.values[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+#====================METRICS: COUNTER====================#
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def merge(self, key, value):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+#====================METRICS: GAUGE====================#
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+#====================METRICS: HISTOGRAM====================#
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), **kwargs):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(kwargs.get("buckets", BUCKETS))
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            entry = self.values.setdefault(key, dict(counts=[0] * len(self.buckets), sum=0, count=0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_samples(self):
+        for name, labels, entry in super().get_samples():
+            # bucket counts are cumulative
+            for bound, count in zip(self.buckets + (float("inf"),), entry["counts"] + [entry["count"]]):
+                yield "%s_bucket" % name, labels + (("le", format_value(bound)),), count
+            yield "%s_sum" % name, labels, entry["sum"]
+            yield "%s_count" % name, labels, entry["count"]
+
+    def snapshot(self):
+        return dict(super().snapshot(), buckets=list(self.buckets))
+
+    def merge(self, key, value):
+        with self.lock:
+            entry = self.values.setdefault(key, dict(counts=[0] * len(self.buckets), sum=0, count=0))
+            entry["counts"] = [a + b for a, b in zip(entry["counts"], value["counts"])]
+            entry["sum"] += value["sum"]
+            entry["count"] += value["count"]
+
+
+#====================METRICS: REGISTRY====================#
+class Registry:
+    types = dict(counter=Counter, gauge=Gauge, histogram=Histogram)
+
+    def __init__(self):
+        self.metrics = dict()
+        self.lock = threading.Lock()
+
+    def register(self, metric_class, name, documentation, labelnames=(), **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), **kwargs):
+        return self.register(Histogram, name, documentation, labelnames, **kwargs)
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items() if metric.values}
+
+    def load(self, snapshot):
+        # merge a snapshot into the registry, registering any metric it does not know of
+        for name, data in snapshot.items():
+            metric_class = self.types.get(data.get("type"))
+            if not metric_class:
+                continue
+            params = dict(buckets=data["buckets"]) if metric_class is Histogram else dict()
+            metric = self.register(metric_class, name, data.get("help", ""), data.get("labelnames", ()), **params)
+            if metric_class is Histogram and list(metric.buckets) != data["buckets"]:
+                continue
+            for key, value in data.get("samples", []):
+                metric.merge(tuple(key), value)
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            samples = list(metric.get_samples())
+            if not samples:
+                continue
+            lines.append("# HELP %s %s" % (name, escape(metric.documentation).replace('\\"', '"')))
+            lines.append("# TYPE %s %s" % (name, metric.type))
+            lines.extend("%s%s %s" % (sample_name, format_labels(labels), format_value(value)) for sample_name, labels, value in samples)
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+#====================METRICS: REGISTRY INSTANCE====================#
+REGISTRY = Registry()
+STAGE_DURATION = REGISTRY.histogram("mango_stage_duration_seconds", "Time spent in each stage of sending posts.", ("stage", "host"))
+POSTS = REGISTRY.counter("mango_posts_total", "Posts handled per account by outcome.", ("outcome",))
+QUEUE_DEPTH = REGISTRY.gauge("mango_queue_depth", "Post schedule objects waiting to be sent by queue.", ("queue",))
+COMMAND_DURATION = REGISTRY.histogram("mango_command_duration_seconds", "Time spent running management commands.", ("command",))
+COMMAND_LAST_RUN = REGISTRY.gauge("mango_command_last_run_timestamp_seconds", "Time when management commands last finished.", ("command",))
+COMMAND_LAST_SUCCESS = REGISTRY.gauge("mango_command_last_success_timestamp_seconds", "Time when management commands last finished without an error.", ("command",))
+
+
+#====================METRICS: TIMER====================#
+def timer(stage, **labels):
+    return STAGE_DURATION.time(stage=stage, **labels)
+
+
+#====================METRICS: GET SNAPSHOT PATH====================#
+def get_snapshot_path(name, **kwargs):
+    metrics_dir = kwargs.get("metrics_dir", METRICS_DIR)
+    return Path(metrics_dir) / ("%s.json" % name) if metrics_dir else None
+
+
+#====================METRICS: READ SNAPSHOT====================#
+def read_snapshot(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+    except Exception as e:
+        log_except(logger, "Metrics snapshot has failed to be read", exception=e, object=path, level=logging.WARNING)
+        return dict()
+
+
+#====================METRICS: DUMP METRICS====================#
+def dump_metrics(name, **kwargs):
+    registry = kwargs.get("registry", REGISTRY)
+    path = get_snapshot_path(name, **kwargs)
+    if not path:
+        return
+    # add the metrics of this run to those of earlier runs so that counters keep increasing
+    merged = Registry()
+    merged.load(read_snapshot(path))
+    merged.load(registry.snapshot())
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so that readers never see a partial snapshot
+        temp_path = path.with_name("%s.%s.%s.tmp" % (path.name, os.getpid(), threading.get_ident()))
+        with open(temp_path, "w") as f:
+            json.dump(merged.snapshot(), f)
+        os.replace(temp_path, path)
+    except Exception as e:
+        log_except(logger, "Metrics snapshot has failed to be written", exception=e, object=path, level=logging.WARNING)
+
+
+#====================METRICS: GET LAST SUCCESS====================#
+def get_last_success(command, **kwargs):
+    registry = kwargs.get("registry", REGISTRY)
+    # management commands run in their own processes, so read the snapshot they dumped as well
+    merged = Registry()
+    merged.load(registry.snapshot())
+    path = get_snapshot_path(command, **kwargs)
+    if path:
+        merged.load(read_snapshot(path))
+    metric = merged.metrics.get(COMMAND_LAST_SUCCESS.name)
+    return metric.values.get((command,)) if metric else None
+
+
+#====================METRICS: RENDER METRICS====================#
+def render_metrics(**kwargs):
+    metrics_dir = kwargs.get("metrics_dir", METRICS_DIR)
+    registry = kwargs.get("registry", REGISTRY)
+    # merge the metrics of this process with those dumped by management commands
+    merged = Registry()
+    merged.load(registry.snapshot())
+    for path in sorted(Path(metrics_dir).glob("*.json")) if metrics_dir and os.path.isdir(metrics_dir) else []:
+        merged.load(read_snapshot(path))
+    return merged.render()
+
+
+#====================METRICS: METRICS VIEW====================#
+def metrics_view(request):
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+#====================METRICS: METRICS COMMAND====================#
+class MetricsCommand(BaseCommand):
+    # commands that judge their own success record it themselves
+    record_success = True
+
+    def add_arguments(self, parser):
+        parser.add_argument("--metrics", action="store_true", help="Print the metrics collected by the command once it finishes")
+
+    def execute(self, *args, **options):
+        name = self.__module__.rsplit(".", 1)[-1]
+        start = time.perf_counter()
+        succeeded = False
+        try:
+            output = super().execute(*args, **options)
+            succeeded = True
+            return output
+        finally:
+            # record the run and dump the metrics it collected
+            COMMAND_DURATION.observe(time.perf_counter() - start, command=name)
+            COMMAND_LAST_RUN.set(time.time(), command=name)
+            if succeeded and self.record_success:
+                COMMAND_LAST_SUCCESS.set(time.time(), command=name)
+            dump_metrics(name)
+            if options.get("metrics"):
+                self.stdout.write(REGISTRY.render())
@@ -1,35 +1,79 @@
 import logging
+import time
 from django.conf import settings
-from base.methods import (
-    get_values_list,
-    message,
-    string_list,
-)
-from lib.scheduler import schedule_post
+from django.db import transaction
+from base.logs import log_event
+from lib.scheduler import bulk_schedule_post
 logger = logging.getLogger("base")
 
 
 #====================SETTINGS: GETATTR====================#
+CLEAN_CHUNK_SIZE = getattr(settings, "CLEAN_CHUNK_SIZE")
+CLEAN_TIME_BUDGET = getattr(settings, "CLEAN_TIME_BUDGET")
 RETRY_POST = getattr(settings, "RETRY_POST")
 
 
+#====================BASE: GET DEADLINE====================#
+def get_deadline(time_budget):
+    # no deadline if there is no time budget
+    return time.monotonic() + time_budget if time_budget and time_budget > 0 else None
+
+
+#====================BASE: IS PAST DEADLINE====================#
+def is_past_deadline(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+#====================BASE: DELETE CHUNKS====================#
+def delete_chunks(queryset, **kwargs):
+    chunk_size = kwargs.get("chunk_size", CLEAN_CHUNK_SIZE)
+    deadline = kwargs.get("deadline")
+    counts = dict()
+    last_pk = None
+
+    while not is_past_deadline(deadline):
+        # get the next chunk of candidates after the last deleted one
+        chunk_objects = queryset.order_by("pk")
+        if last_pk is not None:
+            chunk_objects = chunk_objects.filter(pk__gt=last_pk)
+        pks = list(chunk_objects.values_list("pk", flat=True).distinct()[:chunk_size])
+        if not pks:
+            return counts, True
+        # delete chunk in a short transaction, checking that its objects are still candidates
+        with transaction.atomic():
+            _, deleted = queryset.filter(pk__in=pks).delete()
+        for label, count in deleted.items():
+            counts[label] = counts.get(label, 0) + count
+        last_pk = pks[-1]
+    return counts, False
+
+
+#====================BASE: FORMAT COUNTS====================#
+def format_counts(counts):
+    return ", ".join("%s %s" % (count, label) for label, count in sorted(counts.items()))
+
+
 #====================BASE: CLEAN DATA====================#
 def clean_data(deletion_candidates, schedule_candidates, **kwargs):
+    chunk_size = kwargs.get("chunk_size", CLEAN_CHUNK_SIZE)
     retry_post = kwargs.get("retry_post", RETRY_POST)
+    time_budget = kwargs.get("time_budget", CLEAN_TIME_BUDGET)
+    deadline = get_deadline(time_budget)
+    summary = dict(deleted=dict(), left_behind=dict(), scheduled=0, complete=True)
+
     # delete deletion candidate model objects
-    if deletion_candidates.exists():
-        log_message = message("LOG_EVENT", event='Objects "%s" have been deleted' % string_list(get_values_list("pk", queryset=deletion_candidates, unique=False)))
-        deletion_candidates.delete()
-        logger.info(log_message)
+    summary["deleted"], complete = delete_chunks(deletion_candidates, chunk_size=chunk_size, deadline=deadline)
+    if summary["deleted"]:
+        log_event(logger, "Objects have been deleted (%s)", format_counts(summary["deleted"]))
     # schedule or delete schedule candidate model objects
-    if schedule_candidates.exists():
-        if not retry_post:
-            verbose_event = 'Objects "%s" that were left behind have been deleted' % string_list(get_values_list("pk", queryset=schedule_candidates, unique=False))
-            log_message = message("LOG_EVENT", event=verbose_event)
-            schedule_candidates.delete()
-            logger.info(log_message)
-        else:
-            for candidate in schedule_candidates:
-                log_message = message("LOG_EVENT", event='Scheduling object "%s" that was left behind' % candidate.pk)
-                logger.info(log_message)
-                schedule_post(candidate)
+    if complete and not retry_post:
+        summary["left_behind"], complete = delete_chunks(schedule_candidates, chunk_size=chunk_size, deadline=deadline)
+        if summary["left_behind"]:
+            log_event(logger, "Objects that were left behind have been deleted (%s)", format_counts(summary["left_behind"]))
+    elif complete:
+        summary["scheduled"], complete = bulk_schedule_post(schedule_candidates, batch_size=chunk_size, deadline=deadline)
+
+    if not complete:
+        log_event(logger, "Cleaning has been stopped after its time budget of %ss and will resume on the next run", time_budget)
+    summary["complete"] = complete
+    return summary
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+
+
+#====================SETTINGS: GETATTR====================#
+RATE_LIMIT_BURST = getattr(settings, "RATE_LIMIT_BURST")
+RATE_LIMIT_HOST_BURST = getattr(settings, "RATE_LIMIT_HOST_BURST")
+RATE_LIMIT_HOST_RATE = getattr(settings, "RATE_LIMIT_HOST_RATE")
+RATE_LIMIT_MAX_WAIT = getattr(settings, "RATE_LIMIT_MAX_WAIT")
+RATE_LIMIT_RATE = getattr(settings, "RATE_LIMIT_RATE")
+
+
+#====================RATELIMIT: RATE LIMIT DEFERRED====================#
+class RateLimitDeferred(Exception):
+    pass
+
+
+#====================RATELIMIT: PARSE RESET====================#
+def parse_reset(value):
+    if not value:
+        return
+    try:
+        reset = float(value)
+        # treat small values as seconds until reset instead of an epoch timestamp
+        return reset if reset > 1e9 else time.time() + reset
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return
+
+
+#====================RATELIMIT: PARSE RATE LIMIT====================#
+def parse_ratelimit(headers):
+    if not headers:
+        return
+
+    # get a header value regardless of its prefix
+    def get_header(name):
+        for key in ("ratelimit-%s" % name, "x-ratelimit-%s" % name):
+            if (value := headers.get(key)) is not None:
+                return value
+
+    remaining = get_header("remaining")
+    if remaining is None:
+        return
+    try:
+        limit = int(get_header("limit") or 0) or None
+        remaining = int(remaining)
+    except ValueError:
+        return
+    return dict(limit=limit, remaining=remaining, reset=parse_reset(get_header("reset")))
+
+
+#====================RATELIMIT: TOKEN BUCKET====================#
+class TokenBucket:
+    def __init__(self, **kwargs):
+        self.capacity = self.default_capacity = kwargs.get("capacity", RATE_LIMIT_BURST)
+        self.rate = self.default_rate = kwargs.get("rate", RATE_LIMIT_RATE)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # time until which the budget has run dry
+        self.blocked_until = None
+        # time until which the learnt rate applies
+        self.window_end = None
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        if self.blocked_until is not None:
+            if now < self.blocked_until:
+                self.updated = now
+                return
+            # restore the budget once the rate limit window has been reset
+            self.tokens += self.capacity
+            self.updated = self.blocked_until
+            self.blocked_until = None
+            self.rate = self.default_rate
+        if self.window_end is not None and now >= self.window_end:
+            self.window_end = None
+            self.rate = self.default_rate
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait):
+        # take a token and return how long to wait for it, or None if the wait would be too long
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            start = self.blocked_until or now
+            tokens = self.tokens + (self.capacity if self.blocked_until else 0)
+            delay = (start - now) + (max(1 - tokens, 0) / self.rate if self.rate > 0 else 0)
+            if delay > max_wait:
+                return
+            self.tokens -= 1
+            return delay
+
+    def is_blocked(self):
+        with self.lock:
+            return self.blocked_until is not None and time.monotonic() < self.blocked_until
+
+    def refund(self):
+        with self.lock:
+            self.tokens += 1
+
+    def learn(self, ratelimit):
+        limit = ratelimit.get("limit")
+        remaining = ratelimit.get("remaining")
+        reset = ratelimit.get("reset")
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            if limit:
+                self.capacity = min(self.default_capacity, limit)
+            if remaining is None:
+                return
+            # trust the budget reported by the server over the local estimate
+            self.tokens = min(self.tokens, remaining)
+            window = reset - time.time() if reset else None
+            if not (window and window > 0):
+                return
+            if remaining <= 0:
+                self.blocked_until = now + window
+            else:
+                # spread the remaining budget evenly over the rest of the window
+                self.rate = remaining / window
+                self.window_end = now + window
+
+
+#====================RATELIMIT: RATE LIMITER====================#
+class RateLimiter:
+    def __init__(self, **kwargs):
+        self.burst = kwargs.get("burst", RATE_LIMIT_BURST)
+        self.host_burst = kwargs.get("host_burst", RATE_LIMIT_HOST_BURST)
+        self.host_rate = kwargs.get("host_rate", RATE_LIMIT_HOST_RATE)
+        self.max_wait = kwargs.get("max_wait", RATE_LIMIT_MAX_WAIT)
+        self.rate = kwargs.get("rate", RATE_LIMIT_RATE)
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def get_buckets(self, host, account):
+        with self.lock:
+            host_bucket = self.buckets.setdefault(("host", host), TokenBucket(capacity=self.host_burst, rate=self.host_rate))
+            account_bucket = self.buckets.setdefault(("account", account), TokenBucket(capacity=self.burst, rate=self.rate))
+        return host_bucket, account_bucket
+
+    def reserve(self, host, account):
+        # take a token from both the instance and the account budget or defer if either has run dry
+        delays = []
+        buckets = self.get_buckets(host, account)
+        for bucket in buckets:
+            if (delay := bucket.reserve(self.max_wait)) is None:
+                for reserved_bucket in buckets[:len(delays)]:
+                    reserved_bucket.refund()
+                raise RateLimitDeferred('Rate limit budget of "%s" on "%s" has run dry' % (account, host))
+            delays.append(delay)
+        return max(delays)
+
+    def check(self, host, account):
+        # defer if the budget has run dry while waiting for it
+        if any(bucket.is_blocked() for bucket in self.get_buckets(host, account)):
+            raise RateLimitDeferred('Rate limit budget of "%s" on "%s" has run dry' % (account, host))
+
+    def acquire(self, host, account):
+        if (delay := self.reserve(host, account)) > 0:
+            time.sleep(delay)
+            self.check(host, account)
+
+    async def async_acquire(self, host, account):
+        if (delay := self.reserve(host, account)) > 0:
+            await asyncio.sleep(delay)
+            self.check(host, account)
+
+    def learn(self, host, account, ratelimit):
+        # the budget reported for a request bounds both the instance and the account that made it
+        if ratelimit:
+            for bucket in self.get_buckets(host, account):
+                bucket.learn(ratelimit)
+
+
+#====================RATELIMIT: RATE LIMITER INSTANCE====================#
+# shared between runs in the same process so that what has been learnt about each budget is kept
+RATE_LIMITER = RateLimiter()
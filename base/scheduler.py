@@ -1,33 +1,85 @@
+import asyncio
+import hashlib
+import httpx
 import logging
 import math
 import random
+import time
+from collections import Counter
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+from contextlib import nullcontext
 from django.conf import settings
+from django.db import (
+    connection,
+    transaction,
+)
+from django.db.models import (
+    Count,
+    Max,
+    Min,
+    Prefetch,
+    prefetch_related_objects,
+)
+from django.utils import timezone
 from base.methods import (
+    database_sync_to_async,
     emojize,
     get_active_accounts,
+    get_delivery_model,
     get_domain,
     is_debug,
-    message,
+    run_sync,
     sanitise_string,
-    string_list,
+)
+from base.logs import (
+    event_message,
+    log,
+    log_event,
+    log_except,
+)
+from base.metrics import (
+    POSTS,
+    QUEUE_DEPTH,
+    timer,
+)
+from base.ratelimit import (
+    RATE_LIMITER,
+    RateLimitDeferred,
 )
 from lib.bluesky import (
+    async_close as async_close_bluesky,
+    async_instantiate as async_instantiate_bluesky,
+    async_send_post as async_send_bluesky_post,
+    async_verify_credentials as async_verify_bluesky_credentials,
+    get_ratelimit as get_bluesky_ratelimit,
     instantiate as instantiate_bluesky,
     prepare_post as prepare_bluesky_post,
     send_post as send_bluesky_post,
 )
 from lib.mastodon import (
+    async_close as async_close_mastodon,
+    async_instantiate as async_instantiate_mastodon,
+    async_send_post as async_send_mastodon_post,
+    async_verify_credentials as async_verify_mastodon_credentials,
+    get_ratelimit as get_mastodon_ratelimit,
     instantiate as instantiate_mastodon,
     prepare_post as prepare_mastodon_post,
     send_post as send_mastodon_post,
 )
 logger = logging.getLogger("base")
+DeliveryModel = get_delivery_model()
 
 
 #====================SETTINGS: GETATTR====================#
-DB_TYPE = getattr(settings, "DB_TYPE")
 ORGANIC_POSTS = getattr(settings, "ORGANIC_POSTS")
+POST_ENGINE = getattr(settings, "POST_ENGINE")
+POST_FLUSH_INTERVAL = getattr(settings, "POST_FLUSH_INTERVAL")
+POST_FLUSH_SIZE = getattr(settings, "POST_FLUSH_SIZE")
 POST_LIMIT = getattr(settings, "POST_LIMIT")
+POST_WORKERS = getattr(settings, "POST_WORKERS")
 RETRY_POST = getattr(settings, "RETRY_POST")
 
 
@@ -44,134 +96,668 @@ def schedule_post(schedule_model, subject_object, **kwargs):
     object_values = dict(name=name, subject=subject_object, receiver=receiver, visibility=visibility)
     post_object = schedule_model.objects.create(**object_values)
 
-    log_message = message("LOG_EVENT", event='%s object "%s" (%s) has been scheduled' % (schedule_model.__name__, post_object, post_object.subject))
-    logger.info(log_message)
+    log_event(logger, '%s object "%s" (%s) has been scheduled', schedule_model.__name__, post_object, subject_object)
 
 
-#====================BASE: POST SCHEDULER====================#
-def post_scheduler(pending_objects, updating_objects, **kwargs):
-    account_objects = kwargs.get("account_objects", get_active_accounts())
-    clients = kwargs.get("clients", {})
-    limit = kwargs.get("limit", POST_LIMIT)
-    organic = kwargs.get("organic", ORGANIC_POSTS)
-    retry_post = kwargs.get("retry_post", RETRY_POST)
+#====================BASE: BULK SCHEDULE POST====================#
+def bulk_schedule_post(schedule_model, subject_objects, **kwargs):
+    batch_size = kwargs.get("batch_size", 500)
+    deadline = kwargs.get("deadline")
+    receiver = kwargs.get("receiver")
+    visibility = kwargs.get("visibility")
+    name = "Mention" if receiver else "Public"
+    scheduled = 0
+    last_pk = None
 
-    if not account_objects:
-        if is_debug():
-            log_message = message("LOG_EVENT", event="No active account objects were found")
-            logger.info(log_message)
+    while deadline is None or time.monotonic() < deadline:
+        # get the next batch of subject objects after the last scheduled one
+        batch_objects = subject_objects.order_by("pk")
+        if last_pk is not None:
+            batch_objects = batch_objects.filter(pk__gt=last_pk)
+        pks = list(batch_objects.values_list("pk", flat=True).distinct()[:batch_size])
+        if not pks:
+            break
+        schedule_model.objects.bulk_create([schedule_model(name=name, subject_id=pk, receiver=receiver, visibility=visibility) for pk in pks])
+        scheduled += len(pks)
+        last_pk = pks[-1]
+    else:
+        # stop once the deadline has passed, leaving the rest for the next run
+        return scheduled, False
+
+    if scheduled:
+        log_event(logger, "%s %s objects have been scheduled", scheduled, schedule_model.__name__)
+    return scheduled, True
+
+
+#====================BASE: SAVE DELIVERIES====================#
+def save_deliveries(delivery_objects):
+    if not delivery_objects:
         return
+    delivery_model = type(delivery_objects[0])
+    update_fields = ["content_hash", "sent_at"]
+    # upsert deliveries one by one on databases that cannot resolve conflicts in bulk
+    if not connection.features.supports_update_conflicts:
+        for delivery_object in delivery_objects:
+            existing_object, created = delivery_model.objects.get_or_create(
+                subject_id=delivery_object.subject_id,
+                account_id=delivery_object.account_id,
+                defaults={field: getattr(delivery_object, field) for field in ["remote_id", *update_fields]},
+            )
+            if not created:
+                for field in update_fields:
+                    setattr(existing_object, field, getattr(delivery_object, field))
+                existing_object.save(update_fields=update_fields)
+        return
+    # insert new deliveries and refresh existing ones while keeping the ID of the original post, naming the conflicting fields only where the database supports it (e.g. not on mysql)
+    delivery_model.objects.bulk_create(
+        delivery_objects,
+        update_conflicts=True,
+        unique_fields=["subject", "account_id"] if connection.features.supports_update_conflicts_with_target else None,
+        update_fields=update_fields,
+    )
+
+
+#====================BASE: BACKFILL DELIVERIES====================#
+def backfill_deliveries(delivery_model, subject_objects, **kwargs):
+    batch_size = kwargs.get("batch_size", 500)
+    backfilled = 0
+    last_pk = None
+
+    while True:
+        # get the next batch of subject objects with legacy post ids after the last backfilled one
+        batch_objects = subject_objects.filter(post_id__isnull=False).order_by("pk")
+        if last_pk is not None:
+            batch_objects = batch_objects.filter(pk__gt=last_pk)
+        batch_objects = list(batch_objects.values_list("pk", "post_id")[:batch_size])
+        if not batch_objects:
+            break
+        # skip deliveries that have already been backfilled or recorded
+        delivered = set(delivery_model.objects.filter(subject__in=[pk for pk, _ in batch_objects]).values_list("subject", "account_id"))
+        delivery_objects = dict()
+        for pk, post_id in batch_objects:
+            for pid in post_id if isinstance(post_id, list) else []:
+                # legacy post ids are formatted as "<account_id>_<post_id>"
+                account_id, _, remote_id = str(pid).rpartition("_")
+                if account_id and remote_id and (pk, account_id) not in delivered:
+                    delivery_objects.setdefault((pk, account_id), delivery_model(subject_id=pk, account_id=account_id, remote_id=remote_id))
+        delivery_model.objects.bulk_create(delivery_objects.values(), ignore_conflicts=True)
+        backfilled += len(delivery_objects)
+        last_pk = batch_objects[-1][0]
+
+    if backfilled:
+        log_event(logger, "%s legacy post IDs have been backfilled into %s objects", backfilled, delivery_model.__name__)
+    return backfilled
+
+
+#====================BASE: DELIVERY BUFFER====================#
+class DeliveryBuffer:
+    def __init__(self, **kwargs):
+        self.flush_interval = kwargs.get("flush_interval", POST_FLUSH_INTERVAL)
+        self.flush_size = kwargs.get("flush_size", POST_FLUSH_SIZE)
+        self.deliveries = dict()
+        self.schedules = dict()
+        self.last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self.deliveries) + len(self.schedules)
+
+    def save_delivery(self, delivery_object):
+        # keep only the latest delivery of the same subject object to the same account
+        self.deliveries[(type(delivery_object), delivery_object.subject_id, delivery_object.account_id)] = delivery_object
+        self.flush_due()
+
+    def delete_schedule(self, schedule_object, log_message):
+        self.schedules[(type(schedule_object), schedule_object.pk)] = log_message
+        self.flush_due()
+
+    def flush_due(self):
+        # flush once enough writes have been collected or enough time has passed since the last flush
+        if len(self) >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not len(self):
+            return
+        deliveries = dict()
+        schedules = dict()
+        for (model, _, _), delivery_object in self.deliveries.items():
+            deliveries.setdefault(model, []).append(delivery_object)
+        for (model, pk), log_message in self.schedules.items():
+            schedules.setdefault(model, []).append(pk)
+        # write all collected deliveries and deletions at once
+        with timer("db_write"), transaction.atomic():
+            for delivery_objects in deliveries.values():
+                save_deliveries(delivery_objects)
+            for model, pks in schedules.items():
+                model.objects.filter(pk__in=pks).delete()
+        for log_message in self.schedules.values():
+            if log_message:
+                log(logger, logging.INFO, log_message)
+        self.deliveries.clear()
+        self.schedules.clear()
+
+
+#====================BASE: GET ACCOUNT ID====================#
+def get_account_id(account):
+    api_domain = get_domain(getattr(account, "api_base_url", None))
+    host = getattr(account, "host", None)
+    uid = getattr(account, "uid", None)
+    # format a unique account id
+    return "%s%s%s" % (uid, "." if host and host.lower() == "bluesky" else "@", api_domain) if api_domain and uid else None
+
 
+#====================BASE: INSTANTIATE CLIENT====================#
+def instantiate_client(account, **kwargs):
+    # options of the Bluesky client, such as the server it connects to and where its session is stored
+    bluesky_options = kwargs.get("bluesky_options", dict())
+    access_token = getattr(account, "access_token", None)
+    api_base_url = getattr(account, "api_base_url", None)
+    host = getattr(account, "host", None)
+    account_id = get_account_id(account)
+    with timer("instantiate", host=host):
+        client = instantiate_bluesky(access_token, account_id, **bluesky_options) if host and host.lower() == "bluesky" else instantiate_mastodon(access_token, api_base_url)
+    return dict(account_id=account_id, client=client, domain=get_domain(api_base_url), host=host)
+
+
+#====================BASE: ASYNC INSTANTIATE CLIENT====================#
+async def async_instantiate_client(account, **kwargs):
+    # options of the Bluesky client, such as the server it connects to and where its session is stored
+    bluesky_options = kwargs.get("bluesky_options", dict())
+    access_token = getattr(account, "access_token", None)
+    api_base_url = getattr(account, "api_base_url", None)
+    host = getattr(account, "host", None)
+    account_id = get_account_id(account)
+    with timer("instantiate", host=host):
+        client = await async_instantiate_bluesky(access_token, account_id, **bluesky_options) if host and host.lower() == "bluesky" else await async_instantiate_mastodon(access_token, api_base_url)
+    return dict(account_id=account_id, client=client, domain=get_domain(api_base_url), host=host)
+
+
+#====================BASE: ASYNC CLOSE CLIENT====================#
+async def async_close_client(account_client):
+    client = account_client.get("client")
+    host = account_client.get("host")
+    await async_close_bluesky(client) if host and host.lower() == "bluesky" else await async_close_mastodon(client)
+
+
+#====================BASE: ASYNC VERIFY CLIENT====================#
+async def async_verify_client(account_client):
+    client = account_client.get("client")
+    host = account_client.get("host")
+    return await async_verify_bluesky_credentials(client) if host and host.lower() == "bluesky" else await async_verify_mastodon_credentials(client)
+
+
+#====================BASE: GET RATE LIMIT KEYS====================#
+def get_ratelimit_keys(account_client):
+    account_id = account_client.get("account_id")
+    host = account_client.get("host")
+    # budgets are shared per instance and per account
+    return account_client.get("domain") or host, account_id
+
+
+#====================BASE: GET CLIENT RATE LIMIT====================#
+def get_client_ratelimit(account_client):
+    client = account_client.get("client")
+    host = account_client.get("host")
+    return get_bluesky_ratelimit(client) if host and host.lower() == "bluesky" else get_mastodon_ratelimit(client)
+
+
+#====================BASE: SEND ACCOUNT POST====================#
+def send_account_post(account_client, **kwargs):
+    bluesky_post = kwargs.get("bluesky_post")
+    limiter = kwargs.get("limiter")
+    mastodon_post = kwargs.get("mastodon_post")
+    post_id = kwargs.get("post_id")
+    receiver = kwargs.get("receiver")
+    visibility = kwargs.get("visibility")
+    client = account_client.get("client")
+    host = account_client.get("host")
+
+    # wait for the rate limit budget or defer the post if it has run dry
+    if limiter:
+        limiter.acquire(*get_ratelimit_keys(account_client))
+
+    try:
+        if host and host.lower() == "bluesky":
+            return send_bluesky_post(
+                bluesky_post,
+                bluesky=client,
+                post_id=post_id,
+                receiver=receiver,
+            )
+        return send_mastodon_post(
+            mastodon_post,
+            mastodon=client,
+            post_id=post_id,
+            receiver=receiver,
+            visibility=visibility,
+        )
+    finally:
+        # learn the rate limit budget reported by the server
+        if limiter:
+            limiter.learn(*get_ratelimit_keys(account_client), get_client_ratelimit(account_client))
+
+
+#====================BASE: ASYNC SEND ACCOUNT POST====================#
+async def async_send_account_post(account_client, **kwargs):
+    bluesky_post = kwargs.get("bluesky_post")
+    limiter = kwargs.get("limiter")
+    mastodon_post = kwargs.get("mastodon_post")
+    post_id = kwargs.get("post_id")
+    receiver = kwargs.get("receiver")
+    session = kwargs.get("session")
+    visibility = kwargs.get("visibility")
+    client = account_client.get("client")
+    host = account_client.get("host")
+
+    # wait for the rate limit budget or defer the post if it has run dry
+    if limiter:
+        await limiter.async_acquire(*get_ratelimit_keys(account_client))
+
+    try:
+        if host and host.lower() == "bluesky":
+            return await async_send_bluesky_post(
+                bluesky_post,
+                bluesky=client,
+                post_id=post_id,
+                receiver=receiver,
+                session=session,
+            )
+        return await async_send_mastodon_post(
+            mastodon_post,
+            mastodon=client,
+            post_id=post_id,
+            receiver=receiver,
+            visibility=visibility,
+        )
+    finally:
+        # learn the rate limit budget reported by the server
+        if limiter:
+            limiter.learn(*get_ratelimit_keys(account_client), get_client_ratelimit(account_client))
+
+
+#====================BASE: RUN TASK====================#
+def run_task(task):
+    func, args, params = task
+    # return the result and exception of a single task
+    try:
+        return func(*args, **params), None
+    except Exception as e:
+        return None, e
+
+
+#====================BASE: RUN TASKS====================#
+def run_tasks(tasks, **kwargs):
+    executor = kwargs.get("executor")
+    # run tasks one after another if there is no worker pool
+    if not executor:
+        return [run_task(task) for task in tasks]
+    # run tasks concurrently and return their outcomes in the order they were submitted
+    return [future.result() for future in [executor.submit(run_task, task) for task in tasks]]
+
+
+#====================BASE: ASYNC RUN TASKS====================#
+async def async_run_tasks(tasks, **kwargs):
+    semaphore = kwargs.get("semaphore")
+
+    # return the result and exception of a single task
+    async def run_task(task):
+        func, args, params = task
+        try:
+            async with semaphore if semaphore else nullcontext():
+                return await func(*args, **params), None
+        except Exception as e:
+            return None, e
+
+    # run tasks concurrently and return their outcomes in the order they were submitted
+    return await asyncio.gather(*[run_task(task) for task in tasks])
+
+
+#====================BASE: GET POST COUNT====================#
+def get_post_count(limit, organic):
     # set count of posts to be sent
     limit = limit if limit > 0 else 100
     if organic:
         minimum = limit / 3
         minimum = math.ceil(minimum) if minimum % 1 != 0 else int(minimum)
-        count = random.randint(minimum, limit)
-    else:
-        count = limit
+        return random.randint(minimum, limit)
+    return limit
 
-    # limit pending objects to count for supported databases
-    if DB_TYPE == "postgresql":
-        pending_objects = pending_objects[:count]
-    # combine pending and updating objects
-    post_objects = pending_objects | updating_objects
 
-    if not post_objects.exists():
-        if is_debug():
-            log_message = message("LOG_EVENT", event="No pending post objects were found")
-            logger.info(log_message)
-        return
+#====================BASE: POST FIELDS====================#
+# schedule and subject fields required to render and record a post
+POST_FIELDS = (
+    "receiver",
+    "visibility",
+    "subject__link",
+    "subject__tags",
+    "subject__title",
+)
+
+
+#====================BASE: GET POST QUERYSET====================#
+def get_post_queryset(post_objects):
+    # load objects with only the fields of their subjects that are needed
+    return post_objects.select_related("subject").only(*POST_FIELDS)
+
+
+#====================BASE: GET POST OBJECTS====================#
+def get_post_objects(pending_objects, updating_objects, count):
+    with timer("load"):
+        # load the next count pending objects and all updating objects
+        post_objects = list(get_post_queryset(pending_objects)[:count]) + list(get_post_queryset(updating_objects))
+        # load the deliveries of all objects at once
+        prefetch_related_objects(post_objects, Prefetch(
+            "subject__%s_set" % DeliveryModel.__name__.lower(),
+            queryset=DeliveryModel.objects.only("subject", "account_id", "remote_id"),
+            to_attr="deliveries",
+        ))
+    return post_objects
+
+
+#====================BASE: GET QUEUE DEPTH====================#
+def get_queue_depth(schedule_objects, pending_query):
+    # count pending and updating objects in a single query
+    return schedule_objects.order_by().aggregate(
+        pending=Count("pk", filter=pending_query),
+        updating=Count("pk", filter=~pending_query),
+    )
 
-    # instantiate all clients
-    for account in account_objects:
-        access_token = getattr(account, "access_token", None)
-        api_base_url = getattr(account, "api_base_url", None)
-        api_domain = get_domain(api_base_url)
-        host = getattr(account, "host", None)
-        uid = getattr(account, "uid", None)
-        # format a unique account id
-        account_id = "%s%s%s" % (uid, "." if host and host.lower() == "bluesky" else "@", api_domain) if api_domain and uid else None
-        client = instantiate_bluesky(access_token, account_id) if host and host.lower() == "bluesky" else instantiate_mastodon(access_token, api_base_url)
-        # abort if client instantiation failed
-        if not client:
-            verbose_error = 'Client "%s" has failed to be instantiated' % account_id
-            log_error = message("LOG_EXCEPT", exception=None, verbose=verbose_error, object=account.pk)
-            logger.error(log_error)
-            continue
-        clients[account.pk] = dict(account_id=account_id, client=client, host=host)
 
-    for post_object in post_objects:
-        delete = True
+#====================BASE: GET QUEUE STATUS====================#
+def get_queue_status(schedule_objects, pending_query, delivery_objects):
+    status = get_queue_depth(schedule_objects, pending_query)
+    # the oldest pending object shows how far behind sending posts is, and the last delivery when anything was last sent
+    status.update(schedule_objects.order_by().filter(pending_query).aggregate(oldest_pending=Min("date_scheduled")))
+    status.update(delivery_objects.order_by().aggregate(last_sent=Max("sent_at")))
+    return status
+
+
+#====================BASE: UPDATE QUEUE DEPTH====================#
+def update_queue_depth(pending_objects, updating_objects):
+    for queue, post_objects in (("pending", pending_objects), ("updating", updating_objects)):
+        QUEUE_DEPTH.set(post_objects.count(), queue=queue)
+
+
+#====================BASE: GET SUBJECT DELIVERIES====================#
+def get_subject_deliveries(subject_object):
+    # map account ids to the remote ids of posts that have already been sent to them
+    delivery_objects = getattr(subject_object, "deliveries", None)
+    if delivery_objects is None:
+        delivery_objects = DeliveryModel.objects.filter(subject=subject_object).only("account_id", "remote_id")
+    return {delivery_object.account_id: delivery_object.remote_id for delivery_object in delivery_objects}
+
+
+#====================BASE: PREPARE POST CONTENT====================#
+def prepare_post_content(post_object):
+    with timer("prepare"):
         # prepare post title, tags, and link
         post_title = emojize(post_object.subject.title)
         post_tags = emojize(" " + " ".join(["#" + sanitise_string(i) for i in post_object.subject.tags]) if post_object.subject.tags else "")
         post_link = emojize(post_object.subject.link if post_object.subject.link else "")
         bluesky_post = prepare_bluesky_post(post_title, post_tags, post_link, embed_only=True)
         mastodon_post = prepare_mastodon_post(post_title, post_tags, post_link)
+    return bluesky_post, mastodon_post
 
-        for account in account_objects:
-            if not (account_client := clients.get(account.pk, None)): continue
-            account_id = account_client.get("account_id")
-            client = account_client.get("client")
-            host = account_client.get("host")
-            # get post_id specific to account if it is an existing and format conforming post
-            account_pid = [pid.split("_")[-1] for pid in post_object.subject.post_id if pid.split("_")[0] == account_id] if post_object.subject.post_id and isinstance(post_object.subject.post_id, list) else []
-            account_pid = account_pid[0] if account_pid else None
-            try:
-                if host and host.lower() == "bluesky":
-                    post_id = send_bluesky_post(
-                        bluesky_post,
-                        # access_token=access_token,
-                        # account_id=account_id,
-                        bluesky=client,
-                        post_id=account_pid,
-                        receiver=post_object.receiver,
-                    )
-                else:
-                    post_id = send_mastodon_post(
-                        mastodon_post,
-                        # access_token=access_token,
-                        # api_base_url=api_base_url,
-                        mastodon=client,
-                        post_id=account_pid,
-                        receiver=post_object.receiver,
-                        visibility=post_object.visibility,
-                    )
-            except Exception as e:
-                # cancel mark for deletion due to error
-                delete = False
-                verbose_error = 'Post "%s" (%s) has failed to be sent' % (post_object, account_id)
-                log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=post_object)
-                logger.error(log_error)
-            else:
-                if not post_id:
-                    # cancel mark for deletion since post has not been sent on current account
-                    delete = False
-                    verbose_error = 'Post "%s" (%s) has not successfully returned an ID' % (post_object, account_id)
-                    log_error = message("LOG_EXCEPT", exception=None, verbose=verbose_error, object=post_object)
-                    logger.error(log_error)
-                    continue
-                pid = "%s_%s" % (account_id, post_id)
-                # update subject object post_id if new or non-format conforming post
-                if not account_pid:
-                    if not isinstance(post_object.subject.post_id, list):
-                        post_object.subject.post_id = list()
-                    post_object.subject.post_id.append(pid)
-                    post_object.subject.save(update_fields=["post_id"])
-                log_message = message("LOG_EVENT", event='Post "%s" (%s) has been sent' % (post_object, pid))
-                logger.info(log_message)
-                # cancel mark for deletion if post has not been sent on an account
-                # NOTE: check for account_id instead as pid changes with every quote post for bluesky due to absence of real post updates
-                # if not pid in post_object.subject.post_id:
-                if not any(account_id in i for i in post_object.subject.post_id):
-                    delete = False
-        # delete post schedule object if it has been sent successfully on all accounts or if configured to not retry
-        if delete or not retry_post:
+
+#====================BASE: GET CONTENT HASH====================#
+def get_content_hash(content):
+    return hashlib.sha256(str(content).encode()).hexdigest()
+
+
+#====================BASE: PREPARE DELIVERIES====================#
+def prepare_deliveries(post_object, account_objects, clients, send_func, **kwargs):
+    # prepare a send task for each account
+    bluesky_post, mastodon_post = prepare_post_content(post_object)
+    subject_deliveries = get_subject_deliveries(post_object.subject)
+    deliveries = []
+    for account in account_objects:
+        if not (account_client := clients.get(account.pk, None)):
+            POSTS.inc(outcome="skipped")
+            continue
+        account_id = account_client.get("account_id")
+        host = account_client.get("host")
+        # get post_id specific to account if it has already been sent to it
+        account_pid = subject_deliveries.get(account_id)
+        content = bluesky_post if host and host.lower() == "bluesky" else mastodon_post
+        params = dict(
+            bluesky_post=bluesky_post,
+            mastodon_post=mastodon_post,
+            post_id=account_pid,
+            receiver=post_object.receiver,
+            visibility=post_object.visibility,
+            **kwargs
+        )
+        deliveries.append((account_id, account_pid, get_content_hash(content), (send_func, (account_client,), params)))
+    return deliveries
+
+
+#====================BASE: GET ACCOUNT LANES====================#
+def get_account_lanes(post_deliveries):
+    lanes = dict()
+    # group the send tasks of every post by account, keeping the posts of each account in the order they are to be sent
+    for i, deliveries in enumerate(post_deliveries):
+        for j, (account_id, *_, task) in enumerate(deliveries):
+            lanes.setdefault(account_id, []).append(((i, j), task))
+    return list(lanes.values())
+
+
+#====================BASE: RUN LANE====================#
+def run_lane(lane, results):
+    deferred = None
+    for key, task in lane:
+        # defer the rest of the posts of an account once its rate limit budget has run dry so that they are not sent out of order
+        outcome = (None, deferred) if deferred else run_task(task)
+        if isinstance(outcome[1], RateLimitDeferred):
+            deferred = outcome[1]
+        results[key].set_result(outcome)
+
+
+#====================BASE: ASYNC RUN LANE====================#
+async def async_run_lane(lane, results, **kwargs):
+    semaphore = kwargs.get("semaphore")
+    deferred = None
+    for key, task in lane:
+        # defer the rest of the posts of an account once its rate limit budget has run dry so that they are not sent out of order
+        outcome = (None, deferred) if deferred else (await async_run_tasks([task], semaphore=semaphore))[0]
+        if isinstance(outcome[1], RateLimitDeferred):
+            deferred = outcome[1]
+        results[key].set_result(outcome)
+
+
+#====================BASE: RECORD DELIVERIES====================#
+def record_deliveries(post_object, deliveries, results, **kwargs):
+    buffer = kwargs.get("buffer")
+    retry_post = kwargs.get("retry_post", RETRY_POST)
+    delete = True
+    deferred = False
+    outcomes = Counter()
+    pids = []
+
+    for (account_id, account_pid, content_hash, _), (post_id, e) in zip(deliveries, results):
+        if isinstance(e, RateLimitDeferred):
+            # keep post schedule object for the next run without counting it as a failed attempt
+            delete = False
+            deferred = True
+            POSTS.inc(outcome="deferred")
+            outcomes["deferred"] += 1
+            log_event(logger, 'Post "%s" (%s) has been deferred as its rate limit budget has run dry', post_object, account_id)
+            continue
+        if e:
+            # cancel mark for deletion due to error
+            delete = False
+            POSTS.inc(outcome="failed")
+            outcomes["failed"] += 1
+            log_except(logger, 'Post "%s" (%s) has failed to be sent', post_object, account_id, exception=e, object=post_object)
+            continue
+        if not post_id:
+            # cancel mark for deletion since post has not been sent on current account
+            delete = False
+            POSTS.inc(outcome="failed")
+            outcomes["failed"] += 1
+            log_except(logger, 'Post "%s" (%s) has not successfully returned an ID', post_object, account_id, object=post_object)
+            continue
+        pid = "%s_%s" % (account_id, post_id)
+        pids.append(pid)
+        POSTS.inc(outcome="sent")
+        outcomes["sent"] += 1
+        # record delivery to the account, keeping the ID of the original post as it changes with every quote post for bluesky
+        delivery_object = DeliveryModel(subject_id=post_object.subject_id, account_id=account_id, remote_id=account_pid or post_id, content_hash=content_hash, sent_at=timezone.now())
+        if buffer is not None:
+            buffer.save_delivery(delivery_object)
+        else:
+            with timer("db_write"):
+                save_deliveries([delivery_object])
+        log_event(logger, 'Post "%s" (%s) has been sent', post_object, pid)
+    # delete post schedule object if it has been sent successfully on all accounts or if configured to not retry
+    if delete or not (retry_post or deferred):
+        # build the message before the post schedule object is deleted, but only if it is going to be logged
+        log_message = None
+        if logger.isEnabledFor(logging.INFO):
             if delete:
-                verbose_event = 'Post Schedule "%s" which has been sent successfully to "%s" has been deleted' % (post_object, string_list(post_object.subject.post_id))
+                log_message = event_message('Post Schedule "%s" which has been sent successfully to "%s" has been deleted', post_object, pids)
             else:
-                verbose_event = 'Post Schedule "%s" has been deleted' % post_object
-            post_object.delete()
-            log_message = message("LOG_EVENT", event=verbose_event)
-            logger.info(log_message)
+                log_message = event_message('Post Schedule "%s" has been deleted', post_object)
+        if buffer is not None:
+            buffer.delete_schedule(post_object, log_message)
+            return outcomes
+        post_object.delete()
+        if log_message:
+            log(logger, logging.INFO, log_message)
+    return outcomes
+
+
+#====================BASE: POST SCHEDULER====================#
+def post_scheduler(pending_objects, updating_objects, **kwargs):
+    account_objects = kwargs.get("account_objects", get_active_accounts())
+    clients = kwargs.get("clients", {})
+    engine = kwargs.get("engine", POST_ENGINE)
+    limit = kwargs.get("limit", POST_LIMIT)
+    limiter = kwargs.get("limiter", RATE_LIMITER)
+    organic = kwargs.get("organic", ORGANIC_POSTS)
+    retry_post = kwargs.get("retry_post", RETRY_POST)
+    workers = kwargs.get("workers", POST_WORKERS)
+    # count the outcome of every delivery so that callers can tell whether the run has sent anything
+    outcomes = Counter()
+
+    # hand over to the asyncio delivery engine if configured to do so
+    if engine == "async":
+        return run_sync(async_post_scheduler(pending_objects, updating_objects, **kwargs))
+
+    account_objects = list(account_objects)
+
+    if not account_objects:
+        if is_debug():
+            log_event(logger, "No active account objects were found")
+        return outcomes
+
+    update_queue_depth(pending_objects, updating_objects)
+    post_objects = get_post_objects(pending_objects, updating_objects, get_post_count(limit, organic))
+
+    if not post_objects:
+        if is_debug():
+            log_event(logger, "No pending post objects were found")
+        return outcomes
+
+    # share a bounded worker pool between all accounts
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # instantiate all clients
+        uninstantiated_accounts = [account for account in account_objects if account.pk not in clients]
+        instantiated_clients = run_tasks([(instantiate_client, (account,), {}) for account in uninstantiated_accounts], executor=executor)
+        for account, (account_client, e) in zip(uninstantiated_accounts, instantiated_clients):
+            # abort if client instantiation failed
+            if not (account_client and account_client.get("client")):
+                account_id = account_client.get("account_id") if account_client else None
+                log_except(logger, 'Client "%s" has failed to be instantiated', account_id, exception=e, object=account.pk)
+                # the posts of an account without a client cannot be sent either
+                outcomes["failed"] += 1
+                continue
+            clients[account.pk] = account_client
+
+        post_deliveries = [prepare_deliveries(post_object, account_objects, clients, send_account_post, limiter=limiter) for post_object in post_objects]
+        results = {(i, j): Future() for i, deliveries in enumerate(post_deliveries) for j in range(len(deliveries))}
+        # send the posts of each account one after another while accounts take turns on the worker pool
+        for lane in get_account_lanes(post_deliveries):
+            executor.submit(run_lane, lane, results)
+
+        # collect deliveries and schedule deletions to write them in batches
+        buffer = DeliveryBuffer()
+        try:
+            # record each post once it has been sent to all accounts
+            for i, (post_object, deliveries) in enumerate(zip(post_objects, post_deliveries)):
+                post_results = [results[(i, j)].result() for j in range(len(deliveries))]
+                outcomes.update(record_deliveries(post_object, deliveries, post_results, buffer=buffer, retry_post=retry_post))
+        finally:
+            buffer.flush()
+    return outcomes
+
+
+#====================BASE: ASYNC POST SCHEDULER====================#
+async def async_post_scheduler(pending_objects, updating_objects, **kwargs):
+    account_objects = kwargs.get("account_objects", get_active_accounts())
+    clients = kwargs.get("clients", {})
+    limit = kwargs.get("limit", POST_LIMIT)
+    limiter = kwargs.get("limiter", RATE_LIMITER)
+    organic = kwargs.get("organic", ORGANIC_POSTS)
+    retry_post = kwargs.get("retry_post", RETRY_POST)
+    workers = kwargs.get("workers", POST_WORKERS)
+    # count the outcome of every delivery so that callers can tell whether the run has sent anything
+    outcomes = Counter()
+
+    # evaluate querysets outside of the event loop
+    account_objects = await database_sync_to_async(list)(account_objects)
+
+    if not account_objects:
+        if is_debug():
+            log_event(logger, "No active account objects were found")
+        return outcomes
+
+    await database_sync_to_async(update_queue_depth)(pending_objects, updating_objects)
+    post_objects = await database_sync_to_async(get_post_objects)(pending_objects, updating_objects, get_post_count(limit, organic))
+
+    if not post_objects:
+        if is_debug():
+            log_event(logger, "No pending post objects were found")
+        return outcomes
+
+    # bound the number of requests in flight
+    semaphore = asyncio.Semaphore(max(workers, 1))
+    instantiated_pks = []
+    lane_tasks = []
+    # collect deliveries and schedule deletions to write them in batches
+    buffer = DeliveryBuffer()
+
+    try:
+        # instantiate all clients
+        uninstantiated_accounts = [account for account in account_objects if account.pk not in clients]
+        instantiated_clients = await async_run_tasks([(async_instantiate_client, (account,), {}) for account in uninstantiated_accounts], semaphore=semaphore)
+        for account, (account_client, e) in zip(uninstantiated_accounts, instantiated_clients):
+            # abort if client instantiation failed
+            if not (account_client and account_client.get("client")):
+                account_id = account_client.get("account_id") if account_client else None
+                log_except(logger, 'Client "%s" has failed to be instantiated', account_id, exception=e, object=account.pk)
+                # the posts of an account without a client cannot be sent either
+                outcomes["failed"] += 1
+                continue
+            clients[account.pk] = account_client
+            instantiated_pks.append(account.pk)
+
+        async with httpx.AsyncClient(follow_redirects=True) as session:
+            post_deliveries = [prepare_deliveries(post_object, account_objects, clients, async_send_account_post, limiter=limiter, session=session) for post_object in post_objects]
+            loop = asyncio.get_running_loop()
+            results = {(i, j): loop.create_future() for i, deliveries in enumerate(post_deliveries) for j in range(len(deliveries))}
+            # send the posts of each account one after another while accounts take turns within the bound of the semaphore
+            lane_tasks = [asyncio.create_task(async_run_lane(lane, results, semaphore=semaphore)) for lane in get_account_lanes(post_deliveries)]
+            # record each post once it has been sent to all accounts
+            for i, (post_object, deliveries) in enumerate(zip(post_objects, post_deliveries)):
+                post_results = [await results[(i, j)] for j in range(len(deliveries))]
+                outcomes.update(await database_sync_to_async(record_deliveries)(post_object, deliveries, post_results, buffer=buffer, retry_post=retry_post))
+    finally:
+        for task in lane_tasks:
+            task.cancel()
+        await asyncio.gather(*lane_tasks, return_exceptions=True)
+        await database_sync_to_async(buffer.flush)()
+        # close clients that were opened by this run
+        for pk in instantiated_pks:
+            await async_close_client(clients.pop(pk))
+    return outcomes
@@ -8,10 +8,14 @@ from base.methods import (
     get_post_model,
     get_schedule_model,
     is_expired,
-    message,
+)
+from base.logs import (
+    log_event,
+    log_except,
 )
 from lib.bluesky import update_account as update_bluesky_account
 from lib.mastodon import update_account as update_mastodon_account
+from lib.post import get_ingested_objects
 from lib.scheduler import schedule_post
 logger = logging.getLogger("base")
 AccountModel = get_account_model()
@@ -27,20 +31,24 @@ POST_EXPIRY = getattr(settings, "POST_EXPIRY")
 #====================POST: SCHEDULE POSTS====================#
 @receiver(post_save, sender=PostModel)
 def schedule_posts(sender, instance, created, **kwargs):
+    expired = is_expired(getattr(instance, POST_DATE), POST_EXPIRY)
+    # defer scheduling of objects that have not expired to the end of a bulk ingest
+    if (ingested_objects := get_ingested_objects()) is not None:
+        if not expired:
+            ingested_objects.append(instance.pk)
+        return
     schedule_related_name = "%s_set" % ScheduleModel.__name__.lower()
-    schedule_obj = getattr(instance, schedule_related_name)
+    # fetch the pk of any existing schedule object in the same query that checks for it
+    schedule_pk = getattr(instance, schedule_related_name).values_list("pk", flat=True).first()
     # schedule object if it has neither been scheduled nor past expiry date
-    if not schedule_obj.exists():
-        if not is_expired(getattr(instance, POST_DATE), POST_EXPIRY):
-            log_message = message("LOG_EVENT", event='Scheduling %s object "%s"' % (PostModel.__name__, instance))
-            logger.info(log_message)
+    if schedule_pk is None:
+        if not expired:
+            log_event(logger, 'Scheduling %s object "%s"', PostModel.__name__, instance)
             schedule_post(instance)
         else:
-            log_message = message("LOG_EVENT", event='%s object "%s" has expired' % (PostModel.__name__, instance))
-            logger.info(log_message)
+            log_event(logger, '%s object "%s" has expired', PostModel.__name__, instance)
     else:
-        log_message = message("LOG_EVENT", event='%s object "%s" already has a %s object "%s"' % (PostModel.__name__, instance, ScheduleModel.__name__, schedule_obj.first().pk))
-        logger.info(log_message)
+        log_event(logger, '%s object "%s" already has a %s object "%s"', PostModel.__name__, instance, ScheduleModel.__name__, schedule_pk)
 
 
 #====================ACCOUNT: UPDATE ACCOUNTS====================#
@@ -69,6 +77,4 @@ def update_accounts(sender, instance, created, **kwargs):
         ))
         account = update_mastodon_account(**params)
     if not account:
-        verbose_warning = 'Account "%s" failed to be updated' % instance.pk
-        log_message = message("LOG_EXCEPT", exception=None, verbose=verbose_warning, object=instance)
-        logger.warning(log_message)
+        log_except(logger, 'Account "%s" failed to be updated', instance.pk, object=instance, level=logging.WARNING)
@@ -0,0 +1,458 @@
+import httpx
+import io
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from unittest import mock
+from django.conf import settings
+from django.db import connection
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+)
+from django.test.utils import CaptureQueriesContext
+from base.methods import (
+    JSONStream,
+    bulk_dicts_to_models,
+    database_sync_to_async,
+    get_account_model,
+    get_delivery_model,
+    get_expired_date,
+    get_feed_model,
+    get_post_model,
+    get_schedule_model,
+    run_sync,
+    sync_data,
+)
+from base.ratelimit import (
+    RateLimitDeferred,
+    RateLimiter,
+    TokenBucket,
+    parse_ratelimit,
+)
+from base.scheduler import (
+    DeliveryBuffer,
+    async_run_tasks,
+    async_send_account_post,
+    post_scheduler,
+    record_deliveries,
+    save_deliveries,
+)
+from lib.benchmark import RateLimitedServer
+from lib.mastodon import (
+    async_close as async_close_mastodon,
+    async_instantiate as async_instantiate_mastodon,
+)
+from lib.post import bulk_ingest
+from lib.scheduler import get_schedule_objects
+AccountModel = get_account_model()
+DeliveryModel = get_delivery_model()
+FeedModel = get_feed_model()
+PostModel = get_post_model()
+ScheduleModel = get_schedule_model()
+
+
+#====================SETTINGS: GETATTR====================#
+POST_EXPIRY = getattr(settings, "POST_EXPIRY")
+
+
+#====================TESTS: FAKE TIME====================#
+class FakeTime:
+    def __init__(self, now=1700000000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+#====================TESTS: JSON STREAM====================#
+class JSONStreamTests(SimpleTestCase):
+    def test_values_across_reads(self):
+        data = [[], {"a\\\"": ["}", "]"]}, -2.5e10, 123, True, None, "x" * 20]
+        text = json.dumps({"skip": ['"]}' * 10], "items": data})
+        for read_size in range(1, len(text) + 1):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(list(JSONStream(io.StringIO(json.dumps(data)), read_size=read_size).iter_array()), data)
+                self.assertEqual(list(JSONStream(io.StringIO(text), read_size=read_size).iter_key("items")), data)
+
+    def test_large_value_is_decoded_once(self):
+        text = json.dumps({"skip": ["y" * 100] * 1000, "items": [1, 2]})
+        stream = JSONStream(io.StringIO(text), read_size=1024)
+        with mock.patch.object(stream.decoder, "raw_decode", wraps=stream.decoder.raw_decode) as raw_decode:
+            self.assertEqual(list(stream.iter_key("items")), [1, 2])
+        # the incomplete value is tried once within the first read and decoded once it has been read in full
+        starts = [(c.args + (0,))[1] for c in raw_decode.call_args_list]
+        self.assertEqual(len([c for c, start in zip(raw_decode.call_args_list, starts) if c.args[0].startswith('["y', start)]), 2)
+
+    def test_incomplete_value(self):
+        for text in ("[1,", '["abc', "[{]"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(JSONStream(io.StringIO(text), read_size=2).iter_array())
+
+
+#====================TESTS: PARSE RATE LIMIT====================#
+class ParseRateLimitTests(SimpleTestCase):
+    def test_mastodon_headers(self):
+        headers = httpx.Headers({
+            "X-RateLimit-Limit": "300",
+            "X-RateLimit-Remaining": "299",
+            "X-RateLimit-Reset": "2024-01-01T00:05:00.000Z",
+        })
+        self.assertEqual(parse_ratelimit(headers), dict(limit=300, remaining=299, reset=1704067500.0))
+
+    def test_ietf_headers_with_seconds_until_reset(self):
+        with mock.patch("base.ratelimit.time", FakeTime()):
+            ratelimit = parse_ratelimit({"ratelimit-limit": "100", "ratelimit-remaining": "0", "ratelimit-reset": "60"})
+        self.assertEqual(ratelimit, dict(limit=100, remaining=0, reset=1700000060.0))
+
+    def test_epoch_reset(self):
+        ratelimit = parse_ratelimit({"ratelimit-remaining": "5", "ratelimit-reset": "1700000060"})
+        self.assertEqual(ratelimit, dict(limit=None, remaining=5, reset=1700000060.0))
+
+    def test_missing_or_invalid_headers(self):
+        self.assertIsNone(parse_ratelimit(None))
+        self.assertIsNone(parse_ratelimit({}))
+        self.assertIsNone(parse_ratelimit({"x-ratelimit-limit": "300"}))
+        self.assertIsNone(parse_ratelimit({"x-ratelimit-remaining": "many"}))
+
+    def test_invalid_reset(self):
+        self.assertEqual(parse_ratelimit({"x-ratelimit-remaining": "1", "x-ratelimit-reset": "soon"}), dict(limit=None, remaining=1, reset=None))
+
+
+#====================TESTS: TOKEN BUCKET====================#
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("base.ratelimit.time", FakeTime())
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(capacity=2, rate=1)
+        self.assertEqual(bucket.reserve(10), 0)
+        self.assertEqual(bucket.reserve(10), 0)
+        # the third token is only refilled after a second
+        self.assertEqual(bucket.reserve(10), 1)
+        # a wait beyond the maximum takes no token
+        self.assertIsNone(bucket.reserve(1.5))
+        self.assertEqual(bucket.tokens, -1)
+
+    def test_refill(self):
+        bucket = TokenBucket(capacity=2, rate=1)
+        bucket.reserve(0)
+        bucket.reserve(0)
+        self.time.advance(5)
+        # tokens never exceed the capacity
+        self.assertEqual(bucket.reserve(0), 0)
+        self.assertEqual(bucket.tokens, 1)
+
+    def test_refund(self):
+        bucket = TokenBucket(capacity=1, rate=1)
+        bucket.reserve(0)
+        bucket.refund()
+        self.assertEqual(bucket.reserve(0), 0)
+
+    def test_learn_capacity_and_remaining(self):
+        bucket = TokenBucket(capacity=10, rate=1)
+        bucket.learn(dict(limit=5, remaining=3, reset=None))
+        self.assertEqual(bucket.capacity, 5)
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_learn_spreads_remaining_budget(self):
+        bucket = TokenBucket(capacity=10, rate=1)
+        bucket.learn(dict(limit=300, remaining=5, reset=self.time.time() + 50))
+        self.assertEqual(bucket.rate, 0.1)
+        # the default rate applies again once the window has ended
+        self.time.advance(50)
+        bucket.reserve(0)
+        self.assertEqual(bucket.rate, 1)
+
+    def test_learn_exhausted_budget_blocks_until_reset(self):
+        bucket = TokenBucket(capacity=2, rate=1)
+        bucket.learn(dict(limit=300, remaining=0, reset=self.time.time() + 30))
+        self.assertTrue(bucket.is_blocked())
+        self.assertIsNone(bucket.reserve(10))
+        self.assertEqual(bucket.reserve(30), 30)
+        self.time.advance(30)
+        self.assertFalse(bucket.is_blocked())
+
+
+#====================TESTS: RATE LIMITER====================#
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("base.ratelimit.time", FakeTime())
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_limiter(self, **kwargs):
+        params = dict(burst=2, host_burst=10, host_rate=1, max_wait=5, rate=1)
+        params.update(kwargs)
+        return RateLimiter(**params)
+
+    def test_reserve_returns_longest_delay(self):
+        limiter = self.get_limiter(burst=1)
+        self.assertEqual(limiter.reserve("host", "account"), 0)
+        self.assertEqual(limiter.reserve("host", "account"), 1)
+
+    def test_deferred_when_account_budget_runs_dry(self):
+        limiter = self.get_limiter(burst=1, rate=0.1)
+        limiter.reserve("host", "account")
+        with self.assertRaises(RateLimitDeferred):
+            limiter.reserve("host", "account")
+        # the instance token taken before deferring is given back
+        host_bucket, _ = limiter.get_buckets("host", "account")
+        self.assertEqual(host_bucket.tokens, 9)
+
+    def test_accounts_have_separate_budgets(self):
+        limiter = self.get_limiter(burst=1, rate=0.1)
+        limiter.reserve("host", "account")
+        self.assertEqual(limiter.reserve("host", "other"), 0)
+
+    def test_learn_applies_to_host_and_account(self):
+        limiter = self.get_limiter()
+        limiter.learn("host", "account", dict(limit=300, remaining=0, reset=self.time.time() + 60))
+        host_bucket, account_bucket = limiter.get_buckets("host", "account")
+        self.assertTrue(host_bucket.is_blocked())
+        self.assertTrue(account_bucket.is_blocked())
+        with self.assertRaises(RateLimitDeferred):
+            limiter.reserve("host", "other")
+
+    def test_learn_ignores_missing_budget(self):
+        limiter = self.get_limiter()
+        limiter.learn("host", "account", None)
+        self.assertEqual(limiter.buckets, dict())
+
+    def test_check_defers_blocked_budget(self):
+        limiter = self.get_limiter()
+        limiter.check("host", "account")
+        limiter.learn("host", "account", dict(limit=None, remaining=0, reset=self.time.time() + 60))
+        with self.assertRaises(RateLimitDeferred):
+            limiter.check("host", "account")
+
+
+#====================TESTS: RATE LIMITED SERVER====================#
+class RateLimitedServerTests(SimpleTestCase):
+    def send_posts(self, url, limiter, **kwargs):
+        accounts = kwargs.get("accounts", 2)
+        posts = kwargs.get("posts", 6)
+
+        # send all posts of every account at once through the limiter
+        async def send():
+            clients = [dict(account_id="u%s@stub" % i, client=await async_instantiate_mastodon("token-%s" % i, url), domain="stub", host="mastodon") for i in range(accounts)]
+            try:
+                tasks = [(async_send_account_post, (account_client,), dict(limiter=limiter, mastodon_post="post %s" % i)) for i in range(posts) for account_client in clients]
+                return await async_run_tasks(tasks)
+            finally:
+                for account_client in clients:
+                    await async_close_mastodon(account_client["client"])
+
+        return run_sync(send())
+
+    def test_limiter_keeps_posts_within_server_limits(self):
+        limiter = RateLimiter(burst=3, host_burst=100, host_rate=100, max_wait=0.5, rate=1)
+        with RateLimitedServer(limit=3, window=60) as server:
+            results = self.send_posts(server.url, limiter)
+        self.assertEqual(server.rejected, 0)
+        # posts that would exceed the budget are deferred rather than sent
+        self.assertEqual(sum(1 for result, _ in results if result), 6)
+        self.assertEqual(sum(1 for _, e in results if isinstance(e, RateLimitDeferred)), 6)
+
+    def test_server_rejects_posts_without_limiter(self):
+        with RateLimitedServer(limit=3, window=60) as server:
+            results = self.send_posts(server.url, None)
+        self.assertEqual(server.rejected, 6)
+        self.assertEqual(sum(1 for _, e in results if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429), 6)
+
+
+#====================TESTS: DELIVERY BUFFER====================#
+class DeliveryBufferTests(TestCase):
+    def setUp(self):
+        PostModel.objects.bulk_create([PostModel(item_id=str(i), title="post %s" % i, link="https://example.com/%s" % i) for i in range(10)])
+        ScheduleModel.objects.bulk_create([ScheduleModel(subject=subject) for subject in PostModel.objects.all()])
+        self.schedule_objects = list(ScheduleModel.objects.order_by("pk"))
+        self.accounts = ["account_%s@example.com" % i for i in range(4)]
+
+    def get_queries(self, queries, statement, table):
+        return [query["sql"] for query in queries if query["sql"].startswith(statement) and table in query["sql"]]
+
+    def record(self, buffer):
+        for schedule_object in self.schedule_objects:
+            deliveries = [(account_id, None, "hash", None) for account_id in self.accounts]
+            results = [("%s_%s" % (schedule_object.pk, n), None) for n in range(len(self.accounts))]
+            record_deliveries(schedule_object, deliveries, results, buffer=buffer)
+
+    def test_empty_buffer_collects_writes(self):
+        buffer = DeliveryBuffer(flush_interval=3600, flush_size=1000)
+        # nothing is written until the buffer is flushed, even though it starts out empty
+        with self.assertNumQueries(0):
+            self.record(buffer)
+        self.assertEqual(len(buffer), len(self.schedule_objects) * (len(self.accounts) + 1))
+
+    def test_flush_writes_in_batches(self):
+        buffer = DeliveryBuffer(flush_interval=3600, flush_size=1000)
+        self.record(buffer)
+        with CaptureQueriesContext(connection) as queries:
+            buffer.flush()
+        # one upsert of every delivery and one deletion of every sent schedule object
+        self.assertEqual(len(self.get_queries(queries, "INSERT", DeliveryModel._meta.db_table)), 1)
+        self.assertEqual(len(self.get_queries(queries, "DELETE", ScheduleModel._meta.db_table)), 1)
+        self.assertEqual(DeliveryModel.objects.count(), len(self.schedule_objects) * len(self.accounts))
+        self.assertFalse(ScheduleModel.objects.exists())
+        self.assertEqual(len(buffer), 0)
+
+
+#====================TESTS: SAVE DELIVERIES====================#
+class SaveDeliveriesTests(TestCase):
+    def setUp(self):
+        self.subject = PostModel.objects.bulk_create([PostModel(item_id="1", title="post", link="https://example.com/1")])[0]
+        DeliveryModel.objects.create(subject=self.subject, account_id="account_0@example.com", remote_id="original", content_hash="old")
+
+    def save(self):
+        save_deliveries([DeliveryModel(subject=self.subject, account_id="account_%s@example.com" % i, remote_id="new", content_hash="new") for i in range(2)])
+
+    def assertSaved(self):
+        # existing deliveries keep the ID of the original post while new ones are inserted
+        self.assertEqual(dict(DeliveryModel.objects.values_list("account_id", "remote_id")), {"account_0@example.com": "original", "account_1@example.com": "new"})
+        self.assertEqual(set(DeliveryModel.objects.values_list("content_hash", flat=True)), {"new"})
+
+    def test_bulk_upsert(self):
+        with self.assertNumQueries(1):
+            self.save()
+        self.assertSaved()
+
+    def test_upsert_without_bulk_conflicts(self):
+        with mock.patch.object(connection.features, "supports_update_conflicts", False):
+            self.save()
+        self.assertSaved()
+
+
+#====================TESTS: SYNC DATA====================#
+class SyncDataTests(TestCase):
+    def sync(self, records, **kwargs):
+        with tempfile.TemporaryDirectory() as directory:
+            data = os.path.join(directory, "feeds.json")
+            with open(data, "w") as f:
+                json.dump(dict(feeds=records), f)
+            return sync_data(dict(feeds=dict(model=FeedModel._meta.label, data=data, object_id=("uid",))), incremental=False, **kwargs).get("feeds")
+
+    def test_paths_return_same_counts(self):
+        for bulk in (True, False):
+            with self.subTest(bulk=bulk):
+                FeedModel.objects.all().delete()
+                FeedModel.objects.create(uid="0", endpoint="https://example.com/0")
+                FeedModel.objects.create(uid="1", endpoint="https://example.com/1")
+                records = [dict(uid="0", endpoint="https://example.com/0"), dict(uid="1", endpoint="https://example.com/new"), dict(uid="2", endpoint="https://example.com/2")]
+                self.assertEqual(self.sync(records, bulk=bulk), dict(created=1, updated=1, unchanged=1))
+                self.assertEqual(FeedModel.objects.get(uid="1").endpoint, "https://example.com/new")
+
+    def test_bulk_update_validates_unique(self):
+        AccountModel.objects.bulk_create([AccountModel(uid=uid, access_token=uid, api_base_url="https://example.com") for uid in ("0", "1")])
+        records = [dict(access_token="1", uid="0"), dict(access_token="0", display_name="account")]
+        with mock.patch("base.methods.post_save.send"):
+            counts = bulk_dicts_to_models(records, AccountModel, object_id=("access_token",))
+        # the update that would duplicate the UID of another account on the same instance is rejected
+        self.assertEqual(counts, dict(created=0, updated=1, unchanged=0))
+        self.assertEqual(dict(AccountModel.objects.values_list("access_token", "uid")), {"0": "0", "1": "1"})
+        self.assertEqual(AccountModel.objects.get(access_token="0").display_name, "account")
+
+
+#====================TESTS: BULK INGEST====================#
+class BulkIngestTests(TestCase):
+    def ingest(self):
+        PostModel.objects.create(item_id="expired", title="expired", link="https://example.com/expired", date_created=get_expired_date(POST_EXPIRY + 1))
+        for i in range(2):
+            PostModel.objects.create(item_id=str(i), title="post %s" % i, link="https://example.com/%s" % i)
+
+    def test_schedules_once_block_exits(self):
+        with bulk_ingest():
+            self.ingest()
+            self.assertFalse(ScheduleModel.objects.exists())
+        self.assertEqual(set(ScheduleModel.objects.values_list("subject__item_id", flat=True)), {"0", "1"})
+
+    def test_discards_objects_after_error(self):
+        with self.assertRaises(ValueError):
+            with bulk_ingest():
+                self.ingest()
+                raise ValueError
+        self.assertFalse(ScheduleModel.objects.exists())
+
+
+#====================TESTS: POST SCHEDULER====================#
+class PostSchedulerTests(TransactionTestCase):
+    def setUp(self):
+        PostModel.objects.bulk_create([PostModel(item_id=str(i), title="post %s" % i, link="https://example.com/%s" % i) for i in range(6)])
+        self.reschedule()
+        self.titles = [schedule_object.subject.title for schedule_object in get_schedule_objects()[0].select_related("subject")]
+        self.accounts = [SimpleNamespace(pk=i) for i in range(3)]
+        self.sent = defaultdict(list)
+
+    def reschedule(self):
+        # start every engine from the same queue
+        DeliveryModel.objects.all().delete()
+        ScheduleModel.objects.all().delete()
+        ScheduleModel.objects.bulk_create([ScheduleModel(subject=subject) for subject in PostModel.objects.order_by("pk")])
+
+    def get_clients(self):
+        return {account.pk: dict(account_id="account_%s@example.com" % account.pk, client=object(), domain="example.com", host="mastodon") for account in self.accounts}
+
+    def get_send(self, **kwargs):
+        deferred = kwargs.get("deferred", set())
+
+        def send(account_client, **params):
+            title = params["mastodon_post"].split("\n")[0]
+            if (account_client["account_id"], title) in deferred:
+                raise RateLimitDeferred("Rate limit budget has run dry")
+            # later posts take less time so that sending them at once would publish them in reverse
+            time.sleep(0.005 * (len(self.titles) - self.titles.index(title)))
+            self.sent[account_client["account_id"]].append(title)
+            return "%s_%s" % (account_client["account_id"], title)
+
+        async def async_send(account_client, **params):
+            return send(account_client, **params)
+
+        return send, async_send
+
+    def run_scheduler(self, engine, **kwargs):
+        send, async_send = self.get_send(**kwargs)
+        with mock.patch("base.scheduler.send_account_post", send), mock.patch("base.scheduler.async_send_account_post", async_send):
+            return post_scheduler(*get_schedule_objects(), account_objects=self.accounts, clients=self.get_clients(), engine=engine, limit=len(self.titles), limiter=None, organic=False, workers=3)
+
+    def test_posts_are_sent_in_order_per_account(self):
+        for engine in ("sync", "async"):
+            with self.subTest(engine=engine):
+                self.sent.clear()
+                outcomes = self.run_scheduler(engine)
+                self.assertEqual(outcomes["sent"], len(self.titles) * len(self.accounts))
+                self.assertEqual(dict(self.sent), {"account_%s@example.com" % account.pk: self.titles for account in self.accounts})
+                self.reschedule()
+
+    def test_deferred_post_defers_later_posts_of_account(self):
+        for engine in ("sync", "async"):
+            with self.subTest(engine=engine):
+                self.sent.clear()
+                outcomes = self.run_scheduler(engine, deferred={("account_0@example.com", self.titles[2])})
+                # the account stops at the deferred post while the others carry on
+                self.assertEqual(self.sent["account_0@example.com"], self.titles[:2])
+                self.assertEqual(self.sent["account_1@example.com"], self.titles)
+                self.assertEqual(outcomes["deferred"], len(self.titles) - 2)
+                self.assertEqual(ScheduleModel.objects.count(), len(self.titles) - 2)
+                self.reschedule()
+
+
+#====================TESTS: DATABASE SYNC TO ASYNC====================#
+class DatabaseSyncToAsyncTests(SimpleTestCase):
+    def test_closes_old_connections_around_call(self):
+        with mock.patch("base.methods.close_old_connections") as close_old_connections:
+            calls = run_sync(database_sync_to_async(lambda: close_old_connections.call_count)())
+        self.assertEqual(calls, 1)
+        self.assertEqual(close_old_connections.call_count, 2)
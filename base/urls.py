@@ -16,16 +16,17 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path
-from base.methods import check_db as _check_db
-
-
-def check_db(request):
-    return _check_db()
-
+from base.health import (
+    health_view,
+    readiness_view,
+)
+from base.metrics import metrics_view
 
 # ================= DO NOT EDIT BEYOND THIS LINE =================
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('healthz/', check_db),
+    path('healthz/', health_view),
+    path('readyz/', readiness_view),
+    path('metrics/', metrics_view),
 ]
@@ -0,0 +1,30 @@
+import json
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from lib.benchmark import (
+    PIPELINE_ROWS,
+    SUITES,
+    format_results,
+)
+
+class Command(BaseCommand):
+    help = "Runs performance benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("suites", nargs="*", choices=sorted(SUITES), help="Benchmark suites to run (default: all)")
+        parser.add_argument("--output", help="Path of a JSON file to write the results to, to compare them across commits")
+        parser.add_argument("--profile", help="Directory to dump cProfile statistics of the measured data pipeline operations to")
+        parser.add_argument("--repeat", type=int, default=5, help="Number of times each benchmark is repeated")
+        parser.add_argument("--rows", type=int, default=PIPELINE_ROWS, help="Number of rows of the generated tables, e.g. 1000000 to measure the data pipeline at scale (default: %s)" % PIPELINE_ROWS)
+        parser.add_argument("--size", type=int, default=500, help="Size of the generated corpus")
+
+    def handle(self, *args, **options):
+        report = dict(date=datetime.now().isoformat(), repeat=options["repeat"], rows=options["rows"], size=options["size"], suites=dict())
+        for name in options["suites"] or sorted(SUITES):
+            self.stdout.write(self.style.MIGRATE_HEADING("Benchmark suite: %s" % name))
+            results = SUITES[name](profile=options["profile"], repeat=options["repeat"], rows=options["rows"], size=options["size"])
+            self.stdout.write(format_results(results))
+            report["suites"][name] = results
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
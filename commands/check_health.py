@@ -1,10 +1,23 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from base.health import (
+    format_verify_results,
+    verify_accounts,
+)
+from base.metrics import MetricsCommand
 from lib.bluesky import check_health as check_bluesky_health
 from lib.mastodon import check_health as check_mastodon_health
 
-class Command(BaseCommand):
+class Command(MetricsCommand):
     help = "Checks the health of the bot by sending a test post"
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--verify", action="store_true", default=getattr(settings, "HEALTH_VERIFY"), help="Verify the credentials of all accounts concurrently instead of sending a test post")
+        parser.add_argument("--timeout", type=float, default=getattr(settings, "HEALTH_TIMEOUT"), help="Seconds to wait for all credentials to be verified")
+
     def handle(self, *args, **options):
+        if options["verify"]:
+            self.stdout.write(format_verify_results(verify_accounts(timeout=options["timeout"])))
+            return
         check_bluesky_health()
         check_mastodon_health()
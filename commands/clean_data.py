@@ -1,9 +1,9 @@
-from django.core.management.base import BaseCommand
+from base.metrics import MetricsCommand
 from base.methods import get_post_model
 from lib.post import clean_data
 PostModel = get_post_model()
 
-class Command(BaseCommand):
+class Command(MetricsCommand):
     help = "Update and clean the %s model with the latest relevant data" % PostModel.__name__
 
     def handle(self, *args, **options):
@@ -1,12 +1,23 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from base.health import (
+    format_verify_results,
+    verify_accounts,
+)
+from base.metrics import MetricsCommand
 from base.methods import sync_data
 from lib.bluesky import check_health as check_bluesky_health
 from lib.mastodon import check_health as check_mastodon_health
+from lib.scheduler import backfill_deliveries
 
-class Command(BaseCommand):
+class Command(MetricsCommand):
     help = "Entrypoint script"
 
     def handle(self, *args, **options):
         sync_data()
+        backfill_deliveries()
+        # verify credentials instead of sending a test post from every account if configured to
+        if getattr(settings, "HEALTH_VERIFY"):
+            self.stdout.write(format_verify_results(verify_accounts()))
+            return
         check_bluesky_health()
         check_mastodon_health()
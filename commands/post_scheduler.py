@@ -1,8 +1,10 @@
-from django.core.management.base import BaseCommand
+from base.metrics import MetricsCommand
 from lib.scheduler import post_scheduler
 
-class Command(BaseCommand):
+class Command(MetricsCommand):
     help = "Runs the post scheduler"
+    # the post scheduler records its last success based on the posts it has sent
+    record_success = False
 
     def handle(self, *args, **options):
         post_scheduler()
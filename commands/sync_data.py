@@ -1,8 +1,12 @@
-from django.core.management.base import BaseCommand
+from base.metrics import MetricsCommand
 from base.methods import sync_data
 
-class Command(BaseCommand):
+class Command(MetricsCommand):
     help = "Sync essential models with data from JSON files"
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--force", action="store_true", help="Sync all records even if their data files have not changed")
+
     def handle(self, *args, **options):
-        sync_data()
+        sync_data(force=options["force"])
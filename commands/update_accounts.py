@@ -1,15 +1,15 @@
 import logging
-from django.core.management.base import BaseCommand
+from base.metrics import MetricsCommand
 from base.methods import (
     get_active_accounts,
     get_domain,
-    message,
 )
+from base.logs import log_except
 from lib.bluesky import update_account as update_bluesky_account
 from lib.mastodon import update_account as update_mastodon_account
 logger = logging.getLogger("base")
 
-class Command(BaseCommand):
+class Command(MetricsCommand):
     help = "Update the profiles of all active accounts"
 
     def handle(self, *args, **options):
@@ -40,5 +40,4 @@ class Command(BaseCommand):
             if not account:
                 verbose_warning = 'Account "%s" failed to be updated' % account.pk
                 self.stdout.write(self.style.WARNING(verbose_warning))
-                log_message = message("LOG_EXCEPT", exception=None, verbose=verbose_warning, object=account)
-                logger.warning(log_message)
+                log_except(logger, verbose_warning, object=account, level=logging.WARNING)
@@ -0,0 +1,1222 @@
+import asyncio
+import base64
+import cProfile
+import emoji
+import functools
+import hashlib
+import httpx
+import json
+import logging
+import math
+import os
+import pstats
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from asgiref.sync import sync_to_async
+from collections import (
+    Counter,
+    deque,
+)
+from contextlib import contextmanager
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+from urllib.parse import (
+    parse_qs,
+    urlparse,
+)
+from django.conf import settings
+from django.db import (
+    connections,
+    transaction,
+)
+from django.db.models.signals import post_save
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    teardown_databases,
+)
+import base.scheduler as base_scheduler
+from base.methods import (
+    analyse_emoji,
+    analyse_text,
+    count_emoji,
+    demojize,
+    emojize,
+    get_account_model,
+    get_delivery_model,
+    get_post_model,
+    get_schedule_model,
+    has_emoji,
+    message,
+    run_sync,
+    sanitise_string,
+    sync_data,
+)
+from base.ratelimit import (
+    RateLimitDeferred,
+    RateLimiter,
+)
+from base.scheduler import (
+    async_close_client,
+    async_instantiate_client,
+    async_run_tasks,
+    async_send_account_post,
+    get_post_queryset,
+    instantiate_client,
+    post_scheduler,
+)
+from base.signals import update_accounts
+from lib.bluesky import (
+    BLOB_CACHE,
+    HANDLE_CACHE,
+    LINK_CACHE,
+    THUMBNAIL_CACHE,
+    prepare_post as prepare_bluesky_post,
+    send_post as send_bluesky_post,
+)
+from lib.mastodon import (
+    async_close as async_close_mastodon,
+    async_instantiate as async_instantiate_mastodon,
+    prepare_post as prepare_mastodon_post,
+    send_post as send_mastodon_post,
+)
+from lib.post import (
+    bulk_ingest,
+    clean_data,
+    get_clean_candidates,
+)
+from lib.scheduler import (
+    bulk_schedule_post,
+    get_schedule_objects,
+)
+logger = logging.getLogger("base")
+DeliveryModel = get_delivery_model()
+PostModel = get_post_model()
+ScheduleModel = get_schedule_model()
+
+
+#====================SETTINGS: GETATTR====================#
+POST_DATE = getattr(settings, "POST_DATE")
+POST_EXPIRY = getattr(settings, "POST_EXPIRY")
+POST_LIMIT = getattr(settings, "POST_LIMIT")
+POST_ORDER = getattr(settings, "POST_ORDER")
+SYNC_CONFIG = getattr(settings, "SYNC_CONFIG")
+
+
+#====================BENCHMARK: PIPELINE====================#
+# default number of rows of the generated tables, kept small for a quick run, and the numbers of rows the data pipeline is measured at up to the requested one
+PIPELINE_ROWS = 10000
+PIPELINE_TIERS = (1000, 10000, 100000, 1000000)
+# modules whose functions are summarised when profiled
+PROFILED_MODULES = (os.path.join("base", "methods.py"), os.path.join("base", "post.py"))
+
+
+#====================BENCHMARK: SUITES====================#
+SUITES = dict()
+
+
+#====================BENCHMARK: SUITE====================#
+def suite(name):
+    # register a benchmark suite under the given name
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+
+#====================BENCHMARK: MEASURE====================#
+def measure(func, **kwargs):
+    number = kwargs.get("number", 1)
+    repeat = kwargs.get("repeat", 5)
+    timings = [t / number for t in timeit.Timer(func).repeat(repeat=repeat, number=number)]
+    return dict(
+        best=min(timings),
+        mean=sum(timings) / len(timings),
+    )
+
+
+#====================BENCHMARK: COMPARE====================#
+def compare(name, baseline, candidate, **kwargs):
+    baseline_timing = measure(baseline, **kwargs)
+    candidate_timing = measure(candidate, **kwargs)
+    return dict(
+        name=name,
+        baseline=baseline_timing["best"],
+        candidate=candidate_timing["best"],
+        speedup=baseline_timing["best"] / candidate_timing["best"] if candidate_timing["best"] else None,
+    )
+
+
+#====================BENCHMARK: FORMAT RESULTS====================#
+def format_results(results):
+    lines = ["%-40s %14s %14s %9s  %s" % ("benchmark", "baseline", "candidate", "speedup", "unit")]
+    for result in results:
+        # timings are reported in milliseconds, rates with decimals, and anything else as a plain count
+        unit = result.get("unit", "ms")
+        value_format = "%14.3f" if unit == "ms" or isinstance(result["baseline"], float) else "%14d"
+        scale = 1000 if unit == "ms" else 1
+        lines.append(("%-40s " + value_format + " " + value_format + " %9s  %s") % (
+            result["name"],
+            result["baseline"] * scale,
+            result["candidate"] * scale,
+            "%.2fx" % result["speedup"] if result.get("speedup") else "-",
+            unit,
+        ))
+        # show any additional details, such as query plans, below the result
+        lines.extend("    %s" % detail for detail in result.get("details", []))
+    return "\n".join(lines)
+
+
+#====================CORPUS: TITLES====================#
+def get_title_corpus(**kwargs):
+    size = kwargs.get("size", 500)
+    seed = kwargs.get("seed", 0)
+    rng = random.Random(seed)
+    words = ["breaking", "news", "update", "Kuala", "Lumpur", "prayer", "time", "weather", "café", "naïve", "#trending", "@mango.bsky.social", "https://example.com/article"]
+    emojis = ["😀", "🔥", "👍🏽", "👨‍👩‍👧", "🇲🇾", "✨", "🕌", "☀️"]
+    corpus = []
+    for _ in range(size):
+        # long titles that are heavy on emoji
+        title = " ".join(rng.choice(words) + ("".join(rng.choices(emojis, k=rng.randint(0, 3)))) for _ in range(rng.randint(30, 60)))
+        tags = " " + " ".join("#" + rng.choice(words).strip("#@") for _ in range(rng.randint(0, 5)))
+        corpus.append((title, tags, "https://example.com/%s" % rng.randint(0, 99999)))
+    return corpus
+
+
+#====================CORPUS: FIELDS====================#
+def get_field_corpus(**kwargs):
+    size = kwargs.get("size", 500)
+    seed = kwargs.get("seed", 0)
+    rng = random.Random(seed)
+    # mostly plain feed fields with some accented and some emoji text
+    corpus = []
+    for title, tags, link in get_title_corpus(size=size, seed=seed):
+        kind = rng.random()
+        if kind < 0.6:
+            title = title.encode("ascii", "ignore").decode()
+        elif kind < 0.8:
+            title = emoji.replace_emoji(title, replace="")
+        corpus.extend((title, tags, link))
+    return corpus
+
+
+#====================BASELINE: COUNT EMOJI====================#
+def baseline_count_emoji(text):
+    # reference implementation that scans the text with the emoji library on every call
+    tokens = list(emoji.analyze(text))
+    return len(tokens), sum([len(t.value.emoji) for t in tokens])
+
+
+#====================BASELINE: DEMOJIZE====================#
+def baseline_demojize(text):
+    return emoji.replace_emoji(text, replace=lambda chars, data_dict: data_dict["en"]) if baseline_count_emoji(text)[0] > 0 else text
+
+
+#====================BASELINE: CLEAN FIELD====================#
+def baseline_clean_field(text):
+    return baseline_demojize(text) if baseline_count_emoji(text)[0] > 0 else text
+
+
+#====================CANDIDATE: CLEAN FIELD====================#
+def candidate_clean_field(text):
+    return demojize(text) if has_emoji(text) else text
+
+
+#====================BASELINE: PREPARE POST====================#
+def baseline_prepare_post(title, tags, link):
+    # reference implementation that counts emoji over the whole text up to twice
+    char_limit = 300
+    link_count = 0
+    emoji_count, emoji_length = baseline_count_emoji(title + tags + link)
+    if sum((len(title), len(tags), link_count, emoji_count - emoji_length)) > char_limit:
+        tags = ""
+        emoji_count = baseline_count_emoji(title + tags + link)[0]
+        title = title[:char_limit - (link_count + emoji_count)]
+    return title + tags + link
+
+
+#====================BASELINE: TOKENIZE====================#
+def baseline_tokenize(text):
+    # reference implementation of the per part and per word pattern matching
+    tokens = []
+    for part in re.split("(%s)" % r"http[s]?://\S+", text):
+        if re.match(r"http[s]?://\S+", part):
+            tokens.append(("url", part))
+            continue
+        for word in re.split(r"(\s+)", part):
+            if re.match(r"#\w+", word):
+                tokens.append(("hashtag", word))
+            elif re.match(r"@\w+", word):
+                tokens.append(("mention", word))
+            else:
+                tokens.append(("text", word))
+    return tokens
+
+
+#====================SUITE: TEXT====================#
+@suite("text")
+def benchmark_text(**kwargs):
+    corpus = get_title_corpus(size=kwargs.get("size", 500))
+    texts = ["%s%s\n\n%s" % post for post in corpus]
+    for post in corpus:
+        assert prepare_bluesky_post(*post, embed_only=True) == baseline_prepare_post(*post)
+    return [
+        compare(
+            "prepare_post (%s titles)" % len(corpus),
+            lambda: [baseline_prepare_post(*post) for post in corpus],
+            lambda: [prepare_bluesky_post(*post, embed_only=True) for post in corpus],
+            **kwargs
+        ),
+        compare(
+            "tokenize rich post (%s titles)" % len(texts),
+            lambda: [baseline_tokenize(text) for text in texts],
+            lambda: [analyse_text(text, emoji_stats=False)["tokens"] for text in texts],
+            **kwargs
+        ),
+    ]
+
+
+#====================SUITE: EMOJI====================#
+@suite("emoji")
+def benchmark_emoji(**kwargs):
+    corpus = get_field_corpus(size=kwargs.get("size", 500))
+    # make sure both implementations agree before timing them
+    for text in corpus:
+        assert candidate_clean_field(text) == baseline_clean_field(text) and count_emoji(text) == baseline_count_emoji(text)
+
+    # time the candidate without the benefit of earlier runs
+    def cold(func):
+        def run():
+            analyse_emoji.cache_clear()
+            return func()
+        return run
+
+    return [
+        compare(
+            "clean fields, cold (%s fields)" % len(corpus),
+            lambda: [baseline_clean_field(text) for text in corpus],
+            cold(lambda: [candidate_clean_field(text) for text in corpus]),
+            **kwargs
+        ),
+        compare(
+            "clean fields, warm (%s fields)" % len(corpus),
+            lambda: [baseline_clean_field(text) for text in corpus],
+            lambda: [candidate_clean_field(text) for text in corpus],
+            **kwargs
+        ),
+        compare(
+            "count_emoji, cold (%s fields)" % len(corpus),
+            lambda: [baseline_count_emoji(text) for text in corpus],
+            cold(lambda: [count_emoji(text) for text in corpus]),
+            **kwargs
+        ),
+    ]
+
+
+#====================STUB: LOCAL SERVER====================#
+class LocalServer:
+    def __init__(self, **kwargs):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.get_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s" % self.server.server_address[1]
+
+    def get_handler(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+#====================STUB: HANDLER====================#
+class StubHandler(BaseHTTPRequestHandler):
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def reply(self, status, body, **kwargs):
+        content_type = kwargs.get("content_type", "application/json")
+        headers = kwargs.get("headers", {})
+        body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+#====================STUB: RATE LIMITED SERVER====================#
+class RateLimitedServer(LocalServer):
+    def __init__(self, **kwargs):
+        self.limit = kwargs.get("limit", 5)
+        self.window = kwargs.get("window", 2)
+        self.rejected = 0
+        self.windows = dict()
+        self.lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def consume(self, token):
+        # enforce a fixed window budget per access token
+        with self.lock:
+            now = time.time()
+            start, count = self.windows.get(token, (now, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            allowed = count < self.limit
+            count += allowed
+            self.rejected += not allowed
+            self.windows[token] = (start, count)
+            return allowed, self.limit - count, start + self.window
+
+    def get_handler(self):
+        server = self
+
+        class Handler(StubHandler):
+            def do_POST(self):
+                self.read_body()
+                allowed, remaining, reset = server.consume(self.headers.get("Authorization"))
+                self.reply(200 if allowed else 429, dict(id=str(time.time_ns())) if allowed else dict(error="Too many requests"), headers={
+                    "X-RateLimit-Limit": str(server.limit),
+                    "X-RateLimit-Remaining": str(remaining),
+                    "X-RateLimit-Reset": datetime.fromtimestamp(reset, timezone.utc).isoformat(),
+                })
+
+            do_PUT = do_POST
+
+        return Handler
+
+
+#====================SUITE: RATE LIMIT====================#
+@suite("ratelimit")
+def benchmark_ratelimit(**kwargs):
+    accounts = 3
+    posts = 10
+
+    # send all posts at once and count how they were rejected or deferred
+    async def send_posts(url, limiter):
+        clients = [dict(account_id="u%s@stub" % i, client=await async_instantiate_mastodon("token-%s" % i, url), domain="stub", host="mastodon") for i in range(accounts)]
+        try:
+            tasks = [(async_send_account_post, (account_client,), dict(limiter=limiter, mastodon_post="post %s" % i)) for i in range(posts) for account_client in clients]
+            results = await async_run_tasks(tasks)
+        finally:
+            for account_client in clients:
+                await async_close_mastodon(account_client["client"])
+        return dict(
+            sent=sum(1 for result, e in results if result),
+            rejected=sum(1 for _, e in results if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429),
+            deferred=sum(1 for _, e in results if isinstance(e, RateLimitDeferred)),
+        )
+
+    outcomes = []
+    for limiter in (None, RateLimiter(max_wait=1)):
+        with RateLimitedServer(limit=5, window=2) as server:
+            outcomes.append(asyncio.run(send_posts(server.url, limiter)))
+    baseline, candidate = outcomes
+    return [
+        dict(name="%s (%s posts)" % (key, accounts * posts), baseline=baseline[key], candidate=candidate[key], unit="posts")
+        for key in ("sent", "rejected", "deferred")
+    ]
+
+
+#====================BENCHMARK: SCRATCH DATABASE====================#
+@contextmanager
+def scratch_database(*models, **kwargs):
+    alias = kwargs.get("alias", "benchmark")
+    # create the tables of the given models in a throwaway in-memory SQLite database
+    connections.settings[alias] = dict(connections.settings["default"], ENGINE="django.db.backends.sqlite3", NAME=":memory:", OPTIONS=dict())
+    try:
+        with connections[alias].schema_editor() as schema_editor:
+            for model in models:
+                schema_editor.create_model(model)
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+#====================BENCHMARK: SET FIELD INDEX====================#
+def set_field_index(alias, model, field_name, db_index):
+    # alter the field from its opposite state, regardless of how it is declared on the model
+    old_field, new_field = model._meta.get_field(field_name).clone(), model._meta.get_field(field_name).clone()
+    old_field.db_index, new_field.db_index = not db_index, db_index
+    for field in (old_field, new_field):
+        field.set_attributes_from_name(field_name)
+        field.model = model
+    with connections[alias].schema_editor() as schema_editor:
+        schema_editor.alter_field(model, old_field, new_field)
+
+
+#====================BENCHMARK: EXPLAIN QUERYSET====================#
+def explain_queryset(queryset):
+    # explain the compiled query directly as queryset.explain() cannot explain sliced querysets
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute("%s %s" % (connection.ops.explain_query_prefix(), sql), params)
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+#====================CORPUS: POST TABLES====================#
+def populate_post_tables(alias, **kwargs):
+    rows = kwargs.get("rows", PIPELINE_ROWS)
+    seed = kwargs.get("seed", 0)
+    batch_size = kwargs.get("batch_size", 10000)
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    # spread creation dates slightly past expiry, as if the table was cleaned regularly
+    max_age = timedelta(days=POST_EXPIRY * 1.05).total_seconds()
+
+    for start in range(0, rows, batch_size):
+        with transaction.atomic(using=alias):
+            post_objects = PostModel.objects.using(alias).bulk_create([
+                PostModel(item_id=str(i), title="title %s" % i, link="https://example.com/%s" % i, date_created=now - timedelta(seconds=rng.random() * max_age))
+                for i in range(start, min(start + batch_size, rows))
+            ])
+            # deliver most objects and keep a few of them scheduled, both delivered and not
+            ScheduleModel.objects.using(alias).bulk_create([
+                ScheduleModel(name="Public", subject=post_object, date_scheduled=post_object.date_created)
+                for post_object in post_objects if rng.random() < 0.05
+            ])
+            DeliveryModel.objects.using(alias).bulk_create([
+                DeliveryModel(subject=post_object, account_id="u@stub", remote_id=post_object.item_id, sent_at=now)
+                for post_object in post_objects if rng.random() < 0.9
+            ])
+
+
+#====================SUITE: EXPLAIN====================#
+@suite("explain")
+def benchmark_explain(**kwargs):
+    rows = kwargs.get("rows", PIPELINE_ROWS)
+    # indexes that serve the scheduler and cleanup queries
+    indexes = [(PostModel, POST_DATE), (ScheduleModel, "date_scheduled")]
+
+    with scratch_database(PostModel, ScheduleModel, DeliveryModel) as alias:
+        deletion_candidates, schedule_candidates = get_clean_candidates()
+        pending_objects, updating_objects = get_schedule_objects()
+        queries = [
+            ("pending queue (%s)" % POST_ORDER, get_post_queryset(pending_objects.using(alias))[:POST_LIMIT or 100]),
+            ("pending queue (date_scheduled)", get_post_queryset(get_schedule_objects(order="date_scheduled")[0].using(alias))[:POST_LIMIT or 100]),
+            ("updating queue (%s)" % POST_ORDER, get_post_queryset(updating_objects.using(alias))),
+            ("deletion candidates", deletion_candidates.using(alias).order_by("pk").values_list("pk", flat=True)[:500]),
+            ("schedule candidates", schedule_candidates.using(alias).order_by("pk").values_list("pk", flat=True)[:500]),
+            ("expired objects", PostModel.objects.using(alias).filter(**{"%s__lte" % POST_DATE: datetime.now(timezone.utc) - timedelta(days=POST_EXPIRY)}).values_list("pk", flat=True)),
+        ]
+
+        # drop the indexes while the tables are empty, then fill them
+        for model, field_name in indexes:
+            set_field_index(alias, model, field_name, False)
+        populate_post_tables(alias, rows=rows)
+
+        # explain and time every query without and with the indexes
+        outcomes = []
+        for db_index in (False, True):
+            if db_index:
+                for model, field_name in indexes:
+                    set_field_index(alias, model, field_name, True)
+            outcomes.append([(explain_queryset(queryset), measure(lambda: list(queryset.all()), **kwargs)["best"]) for _, queryset in queries])
+
+    return [
+        dict(
+            name="%s (%s rows)" % (name, rows),
+            baseline=baseline,
+            candidate=candidate,
+            speedup=baseline / candidate if candidate else None,
+            details=["before: %s" % " | ".join(baseline_plan), "after:  %s" % " | ".join(candidate_plan)],
+        )
+        for (name, _), (baseline_plan, baseline), (candidate_plan, candidate) in zip(queries, *outcomes)
+    ]
+
+
+#====================STUB: JWT====================#
+def get_stub_jwt(subject, scope, ttl):
+    # unsigned token that carries the claims read by the atproto client
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    now = int(time.time())
+    return "%s.%s.%s" % (encode(dict(alg="HS256", typ="JWT")), encode(dict(scope=scope, sub=subject, iat=now, exp=now + ttl)), encode("stub"))
+
+
+#====================STUB: DID====================#
+def get_stub_did(handle):
+    return "did:plc:%s" % hashlib.sha256(handle.encode()).hexdigest()[:24]
+
+
+#====================STUB: IMAGE====================#
+@functools.lru_cache(maxsize=None)
+def get_stub_image(index):
+    # small thumbnail with a distinct colour per link so that each one is uploaded separately
+    rng = random.Random(index)
+    Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(output := BytesIO(), format="PNG")
+    return output.getvalue()
+
+
+#====================STUB: PAGE====================#
+def get_stub_page(url, index):
+    return (
+        '<html><head>'
+        '<meta property="og:title" content="Stub article %s">'
+        '<meta property="og:description" content="Description of stub article %s.">'
+        '<meta property="og:image" content="%s/images/%s.png">'
+        '</head><body></body></html>' % (index, index, url, index)
+    ).encode()
+
+
+#====================STUB: SOCIAL SERVER====================#
+class StubServer(LocalServer):
+    # stand-in for Mastodon and atproto instances, and for the pages and thumbnails of linked articles
+    CID = "bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm"
+
+    def __init__(self, **kwargs):
+        self.error_rate = kwargs.get("error_rate", 0.0)
+        self.latency = kwargs.get("latency", 0.01)
+        self.rng = random.Random(kwargs.get("seed", 0))
+        self.counter = 0
+        self.lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def next_id(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def should_fail(self):
+        # fail a share of the calls that create content
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def get_session(self, handle):
+        did = get_stub_did(handle)
+        return dict(
+            accessJwt=get_stub_jwt(did, "com.atproto.access", 7200),
+            refreshJwt=get_stub_jwt(did, "com.atproto.refresh", 86400),
+            did=did,
+            handle=handle,
+        )
+
+    def get_handler(self):
+        server = self
+
+        class Handler(StubHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                # linked articles are served without latency as they are not part of the instance api
+                if url.path.startswith("/links/"):
+                    return self.reply(200, get_stub_page(server.url, url.path.rsplit("/", 1)[-1]), content_type="text/html")
+                if url.path.startswith("/images/"):
+                    return self.reply(200, get_stub_image(url.path.rsplit("/", 1)[-1].split(".")[0]), content_type="image/png")
+                time.sleep(server.latency)
+                if url.path.startswith("/api/v1/instance"):
+                    return self.reply(200, dict(uri="127.0.0.1", version="4.2.0"))
+                if url.path == "/api/v1/accounts/verify_credentials":
+                    return self.reply(200, dict(id="1", username="stub", acct="stub"))
+                if url.path == "/xrpc/app.bsky.actor.getProfile":
+                    actor = parse_qs(url.query).get("actor", [""])[0]
+                    return self.reply(200, dict(did=actor if actor.startswith("did:") else get_stub_did(actor), handle=actor))
+                self.reply(404, dict(error="NotFound", message="Not found"))
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.read_body()
+                time.sleep(server.latency)
+                if url.path == "/xrpc/com.atproto.server.createSession":
+                    return self.reply(200, server.get_session(json.loads(body).get("identifier")))
+                if server.should_fail():
+                    return self.reply(500, dict(error="InternalServerError", message="Stub error"))
+                if url.path == "/api/v1/statuses":
+                    return self.reply(200, dict(id=str(server.next_id())))
+                if url.path == "/xrpc/com.atproto.repo.createRecord":
+                    repo = json.loads(body).get("repo")
+                    return self.reply(200, dict(uri="at://%s/app.bsky.feed.post/%s" % (repo, server.next_id()), cid=server.CID))
+                if url.path == "/xrpc/com.atproto.repo.uploadBlob":
+                    return self.reply(200, dict(blob={"$type": "blob", "ref": {"$link": server.CID}, "mimeType": self.headers.get("Content-Type") or "image/png", "size": len(body)}))
+                self.reply(404, dict(error="NotFound", message="Not found"))
+
+            def do_PUT(self):
+                url = urlparse(self.path)
+                self.read_body()
+                time.sleep(server.latency)
+                if server.should_fail():
+                    return self.reply(500, dict(error="InternalServerError", message="Stub error"))
+                if url.path.startswith("/api/v1/statuses/"):
+                    return self.reply(200, dict(id=url.path.rsplit("/", 1)[-1]))
+                self.reply(404, dict(error="NotFound", message="Not found"))
+
+        return Handler
+
+
+#====================BENCHMARK: ISOLATED DATABASE====================#
+@contextmanager
+def isolated_database():
+    # run against a throwaway test database so that the scheduler never touches real data
+    old_config = setup_databases(verbosity=0, interactive=False, aliases={"default"})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+#====================BENCHMARK: ISOLATED CACHES====================#
+@contextmanager
+def isolated_caches():
+    # start every run with cold caches and leave the cache directory untouched
+    caches = (BLOB_CACHE, HANDLE_CACHE, LINK_CACHE, THUMBNAIL_CACHE)
+    disks = [cache.disk for cache in caches]
+    for cache in caches:
+        cache.disk = None
+        cache.memory.clear()
+    try:
+        yield
+    finally:
+        for cache, disk in zip(caches, disks):
+            cache.memory.clear()
+            cache.disk = disk
+
+
+#====================BENCHMARK: QUERY COUNTER====================#
+class QueryCounter:
+    def __init__(self, **kwargs):
+        self.alias = kwargs.get("alias", "default")
+        self.connection = None
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        # count the queries made on the connection of the calling thread
+        self.connection = connections[self.alias]
+        self.connection.execute_wrappers.append(self)
+
+    def uninstall(self):
+        self.connection.execute_wrappers.remove(self)
+
+
+#====================BENCHMARK: RECORD SENDS====================#
+@contextmanager
+def record_sends(*targets):
+    # time every send made through the given functions of a module and note whether it has succeeded
+    sends = []
+    originals = [(module, name, getattr(module, name)) for module, name in targets]
+
+    def timed(send_func):
+        if asyncio.iscoroutinefunction(send_func):
+            async def timed_send(*args, **kwargs):
+                start, result = time.perf_counter(), None
+                try:
+                    result = await send_func(*args, **kwargs)
+                    return result
+                finally:
+                    sends.append((time.perf_counter() - start, bool(result)))
+        else:
+            def timed_send(*args, **kwargs):
+                start, result = time.perf_counter(), None
+                try:
+                    result = send_func(*args, **kwargs)
+                    return result
+                finally:
+                    sends.append((time.perf_counter() - start, bool(result)))
+        return timed_send
+
+    for module, name, send_func in originals:
+        setattr(module, name, timed(send_func))
+    try:
+        yield sends
+    finally:
+        for module, name, send_func in originals:
+            setattr(module, name, send_func)
+
+
+#====================BENCHMARK: QUIET LOGGER====================#
+@contextmanager
+def quiet_logger(**kwargs):
+    level = kwargs.get("level", logging.WARNING)
+    # keep the events logged for every post out of the results
+    logger = logging.getLogger("base")
+    old_level = logger.level
+    logger.setLevel(max(level, old_level))
+    try:
+        yield
+    finally:
+        logger.setLevel(old_level)
+
+
+#====================BENCHMARK: PEAK RSS====================#
+def get_peak_rss():
+    # peak resident set size in kilobytes since it was last reset, or since the process started
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+#====================BENCHMARK: RESET PEAK RSS====================#
+def reset_peak_rss():
+    # NOTE: only supported on linux, elsewhere the peak of the whole process is reported
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+#====================BENCHMARK: PERCENTILE====================#
+def percentile(values, fraction):
+    # nearest rank percentile
+    values = sorted(values)
+    return values[min(len(values) - 1, max(math.ceil(fraction * len(values)) - 1, 0))] if values else 0.0
+
+
+#====================CORPUS: SCHEDULER TABLES====================#
+def populate_scheduler_tables(url, token_dir, **kwargs):
+    accounts = kwargs.get("accounts", 4)
+    links = kwargs.get("links", 20)
+    posts = kwargs.get("posts", 500)
+    AccountModel = get_account_model()
+
+    # start from empty tables and alternate accounts between both hosts, whose app passwords are read from files
+    PostModel.objects.all().delete()
+    AccountModel.objects.all().delete()
+    account_objects = []
+    for i, host in ((i, ("mastodon", "bluesky")[i % 2]) for i in range(accounts)):
+        access_token = "token-%s" % i
+        if host == "bluesky":
+            access_token = os.path.join(token_dir, access_token)
+            Path(access_token).write_text("password-%s" % i)
+        account_objects.append(AccountModel(uid="bench%s" % i, host=host, access_token=access_token, api_base_url=url if host == "mastodon" else "https://bsky.stub"))
+    account_objects = AccountModel.objects.bulk_create(account_objects)
+    PostModel.objects.bulk_create([
+        PostModel(item_id=str(i), title="Stub post %s about the news of the day" % i, link="%s/links/%s" % (url, i % links), tags=["mango", "benchmark"])
+        for i in range(posts)
+    ])
+    bulk_schedule_post(PostModel.objects.all())
+    return account_objects
+
+
+#====================BASELINE: POST SCHEDULER====================#
+def baseline_post_scheduler(pending_objects, updating_objects, **kwargs):
+    # reference implementation that sends each post to one account after another, saving the post IDs of each post and deleting its schedule as it goes
+    account_objects = kwargs.get("account_objects")
+    clients = kwargs.get("clients")
+    retry_post = kwargs.get("retry_post", True)
+
+    for post_object in pending_objects | updating_objects:
+        delete = True
+        # prepare post title, tags, and link
+        post_title = emojize(post_object.subject.title)
+        post_tags = emojize(" " + " ".join(["#" + sanitise_string(i) for i in post_object.subject.tags]) if post_object.subject.tags else "")
+        post_link = emojize(post_object.subject.link if post_object.subject.link else "")
+        bluesky_post = prepare_bluesky_post(post_title, post_tags, post_link, embed_only=True)
+        mastodon_post = prepare_mastodon_post(post_title, post_tags, post_link)
+
+        for account in account_objects:
+            if not (account_client := clients.get(account.pk, None)):
+                continue
+            account_id = account_client.get("account_id")
+            client = account_client.get("client")
+            host = account_client.get("host")
+            # get post_id specific to account if it is an existing and format conforming post
+            account_pid = [pid.split("_")[-1] for pid in post_object.subject.post_id if pid.split("_")[0] == account_id] if post_object.subject.post_id and isinstance(post_object.subject.post_id, list) else []
+            account_pid = account_pid[0] if account_pid else None
+            try:
+                if host and host.lower() == "bluesky":
+                    post_id = send_bluesky_post(bluesky_post, bluesky=client, post_id=account_pid, receiver=post_object.receiver)
+                else:
+                    post_id = send_mastodon_post(mastodon_post, mastodon=client, post_id=account_pid, receiver=post_object.receiver, visibility=post_object.visibility)
+            except Exception as e:
+                delete = False
+                logger.error(message("LOG_EXCEPT", exception=e, verbose='Post "%s" (%s) has failed to be sent' % (post_object, account_id), object=post_object))
+                continue
+            if not post_id:
+                delete = False
+                continue
+            pid = "%s_%s" % (account_id, post_id)
+            # update subject object post_id if new or non-format conforming post
+            if not account_pid:
+                if not isinstance(post_object.subject.post_id, list):
+                    post_object.subject.post_id = list()
+                post_object.subject.post_id.append(pid)
+                post_object.subject.save(update_fields=["post_id"])
+            logger.info(message("LOG_EVENT", event='Post "%s" (%s) has been sent' % (post_object, pid)))
+            if not any(account_id in i for i in post_object.subject.post_id):
+                delete = False
+        # delete post schedule object if it has been sent successfully on all accounts or if configured to not retry
+        if delete or not retry_post:
+            post_object.delete()
+            logger.info(message("LOG_EVENT", event='Post Schedule "%s" has been deleted' % post_object))
+
+
+#====================BENCHMARK: INSTANTIATE STUB CLIENTS====================#
+def instantiate_stub_clients(engine, account_objects, url, session_dir):
+    # instantiate clients as the scheduler does, with Bluesky pointed at the stub server
+    options = dict(bluesky_options=dict(base_url="%s/xrpc" % url, session_dir=session_dir))
+    if engine == "async":
+        return {account.pk: run_sync(async_instantiate_client(account, **options)) for account in account_objects}
+    return {account.pk: instantiate_client(account, **options) for account in account_objects}
+
+
+#====================BENCHMARK: RUN STUB SCHEDULER====================#
+def run_stub_scheduler(engine, account_objects, url, session_dir, **kwargs):
+    # count the queries made on the thread that runs database calls, which is a thread of its own for the async engine
+    counter = QueryCounter()
+    if engine == "async":
+        run_sync(sync_to_async(counter.install)())
+    else:
+        counter.install()
+    clients = dict()
+    try:
+        start = time.perf_counter()
+        clients = instantiate_stub_clients(engine, account_objects, url, session_dir)
+        if engine == "baseline":
+            baseline_post_scheduler(*get_schedule_objects(), account_objects=account_objects, clients=clients)
+        else:
+            post_scheduler(*get_schedule_objects(), account_objects=account_objects, clients=clients, engine=engine, **kwargs)
+        return time.perf_counter() - start, counter.count
+    finally:
+        if engine == "async":
+            run_sync(sync_to_async(counter.uninstall)())
+            for account_client in clients.values():
+                run_sync(async_close_client(account_client))
+        else:
+            counter.uninstall()
+
+
+#====================BENCHMARK: MEASURE SCHEDULER====================#
+def measure_scheduler(url, engine, data_dir, **kwargs):
+    posts = kwargs.get("posts", 500)
+    workers = kwargs.get("workers", 8)
+    # send every scheduled post in one run, without pacing it by the rate limit budget
+    params = dict(limit=posts, limiter=None, organic=False, workers=workers)
+    # time the sends of the baseline through the client functions it calls, and those of the engines through their send functions
+    if engine == "baseline":
+        send_funcs = ((sys.modules[__name__], "send_bluesky_post"), (sys.modules[__name__], "send_mastodon_post"))
+    else:
+        send_funcs = ((base_scheduler, "async_send_account_post" if engine == "async" else "send_account_post"),)
+
+    with quiet_logger():
+        account_objects = populate_scheduler_tables(url, data_dir, **kwargs)
+    reset_peak_rss()
+    # the failed sends of the stub errors are logged as errors by the baseline, which would flood the results
+    with isolated_caches(), quiet_logger(level=logging.CRITICAL), record_sends(*send_funcs) as sends:
+        duration, queries = run_stub_scheduler(engine, account_objects, url, data_dir, **params)
+    latencies = [latency for latency, _ in sends]
+    return dict(
+        duration=duration,
+        throughput=posts / duration if duration else 0.0,
+        p50=percentile(latencies, 0.5),
+        p99=percentile(latencies, 0.99),
+        queries=queries,
+        sends=len(sends),
+        failed=sum(1 for _, sent in sends if not sent),
+        peak_rss=get_peak_rss(),
+    )
+
+
+#====================SUITE: SCHEDULER====================#
+@suite("scheduler")
+def benchmark_scheduler(**kwargs):
+    repeat = kwargs.get("repeat", 5)
+    config = dict(
+        accounts=kwargs.get("accounts", 4),
+        links=kwargs.get("links", 20),
+        posts=kwargs.get("size", 500),
+    )
+    workers = kwargs.get("workers", 8)
+    latency = kwargs.get("latency", 0.01)
+    error_rate = kwargs.get("error_rate", 0.01)
+
+    # compare the scheduler from before the delivery engines with each engine against the same stub instances, keeping the fastest run of each
+    outcomes = dict()
+    with isolated_database(), StubServer(latency=latency, error_rate=error_rate) as server, tempfile.TemporaryDirectory() as data_dir:
+        for engine in ("baseline", "sync", "async"):
+            outcomes[engine] = min([measure_scheduler(server.url, engine, data_dir, workers=workers, **config) for _ in range(repeat)], key=lambda outcome: outcome["duration"])
+    baseline = outcomes["baseline"]
+
+    # metrics where higher is better are compared the other way round, and failures are not compared at all
+    rows = [
+        ("throughput", "throughput", "posts/s", -1),
+        ("send latency p50", "p50", "ms", 1),
+        ("send latency p99", "p99", "ms", 1),
+        ("queries", "queries", "queries", 1),
+        ("failed sends", "failed", "sends", 0),
+        ("peak rss", "peak_rss", "KB", 1),
+    ]
+    results = []
+    for engine in ("sync", "async"):
+        candidate = outcomes[engine]
+        engine_results = [
+            dict(
+                name="%s, %s engine (%s posts, %s accounts)" % (name, engine, config["posts"], config["accounts"]),
+                baseline=baseline[key],
+                candidate=candidate[key],
+                speedup=(baseline[key] / candidate[key] if direction > 0 else candidate[key] / baseline[key]) if direction and baseline[key] and candidate[key] else None,
+                unit=unit,
+            )
+            for name, key, unit, direction in rows
+        ]
+        engine_results[0]["details"] = [
+            "baseline: scheduler before the delivery engines, candidate: %s engine with %s workers" % (engine, workers),
+            "%s links, %s ms latency, %s%% errors, %s and %s sends" % (config["links"], latency * 1000, error_rate * 100, baseline["sends"], candidate["sends"]),
+        ]
+        results.extend(engine_results)
+    return results
+
+
+#====================BENCHMARK: DISCONNECTED SIGNAL====================#
+@contextmanager
+def disconnected_signal(signal, receiver, sender):
+    # keep receivers that talk to remote instances out of the benchmark
+    signal.disconnect(receiver, sender=sender)
+    try:
+        yield
+    finally:
+        signal.connect(receiver, sender=sender)
+
+
+#====================BENCHMARK: CAPTURE QUERIES====================#
+@contextmanager
+def capture_queries(**kwargs):
+    alias = kwargs.get("alias", "default")
+    connection = connections[alias]
+    # keep every query rather than only the most recent ones kept by the connection
+    queries_log, connection.queries_log = connection.queries_log, deque()
+    try:
+        with CaptureQueriesContext(connection) as context:
+            yield context
+    finally:
+        connection.queries_log = queries_log
+
+
+#====================BENCHMARK: GET QUERY SHAPE====================#
+def get_query_shape(sql):
+    # identify a query by its statement and the table it mainly reads or writes
+    statement = sql.split(None, 1)[0].upper() if sql.strip() else ""
+    table = re.search(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', sql, re.IGNORECASE)
+    return "%s %s" % (statement, table.group(1)) if table else statement
+
+
+#====================BENCHMARK: GET PROFILE SUMMARY====================#
+def get_profile_summary(profiler, **kwargs):
+    limit = kwargs.get("limit", 3)
+    modules = kwargs.get("modules", PROFILED_MODULES)
+    # cumulative time of the slowest functions of the profiled modules
+    functions = [
+        (cumulative_time, calls, "%s:%s" % (os.path.basename(filename), name))
+        for (filename, _, name), (_, calls, _, cumulative_time, _) in pstats.Stats(profiler).stats.items()
+        if filename.endswith(modules)
+    ]
+    return ", ".join("%s %.3f s in %s calls" % (name, cumulative_time, calls) for cumulative_time, calls, name in sorted(functions, reverse=True)[:limit])
+
+
+#====================BENCHMARK: MEASURE OPERATION====================#
+def measure_operation(func, **kwargs):
+    profile_path = kwargs.get("profile_path")
+    profiler = cProfile.Profile() if profile_path else None
+    with capture_queries() as context:
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            func()
+        finally:
+            if profiler:
+                profiler.disable()
+        duration = time.perf_counter() - start
+        shapes = Counter(get_query_shape(query["sql"]) for query in context.captured_queries)
+        outcome = dict(duration=duration, queries=len(context), shapes=shapes.most_common(3))
+    if profiler:
+        # dump the profile to be inspected with pstats or snakeviz, and summarise it in the results
+        Path(profile_path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_path)
+        outcome["profile"] = get_profile_summary(profiler)
+    return outcome
+
+
+#====================BENCHMARK: COMPARE OPERATIONS====================#
+def compare_operations(name, baseline, candidate, **kwargs):
+    labels = kwargs.get("labels", ("baseline", "candidate"))
+    profile_dir = kwargs.get("profile_dir")
+    setups = kwargs.get("setups", (None, None))
+    # run each operation once as they change the tables they are measured on
+    outcomes = []
+    for label, func, setup in zip(labels, (baseline, candidate), setups):
+        if setup:
+            setup()
+        profile_path = os.path.join(profile_dir, "%s.prof" % re.sub(r"\W+", "-", "%s %s" % (name, label)).strip("-")) if profile_dir else None
+        outcomes.append(measure_operation(func, profile_path=profile_path))
+    baseline_outcome, candidate_outcome = outcomes
+
+    details = []
+    for label, outcome in zip(labels, outcomes):
+        details.append("%s: %s" % (label, ", ".join("%s %s" % (count, shape) for shape, count in outcome["shapes"]) or "no queries"))
+        if outcome.get("profile"):
+            details.append("%s profile: %s" % (label, outcome["profile"]))
+    return [
+        dict(
+            name=name,
+            baseline=baseline_outcome["duration"],
+            candidate=candidate_outcome["duration"],
+            speedup=baseline_outcome["duration"] / candidate_outcome["duration"] if candidate_outcome["duration"] else None,
+            details=details,
+        ),
+        dict(
+            name="%s, queries" % name,
+            baseline=baseline_outcome["queries"],
+            candidate=candidate_outcome["queries"],
+            speedup=baseline_outcome["queries"] / candidate_outcome["queries"] if candidate_outcome["queries"] else None,
+            unit="queries",
+        ),
+    ]
+
+
+#====================CORPUS: WRITE JSON RECORDS====================#
+def write_json_records(path, key, records):
+    # stream the records to the file so that large data files are never held in memory
+    with open(path, "w") as f:
+        f.write('{"%s": [' % key)
+        for i, record in enumerate(records):
+            f.write("%s%s" % ("," if i else "", json.dumps(record)))
+        f.write("]}")
+
+
+#====================CORPUS: ACCOUNT RECORDS====================#
+def get_account_records(records, **kwargs):
+    changed = kwargs.get("changed", 0)
+    step = round(1 / changed) if changed else 0
+    for i in range(records):
+        yield dict(
+            uid="bench%s" % i,
+            access_token="token-%s" % i,
+            api_base_url="https://instance%s.stub" % (i % 10),
+            is_bot=True,
+            is_discoverable=True,
+            is_enabled=True,
+            display_name="Bench %s%s" % (i, " (changed)" if step and i % step == 0 else ""),
+            fields=[["Source", "https://example.com/%s" % i]],
+            host=("mastodon", "bluesky")[i % 2],
+            is_locked=False,
+            note="Synthetic account %s" % i,
+        )
+
+
+#====================CORPUS: FEED RECORDS====================#
+def get_feed_records(records, **kwargs):
+    changed = kwargs.get("changed", 0)
+    step = round(1 / changed) if changed else 0
+    for i in range(records):
+        yield dict(
+            uid="feed%s" % i,
+            endpoint="https://example.com/feeds/%s.xml%s" % (i, "?changed" if step and i % step == 0 else ""),
+            is_enabled=True,
+        )
+
+
+#====================CORPUS: PIPELINE DATA====================#
+def write_pipeline_data(data_dir, records, **kwargs):
+    generators = dict(accounts=get_account_records, feeds=get_feed_records)
+    # sync the generated data files as configured for the real ones
+    sync_dict = {key: dict(SYNC_CONFIG[key], data=os.path.join(data_dir, "%s.json" % key)) for key in generators if key in SYNC_CONFIG}
+    os.makedirs(data_dir, exist_ok=True)
+    for key, config in sync_dict.items():
+        write_json_records(config["data"], key, generators[key](records, **kwargs))
+    return sync_dict
+
+
+#====================CORPUS: INGEST ITEMS====================#
+def ingest_items(items):
+    # save items one by one as feed readers do
+    for i in range(items):
+        PostModel(item_id="item%s" % i, title="Ingested item %s" % i, link="https://example.com/items/%s" % i, tags=["mango", "benchmark"]).save()
+
+
+#====================BENCHMARK: CLEAR PIPELINE TABLES====================#
+def clear_pipeline_tables():
+    with quiet_logger():
+        PostModel.objects.all().delete()
+
+
+#====================SUITE: PIPELINE====================#
+@suite("pipeline")
+def benchmark_pipeline(**kwargs):
+    rows = kwargs.get("rows", PIPELINE_ROWS)
+    ingest_rows = kwargs.get("ingest_rows", 100000)
+    profile_dir = kwargs.get("profile")
+    # measure every tier up to the requested number of rows
+    tiers = [tier for tier in PIPELINE_TIERS if tier < rows] + [rows]
+    AccountModel = get_account_model()
+
+    results = []
+    with isolated_database(), quiet_logger(), disconnected_signal(post_save, update_accounts, AccountModel), tempfile.TemporaryDirectory() as data_dir:
+        for tier in tiers:
+            # sync every record, then sync them again after some of them have changed
+            sync_dict = write_pipeline_data(os.path.join(data_dir, str(tier)), tier)
+            results.extend(compare_operations(
+                "sync_data (%s records per file)" % tier,
+                lambda: sync_data(sync_dict),
+                lambda: sync_data(sync_dict),
+                labels=("initial", "1% changed"),
+                profile_dir=profile_dir,
+                setups=(None, lambda: write_pipeline_data(os.path.join(data_dir, str(tier)), tier, changed=0.01)),
+            ))
+
+            # clean post tables that are mostly delivered, then clean them again once nothing is left to do
+            clear_pipeline_tables()
+            populate_post_tables("default", rows=tier)
+            results.extend(compare_operations(
+                "clean_data (%s rows)" % tier,
+                lambda: clean_data(time_budget=0),
+                lambda: clean_data(time_budget=0),
+                labels=("initial", "repeat"),
+                profile_dir=profile_dir,
+            ))
+
+            # save items with scheduling on every save, then within a bulk ingest
+            items = min(tier, ingest_rows)
+
+            def bulk_ingest_items():
+                with bulk_ingest():
+                    ingest_items(items)
+
+            results.extend(compare_operations(
+                "item ingestion (%s items)" % items,
+                lambda: ingest_items(items),
+                bulk_ingest_items,
+                labels=("per save", "bulk_ingest"),
+                profile_dir=profile_dir,
+                setups=(clear_pipeline_tables, clear_pipeline_tables),
+            ))
+    return results
@@ -1,36 +1,185 @@
+import asyncio
+import hashlib
+import httpx
 import logging
+import os
 import re
-import requests
+import threading
+import time
 from atproto import (
+    AsyncClient,
     Client,
+    SessionEvent,
     client_utils,
     models as atproto_models,
 )
+from atproto.exceptions import (
+    BadRequestError,
+    RequestException,
+    UnauthorizedError,
+)
 from bs4 import BeautifulSoup
 from io import BytesIO
 from pathlib import Path
 from PIL import Image
-# from django.conf import settings
+from django.conf import settings
+from base.cache import (
+    MISSING,
+    TieredCache,
+)
 from base.methods import (
+    analyse_text,
     count_emoji,
     get_active_accounts,
     get_domain,
     message,
+    run_sync,
 )
+from base.logs import (
+    log_event,
+    log_except,
+)
+from base.metrics import timer
+from base.ratelimit import parse_ratelimit
 logger = logging.getLogger("base")
 
 
 #====================SETTINGS: GETATTR====================#
+BLOB_CACHE_TTL = getattr(settings, "BLOB_CACHE_TTL")
+BLUESKY_SESSION_DIR = getattr(settings, "BLUESKY_SESSION_DIR")
 # DEFAULT_VISIBILITY = getattr(settings, "DEFAULT_VISIBILITY")
+HANDLE_CACHE_NEGATIVE_TTL = getattr(settings, "HANDLE_CACHE_NEGATIVE_TTL")
+HANDLE_CACHE_TTL = getattr(settings, "HANDLE_CACHE_TTL")
+LINK_CACHE_SIZE = getattr(settings, "LINK_CACHE_SIZE")
+LINK_CACHE_TTL = getattr(settings, "LINK_CACHE_TTL")
+THUMBNAIL_CACHE_SIZE = getattr(settings, "THUMBNAIL_CACHE_SIZE")
+
+
+#====================CACHE: LINKS====================#
+# link metadata and thumbnails are shared between accounts and runs, with pages that failed to load retried sooner
+LINK_CACHE = TieredCache("links", max_size=LINK_CACHE_SIZE, ttl=LINK_CACHE_TTL, negative_ttl=min(LINK_CACHE_TTL, 300))
+THUMBNAIL_CACHE = TieredCache("thumbnails", max_size=THUMBNAIL_CACHE_SIZE, ttl=LINK_CACHE_TTL, negative_ttl=min(LINK_CACHE_TTL, 300))
+
+
+#====================CACHE: HANDLES====================#
+# dids of mentioned handles shared between accounts and runs, with handles that do not exist retried sooner
+HANDLE_CACHE = TieredCache("handles", max_size=LINK_CACHE_SIZE, ttl=HANDLE_CACHE_TTL, negative_ttl=HANDLE_CACHE_NEGATIVE_TTL)
+HANDLE_PATTERN = re.compile(r"^([a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?$|^did:[a-z]+:[a-zA-Z0-9._:%-]+$")
+PROFILES_LIMIT = 25
+
+
+#====================CACHE: BLOBS====================#
+# blob references of uploaded thumbnails keyed by account and image content
+BLOB_CACHE = TieredCache("blobs", max_size=LINK_CACHE_SIZE, ttl=BLOB_CACHE_TTL)
+
+
+#====================BLUESKY: SESSION CLIENT====================#
+class SessionClient(Client):
+    def __init__(self, *args, **kwargs):
+        # credentials to log in again with should a resumed session be rejected
+        self.credentials = kwargs.pop("credentials", None)
+        self.ratelimit = None
+        super().__init__(*args, **kwargs)
+
+    def _invoke(self, invoke_type, **kwargs):
+        try:
+            return update_ratelimit(self, super()._invoke(invoke_type, **kwargs))
+        except (BadRequestError, UnauthorizedError) as e:
+            update_ratelimit(self, e.response)
+            if kwargs.get("ignore_session_check") or not (self.credentials and is_session_error(e)):
+                raise
+            self._get_and_set_session(*self.credentials)
+            return update_ratelimit(self, super()._invoke(invoke_type, **kwargs))
+        except RequestException as e:
+            update_ratelimit(self, e.response)
+            raise
+
+
+#====================BLUESKY: ASYNC SESSION CLIENT====================#
+class AsyncSessionClient(AsyncClient):
+    def __init__(self, *args, **kwargs):
+        # credentials to log in again with should a resumed session be rejected
+        self.credentials = kwargs.pop("credentials", None)
+        self.ratelimit = None
+        super().__init__(*args, **kwargs)
+
+    async def _invoke(self, invoke_type, **kwargs):
+        try:
+            return update_ratelimit(self, await super()._invoke(invoke_type, **kwargs))
+        except (BadRequestError, UnauthorizedError) as e:
+            update_ratelimit(self, e.response)
+            if kwargs.get("ignore_session_check") or not (self.credentials and is_session_error(e)):
+                raise
+            await self._get_and_set_session(*self.credentials)
+            return update_ratelimit(self, await super()._invoke(invoke_type, **kwargs))
+        except RequestException as e:
+            update_ratelimit(self, e.response)
+            raise
+
+
+#====================UTILS: UPDATE RATE LIMIT====================#
+def update_ratelimit(client, response):
+    # keep the rate limit budget reported by the latest response
+    client.ratelimit = parse_ratelimit(getattr(response, "headers", None)) or client.ratelimit
+    return response
+
+
+#====================UTILS: GET RATE LIMIT====================#
+def get_ratelimit(client):
+    return getattr(client, "ratelimit", None)
+
+
+#====================UTILS: IS SESSION ERROR====================#
+def is_session_error(e):
+    if isinstance(e, UnauthorizedError):
+        return True
+    error = getattr(getattr(getattr(e, "response", None), "content", None), "error", None)
+    return error in ("AuthenticationRequired", "ExpiredToken", "InvalidToken")
 
 
 #====================UTILS: GET CONTENT METADATA====================#
 def get_content_md(url):
-    # fetch the page content
-    response = requests.get(url)
-    if response.status_code != 200: return None
+    return run_sync(async_get_content_md(url))
+
+
+#====================UTILS: ASYNC GET CONTENT METADATA====================#
+async def async_get_content_md(url, **kwargs):
+    session = kwargs.get("session")
+    with timer("metadata"):
+        # fetch the page content
+        if session:
+            response = await session.get(url)
+        else:
+            async with httpx.AsyncClient(follow_redirects=True) as session:
+                response = await session.get(url)
+        if response.status_code != 200: return None
+        return parse_content_md(response.content)
+
+
+#====================UTILS: ASYNC GET LINK METADATA====================#
+async def async_get_link_md(url, **kwargs):
+    return await LINK_CACHE.async_get_or_set(url, lambda: async_get_content_md(url, **kwargs))
+
+
+#====================UTILS: ASYNC GET THUMBNAIL====================#
+async def async_get_thumbnail(url, **kwargs):
+    session = kwargs.get("session")
+    # fetch the image content
+    async def fetch_thumbnail():
+        with timer("thumbnail"):
+            if session:
+                response = await session.get(url)
+            else:
+                async with httpx.AsyncClient(follow_redirects=True) as thumbnail_session:
+                    response = await thumbnail_session.get(url)
+        return response.content if response.status_code == 200 else None
+    return await THUMBNAIL_CACHE.async_get_or_set(url, fetch_thumbnail)
+
+
+#====================UTILS: PARSE CONTENT METADATA====================#
+def parse_content_md(content):
     # parse the page content
-    soup = BeautifulSoup(response.content, "html.parser")
+    soup = BeautifulSoup(content, "html.parser")
     # extract metadata
     description = soup.find("meta", property="og:description")
     thumbnail = soup.find("meta", property="og:image")
@@ -61,26 +210,147 @@ def validate_image_size(image_binary, **kwargs):
     return resized_binary if len(resized_binary := output.getvalue()) < limit else None
 
 
+#====================BLUESKY: GET SESSION PATH====================#
+def get_session_path(account_id, **kwargs):
+    session_dir = kwargs.get("session_dir", BLUESKY_SESSION_DIR)
+    return Path(session_dir) / ("%s.session" % re.sub(r"[^\w.@-]", "_", account_id))
+
+
+#====================BLUESKY: LOAD SESSION====================#
+def load_session(account_id, **kwargs):
+    session_path = get_session_path(account_id, **kwargs)
+    try:
+        return session_path.read_text().strip() if session_path.is_file() else None
+    except Exception as e:
+        log_except(logger, "Bluesky session has failed to be loaded", exception=e, object=account_id, level=logging.WARNING)
+
+
+#====================BLUESKY: SAVE SESSION====================#
+def save_session(account_id, session_string, **kwargs):
+    session_path = get_session_path(account_id, **kwargs)
+    try:
+        session_path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a private temporary file first so that readers never see a partial session
+        temp_path = session_path.with_name("%s.%s.%s.tmp" % (session_path.name, os.getpid(), threading.get_ident()))
+        temp_path.touch(mode=0o600)
+        temp_path.write_text(session_string)
+        os.replace(temp_path, session_path)
+    except Exception as e:
+        log_except(logger, "Bluesky session has failed to be saved", exception=e, object=account_id, level=logging.WARNING)
+
+
+#====================BLUESKY: PERSIST SESSION====================#
+def persist_session(client, account_id, **kwargs):
+    # save the session whenever it is created or refreshed
+    def on_session_change(event, session):
+        if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+            save_session(account_id, session.export(), **kwargs)
+    client.on_session_change(on_session_change)
+
+
+#====================BLUESKY: GET SESSION PROFILE====================#
+def get_session_profile(session):
+    # reject sessions that can no longer be refreshed
+    if (getattr(session.refresh_jwt_payload, "exp", None) or 0) <= time.time():
+        raise ValueError("Bluesky session can no longer be refreshed")
+    # build the profile of the session owner without contacting the server
+    return atproto_models.AppBskyActorDefs.ProfileViewDetailed(did=session.did, handle=session.handle)
+
+
+#====================BLUESKY: RESTORE SESSION====================#
+def restore_session(client, account_id, **kwargs):
+    if not (session_string := load_session(account_id, **kwargs)):
+        return
+    try:
+        # NOTE: the access token is refreshed by the client on its first request if it has expired
+        client.me = get_session_profile(client._import_session_string(session_string))
+    except Exception as e:
+        log_except(logger, "Bluesky session has failed to be restored", exception=e, object=account_id, level=logging.WARNING)
+        return
+    return client
+
+
+#====================BLUESKY: ASYNC RESTORE SESSION====================#
+async def async_restore_session(client, account_id, **kwargs):
+    if not (session_string := load_session(account_id, **kwargs)):
+        return
+    try:
+        # NOTE: the access token is refreshed by the client on its first request if it has expired
+        client.me = get_session_profile(await client._import_session_string(session_string))
+    except Exception as e:
+        log_except(logger, "Bluesky session has failed to be restored", exception=e, object=account_id, level=logging.WARNING)
+        return
+    return client
+
+
 #====================BLUESKY: INSTANTIATE====================#
-def instantiate(access_token, account_id):
+def instantiate(access_token, account_id, **kwargs):
+    base_url = kwargs.get("base_url")
     if not (access_token and account_id):
-        log_message = message("LOG_EVENT", event="Bluesky not configured to be instantiated")
-        logger.warning(log_message)
+        log_event(logger, "Bluesky not configured to be instantiated", level=logging.WARNING)
         return
     try:
-        client = Client()
-        client.login(
-            account_id,
-            Path(access_token).read_text().strip(),
-        )
+        credentials = (account_id, Path(access_token).read_text().strip())
+        # resume the stored session if possible, otherwise log in
+        if not (client := restore_session(SessionClient(base_url=base_url, credentials=credentials), account_id, **kwargs)):
+            client = SessionClient(base_url=base_url, credentials=credentials)
+            client.login(*credentials)
+            save_session(account_id, client.export_session_string(), **kwargs)
+        persist_session(client, account_id, **kwargs)
     except Exception as e:
-        verbose_error = "Bluesky has failed to be instantiated"
-        log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=account_id)
-        logger.error(log_error)
+        log_except(logger, "Bluesky has failed to be instantiated", exception=e, object=account_id)
         return
     return client
 
 
+#====================BLUESKY: ASYNC INSTANTIATE====================#
+async def async_instantiate(access_token, account_id, **kwargs):
+    base_url = kwargs.get("base_url")
+    # NOTE: the asynchronous client is only meant for the delivery engine, the functions without the async prefix take the client returned by instantiate
+    if not (access_token and account_id):
+        log_event(logger, "Bluesky not configured to be instantiated", level=logging.WARNING)
+        return
+    try:
+        credentials = (account_id, Path(access_token).read_text().strip())
+        # resume the stored session if possible, otherwise log in
+        if not (client := await async_restore_session(AsyncSessionClient(base_url=base_url, credentials=credentials), account_id, **kwargs)):
+            client = AsyncSessionClient(base_url=base_url, credentials=credentials)
+            await client.login(*credentials)
+            save_session(account_id, client.export_session_string(), **kwargs)
+        persist_session(client, account_id, **kwargs)
+    except Exception as e:
+        log_except(logger, "Bluesky has failed to be instantiated", exception=e, object=account_id)
+        return
+    return client
+
+
+#====================BLUESKY: ASYNC CLOSE====================#
+async def async_close(client):
+    await client.request.close()
+
+
+#====================BLUESKY: RUN WITH CLIENT====================#
+def run_with_client(client, func):
+    # run the asynchronous implementation on behalf of a client returned by instantiate, using a copy of its session
+    async def run():
+        session_string = client.export_session_string()
+        credentials = getattr(client, "credentials", None)
+        async_client = AsyncSessionClient(base_url=client._base_url, credentials=credentials)
+        await async_client._import_session_string(session_string)
+        async_client.me = client.me
+        if credentials:
+            persist_session(async_client, credentials[0])
+        try:
+            return await func(async_client)
+        finally:
+            # hand any refreshed session back as the previous one is no longer valid
+            if (refreshed_string := async_client.export_session_string()) != session_string:
+                client._import_session_string(refreshed_string)
+            client.ratelimit = get_ratelimit(async_client) or get_ratelimit(client)
+            await async_close(async_client)
+    return run_sync(run())
+
+
 #====================BLUESKY: CLEAN VISIBILITY====================#
 # NOTE: post visibility not currently supported on bluesky
 # def clean_visibility(visibility, **kwargs):
@@ -97,131 +367,198 @@ def prepare_post(title, tags, link, **kwargs):
     # set character limits
     char_limit = 300
     link_limit = sum((23, 2)) # additional 2 for newlines
-    # count characters
-    title_count = len(title)
-    tags_count = len(tags)
-    link_count = 0 if embed_only or not link else (link_limit if sum((len(link), 2)) > link_limit else sum((len(link), 2)))
-    emoji_count, emoji_length = count_emoji(title + tags + link)
+    link = link if embed_only or not link else "\n\n%s" % link
+    # count characters of the whole post at once, with each emoji counted once and the link no longer than its shortened form, or not at all if embedded
+    link_count = 0 if embed_only else min(len(link), link_limit)
+    post = message("FEED_POST", title=title, tags=tags, link=link)
+    post_text = analyse_text(post)
     # prioritise removing tags, then limiting title to accommodate link
-    if sum((title_count, tags_count, link_count, emoji_count - emoji_length)) > char_limit:
-        tags = ""
-        emoji_count = count_emoji(title + tags + link)[0]
-        title = title[:char_limit - (link_count + emoji_count)]
+    if post_text["graphemes"] - len(link) + link_count > char_limit:
+        emoji_count = count_emoji(title + link)[0]
+        post = message("FEED_POST", title=title[:char_limit - (link_count + emoji_count)], tags="", link=link)
     # return post content
-    return message(
-        "FEED_POST",
-        title=title,
-        tags=tags,
-        link=link if embed_only or not link else "\n\n%s" % link,
-    )
+    return post
 
 
 #====================BLUESKY: BUILD RICH POST====================#
 def build_rich_post(client, text, **kwargs):
+    return run_with_client(client, lambda bluesky: async_build_rich_post(bluesky, text, **kwargs))
+
+
+#====================BLUESKY: ASYNC BUILD RICH POST====================#
+async def async_build_rich_post(client, text, **kwargs):
+    blob_keys = kwargs.get("blob_keys")
     embed_only = kwargs.get("embed_only", False)
+    session = kwargs.get("session")
     # set facet character limits
     tag_limit = 64
     link_embed = None
     rich_post = client_utils.TextBuilder()
-    # define patterns
-    hashtag_pattern = r"#\w+"
-    mention_pattern = r"@\w+"
-    url_pattern = r"http[s]?://\S+"
-    # split the text using urls and keep the delimiters
-    parts = re.split("(%s)" % url_pattern, text)
+    # split the text into links, hashtags, mentions, and regular text
+    tokens = analyse_text(text, emoji_stats=False)["tokens"]
+    # resolve all mentioned users at once
+    user_dids = await async_resolve_handles(client, [value[1:] for kind, value in tokens if kind == "mention"])
     # build rich post
-    for part in parts:
+    for kind, value in tokens:
         # build link
-        if re.match(url_pattern, part):
+        if kind == "url":
             if not embed_only:
-                rich_post.link(part, part)
+                rich_post.link(value, value)
             # skip creating link embed object if one exists
             if link_embed:
                 continue
             # create link embed object if sufficient metadata
-            sufficient_metadata = (link_metadata := get_content_md(part)) and ((description := link_metadata.get("description")) and (title := link_metadata.get("title")))
+            sufficient_metadata = (link_metadata := await async_get_link_md(value, session=session)) and ((description := link_metadata.get("description")) and (title := link_metadata.get("title")))
             if sufficient_metadata:
-                # adhere to blob size limit
-                thumbnail_bin = validate_image_size(getattr(requests.get(thumbnail), "content", None), factor=1.0, quality=85) if (thumbnail := link_metadata.get("thumbnail")) else None
-                params = dict(
+                link_embed = build_link_embed(
+                    value,
                     description=description,
-                    thumb=client.upload_blob(data=thumbnail_bin).blob if thumbnail_bin else None,
+                    thumb=await async_upload_thumbnail(client, await async_get_thumbnail(thumbnail, session=session), blob_keys=blob_keys) if (thumbnail := link_metadata.get("thumbnail")) else None,
                     title=title,
-                    uri=part,
-                )
-                link_embed = atproto_models.AppBskyEmbedExternal.Main(
-                    external=atproto_models.AppBskyEmbedExternal.External(**params)
                 )
             # add link regardless if no metadata was extracted
-            rich_post.text("\n\n").link(part, part) if embed_only and not sufficient_metadata else None
+            rich_post.text("\n\n").link(value, value) if embed_only and not sufficient_metadata else None
+        # build hashtag if within allowed grapheme limit
+        elif kind == "hashtag" and len(value[1:]) <= tag_limit:
+            rich_post.tag(value, value[1:])
+        # build mention if valid
+        elif kind == "mention" and (user_did := user_dids.get(value[1:])):
+            rich_post.mention(value, user_did)
+        # add regular text
         else:
-            # split by spaces to handle individual words and hashtags - keep the spaces as separate elements
-            words = re.split(r'(\s+)', part)
-            for word in words:
-                # build hashtag if within allowed grapheme limit
-                if re.match(hashtag_pattern, word) and len(word[1:]) <= tag_limit:
-                    rich_post.tag(word, word[1:])
-                # build mention if valid
-                elif re.match(mention_pattern, word):
-                    user_did = getattr(get_user(client, word[1:]), "did", None)
-                    rich_post.mention(word, user_did) if user_did else rich_post.text(word)
-                # add regular text
-                else:
-                    rich_post.text(word)
+            rich_post.text(value)
     return rich_post, link_embed
 
 
+#====================BLUESKY: GET BLOB KEY====================#
+def get_blob_key(client, image_binary):
+    # identify an image by its content per account as blobs belong to the repository they were uploaded to
+    return "%s:%s" % (getattr(client.me, "did", None), hashlib.sha256(image_binary).hexdigest())
+
+
+#====================BLUESKY: ASYNC UPLOAD THUMBNAIL====================#
+async def async_upload_thumbnail(client, image_binary, **kwargs):
+    blob_keys = kwargs.get("blob_keys")
+    if not image_binary:
+        return
+    blob_key = get_blob_key(client, image_binary)
+    # upload image only if an identical one has not been uploaded by the account
+    async def upload_blob():
+        # note the blobs uploaded for the post being built so that they can be forgotten should it not be sent
+        if blob_keys is not None:
+            blob_keys.append(blob_key)
+        # adhere to blob size limit without blocking the event loop
+        with timer("image_resize"):
+            thumbnail_bin = await asyncio.to_thread(validate_image_size, image_binary, factor=1.0, quality=85)
+        if not thumbnail_bin:
+            return
+        with timer("blob_upload", host="bluesky"):
+            return (await client.upload_blob(data=thumbnail_bin)).blob
+    return await BLOB_CACHE.async_get_or_set(blob_key, upload_blob)
+
+
+#====================BLUESKY: BUILD LINK EMBED====================#
+def build_link_embed(uri, **kwargs):
+    params = dict(
+        description=kwargs.get("description"),
+        thumb=kwargs.get("thumb"),
+        title=kwargs.get("title"),
+        uri=uri,
+    )
+    return atproto_models.AppBskyEmbedExternal.Main(
+        external=atproto_models.AppBskyEmbedExternal.External(**params)
+    )
+
+
+#====================BLUESKY: BUILD POST EMBED====================#
+def build_post_embed(post_id, link_embed):
+    # NOTE: post update not currently supported on bluesky - alternative implementation would be to quote instead
+    if not post_id:
+        return link_embed
+    quote_embed = atproto_models.app.bsky.embed.record.Main(
+        record=atproto_models.ComAtprotoRepoStrongRef.Main(
+            uri=post_id.split(",")[0],
+            cid=post_id.split(",")[1]
+        )
+    )
+    return quote_embed if not link_embed else atproto_models.AppBskyEmbedRecordWithMedia.Main(record=quote_embed, media=link_embed)
+
+
 #====================BLUESKY: SEND POST====================#
 def send_post(content, **kwargs):
     access_token = kwargs.get("access_token")
     account_id = kwargs.get("account_id")
     bluesky = kwargs.get("bluesky")
+
+    # set up bluesky
+    if not (bluesky or (bluesky := instantiate(access_token, account_id))):
+        log_event(logger, "Bluesky has failed to be instantiated", level=logging.WARNING)
+        return
+
+    return run_with_client(bluesky, lambda async_bluesky: async_send_post(content, **dict(kwargs, bluesky=async_bluesky)))
+
+
+#====================BLUESKY: ASYNC SEND POST====================#
+async def async_send_post(content, **kwargs):
+    access_token = kwargs.get("access_token")
+    account_id = kwargs.get("account_id")
+    bluesky = kwargs.get("bluesky")
     params = kwargs.get("params", {})
     post_id = kwargs.get("post_id")
     receiver = kwargs.get("receiver")
-    # visibility = kwargs.get("visibility")
+    session = kwargs.get("session")
+    # close the client afterwards only if it is instantiated here
+    close = not bluesky
+    blob_keys = []
 
     # set up bluesky
-    if not (bluesky or (bluesky := instantiate(access_token, account_id))):
-        log_message = message("LOG_EVENT", event="Bluesky has failed to be instantiated")
-        logger.warning(log_message)
+    if not (bluesky or (bluesky := await async_instantiate(access_token, account_id))):
+        log_event(logger, "Bluesky has failed to be instantiated", level=logging.WARNING)
         return
 
     if receiver:
         content = "@%s %s" % (receiver.strip(), content)
-        # if not visibility:
-        #     visibility = "direct"
 
-    # make post rich
-    content, link_embed = build_rich_post(bluesky, content, embed_only=True)
-
-    # include link embed object if applicable
-    params.update(embed=link_embed) if link_embed else None
-
-    # send bluesky post
-    # NOTE: post update not currently supported on bluesky - alternative implementation would be to quote instead
-    if post_id:
-        quote_embed = atproto_models.app.bsky.embed.record.Main(
-            record=atproto_models.ComAtprotoRepoStrongRef.Main(
-                uri=post_id.split(",")[0],
-                cid=post_id.split(",")[1]
-            )
-        )
-        params.update(embed=quote_embed) if not link_embed else params.update(embed=atproto_models.AppBskyEmbedRecordWithMedia.Main(record=quote_embed, media=link_embed))
-    post = bluesky.send_post(text=content, **params)
+    try:
+        # make post rich
+        content, link_embed = await async_build_rich_post(bluesky, content, embed_only=True, blob_keys=blob_keys, session=session)
+
+        # include link or quote embed object if applicable
+        params.update(embed=embed) if (embed := build_post_embed(post_id, link_embed)) else None
+
+        # send bluesky post
+        with timer("status_post", host="bluesky"):
+            post = await bluesky.send_post(text=content, **params)
+    except Exception:
+        # forget blobs uploaded for the post as the server discards blobs that no record refers to
+        for blob_key in blob_keys:
+            BLOB_CACHE.delete(blob_key)
+        raise
+    finally:
+        if close:
+            await async_close(bluesky)
 
     # return post id
     return "%s,%s" % (getattr(post, "uri"), getattr(post, "cid"))
 
 
+#====================BLUESKY: ASYNC VERIFY CREDENTIALS====================#
+async def async_verify_credentials(bluesky):
+    # a resumed session is only checked by the server once it is used, which also refreshes it if it has expired
+    with timer("verify", host="bluesky"):
+        profile = await bluesky.get_profile(bluesky.me.did)
+
+    # return account handle
+    return getattr(profile, "handle")
+
+
 #====================BLUESKY: CHECK HEALTH====================#
 def check_health(**kwargs):
     account_objects = kwargs.get("account_objects", get_active_accounts(host="bluesky"))
     # visibility = "private"
 
     if not account_objects:
-        log_message = message("LOG_EVENT", event="No active account objects were found")
-        logger.info(log_message)
+        log_event(logger, "No active account objects were found")
         return
 
     for account in account_objects:
@@ -241,12 +578,9 @@ def check_health(**kwargs):
                 # visibility=visibility
             )
         except Exception as e:
-            verbose_error = 'Test post to "%s" has failed to be sent' % account_id
-            log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=content)
-            logger.error(log_error)
+            log_except(logger, 'Test post to "%s" has failed to be sent', account_id, exception=e, object=content)
         else:
-            log_message = message("LOG_EVENT", event='Test post to "%s" has been sent' % account_id)
-            logger.info(log_message)
+            log_event(logger, 'Test post to "%s" has been sent', account_id)
 
 
 #====================BLUESKY: UPDATE ACCOUNT====================#
@@ -257,60 +591,124 @@ def update_account(**kwargs):
 
     # set up bluesky
     if not (bluesky or (bluesky := instantiate(access_token, account_id))):
-        log_message = message("LOG_EVENT", event="Bluesky has failed to be instantiated")
-        logger.warning(log_message)
+        log_event(logger, "Bluesky has failed to be instantiated", level=logging.WARNING)
         return
 
-    # get current profile
-    current_profile_record = bluesky.app.bsky.actor.profile.get(bluesky.me.did, "self")
-    current_profile = getattr(current_profile_record, "value", None)
+    return run_with_client(bluesky, lambda async_bluesky: async_update_account(**dict(kwargs, bluesky=async_bluesky)))
 
-    # NOTE: this feature is experimental - build fields into description
-    description = kwargs.get("description", getattr(current_profile, "description", None))
-    if fields := kwargs.get("fields"):
-        if description:
-            description += "\n\n"
-        else:
-            description = ""
-        for field in fields:
-            description += "%s: %s\n" % (field[0], field[1])
-        description = description.rstrip("\n")
 
-    params = dict(
-        avatar=kwargs.get("avatar", getattr(current_profile, "avatar", None)), # not officially supported
-        banner=kwargs.get("banner", getattr(current_profile, "banner", None)), # not officially supported
-        created_at=kwargs.get("created_at", getattr(current_profile, "created_at", None)), # not officially supported
-        description=description,
-        display_name=kwargs.get("display_name", getattr(current_profile, "display_name", None)),
-        joined_via_starter_pack=kwargs.get("joined_via_starter_pack", getattr(current_profile, "joined_via_starter_pack", None)), # not officially supported
-        labels=kwargs.get("labels", getattr(current_profile, "labels", None)), # not officially supported
-        pinned_post=kwargs.get("pinned_post", getattr(current_profile, "pinned_post", None)), # not officially supported
-    )
+#====================BLUESKY: ASYNC UPDATE ACCOUNT====================#
+async def async_update_account(**kwargs):
+    access_token = kwargs.get("access_token")
+    account_id = kwargs.get("account_id")
+    bluesky = kwargs.get("bluesky")
+    # close the client afterwards only if it is instantiated here
+    close = not bluesky
 
-    # update bluesky account
-    account = bluesky.com.atproto.repo.put_record(
-        atproto_models.ComAtprotoRepoPutRecord.Data(
-            collection=atproto_models.ids.AppBskyActorProfile,
-            repo=bluesky.me.did,
-            rkey="self",
-            swap_record=getattr(current_profile_record, "cid", None),
-            record=atproto_models.AppBskyActorProfile.Record(**params),
+    # set up bluesky
+    if not (bluesky or (bluesky := await async_instantiate(access_token, account_id))):
+        log_event(logger, "Bluesky has failed to be instantiated", level=logging.WARNING)
+        return
+
+    try:
+        # get current profile
+        current_profile_record = await bluesky.app.bsky.actor.profile.get(bluesky.me.did, "self")
+        current_profile = getattr(current_profile_record, "value", None)
+
+        # NOTE: this feature is experimental - build fields into description
+        description = kwargs.get("description", getattr(current_profile, "description", None))
+        if fields := kwargs.get("fields"):
+            if description:
+                description += "\n\n"
+            else:
+                description = ""
+            for field in fields:
+                description += "%s: %s\n" % (field[0], field[1])
+            description = description.rstrip("\n")
+
+        params = dict(
+            avatar=kwargs.get("avatar", getattr(current_profile, "avatar", None)), # not officially supported
+            banner=kwargs.get("banner", getattr(current_profile, "banner", None)), # not officially supported
+            created_at=kwargs.get("created_at", getattr(current_profile, "created_at", None)), # not officially supported
+            description=description,
+            display_name=kwargs.get("display_name", getattr(current_profile, "display_name", None)),
+            joined_via_starter_pack=kwargs.get("joined_via_starter_pack", getattr(current_profile, "joined_via_starter_pack", None)), # not officially supported
+            labels=kwargs.get("labels", getattr(current_profile, "labels", None)), # not officially supported
+            pinned_post=kwargs.get("pinned_post", getattr(current_profile, "pinned_post", None)), # not officially supported
         )
-    )
+
+        # update bluesky account
+        account = await bluesky.com.atproto.repo.put_record(
+            atproto_models.ComAtprotoRepoPutRecord.Data(
+                collection=atproto_models.ids.AppBskyActorProfile,
+                repo=bluesky.me.did,
+                rkey="self",
+                swap_record=getattr(current_profile_record, "cid", None),
+                record=atproto_models.AppBskyActorProfile.Record(**params),
+            )
+        )
+    finally:
+        if close:
+            await async_close(bluesky)
     if account:
         account_id = bluesky.me.handle
-        log_message = message("LOG_EVENT", event='Bluesky account "%s" has been updated' % account_id)
-        logger.info(log_message)
+        log_event(logger, 'Bluesky account "%s" has been updated', account_id)
     return account
 
 
 #====================BLUESKY: GET USER====================#
 def get_user(client, handle):
+    return run_with_client(client, lambda bluesky: async_get_user(bluesky, handle))
+
+
+#====================BLUESKY: ASYNC GET USER====================#
+async def async_get_user(client, handle):
     user = None
     try:
-        user = client.get_profile(handle)
+        user = await client.get_profile(handle)
     except Exception as e:
-        verbose_error = 'Failed to get user "%s" profile' % handle
-        log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=handle)
-        logger.error(log_error)
+        log_except(logger, 'Failed to get user "%s" profile', handle, exception=e, object=handle)
     return user
+
+
+#====================BLUESKY: GET UNRESOLVED HANDLES====================#
+def get_unresolved_handles(handles, user_dids):
+    unresolved_handles = []
+    for handle in dict.fromkeys(handles):
+        # use cached did or resolve handle if it is valid
+        if (user_did := HANDLE_CACHE.get(handle.lower(), default=MISSING)) is not MISSING:
+            user_dids[handle] = user_did
+        elif HANDLE_PATTERN.match(handle):
+            unresolved_handles.append(handle)
+        else:
+            user_dids[handle] = None
+    return unresolved_handles
+
+
+#====================BLUESKY: CACHE PROFILES====================#
+def cache_profiles(handles, profiles, user_dids):
+    found = dict()
+    for profile in profiles:
+        found[profile.handle.lower()] = found[profile.did.lower()] = profile.did
+    # cache missing handles as negative lookups
+    for handle in handles:
+        user_dids[handle] = found.get(handle.lower())
+        HANDLE_CACHE.set(handle.lower(), user_dids[handle])
+
+
+#====================BLUESKY: ASYNC RESOLVE HANDLES====================#
+async def async_resolve_handles(client, handles):
+    user_dids = dict()
+    unresolved_handles = get_unresolved_handles(handles, user_dids)
+    # resolve uncached handles in batches
+    for i in range(0, len(unresolved_handles), PROFILES_LIMIT):
+        batch = unresolved_handles[i:i + PROFILES_LIMIT]
+        try:
+            profiles = (await client.get_profiles(batch)).profiles
+        except Exception as e:
+            log_except(logger, 'Failed to get user profiles "%s"', batch, exception=e, object=batch)
+            # resolve handles individually without caching failures
+            user_dids.update({handle: getattr(await async_get_user(client, handle), "did", None) for handle in batch})
+            continue
+        cache_profiles(batch, profiles, user_dids)
+    return user_dids
@@ -1,12 +1,21 @@
+import httpx
 import logging
+import os
 from mastodon import Mastodon
 from django.conf import settings
 from base.methods import (
+    analyse_text,
     count_emoji,
     get_active_accounts,
     get_domain,
     message,
 )
+from base.logs import (
+    log_event,
+    log_except,
+)
+from base.metrics import timer
+from base.ratelimit import parse_ratelimit
 logger = logging.getLogger("base")
 
 
@@ -14,11 +23,18 @@ logger = logging.getLogger("base")
 DEFAULT_VISIBILITY = getattr(settings, "DEFAULT_VISIBILITY")
 
 
+#====================MASTODON: NORMALISE URL====================#
+def normalise_url(url):
+    # add the missing scheme and trailing slashes that break some endpoints, as done by Mastodon.py
+    if not url.startswith(("http://", "https://")):
+        url = "https://%s" % url
+    return url.rstrip("/")
+
+
 #====================MASTODON: INSTANTIATE====================#
 def instantiate(access_token, home_instance):
     if not (access_token and home_instance):
-        log_message = message("LOG_EVENT", event="Mastodon not configured to be instantiated")
-        logger.warning(log_message)
+        log_event(logger, "Mastodon not configured to be instantiated", level=logging.WARNING)
         return
     try:
         client = Mastodon(
@@ -26,13 +42,56 @@ def instantiate(access_token, home_instance):
             api_base_url=home_instance,
         )
     except Exception as e:
-        verbose_error = "Mastodon has failed to be instantiated"
-        log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=access_token)
-        logger.error(log_error)
+        log_except(logger, "Mastodon has failed to be instantiated", exception=e, object=access_token)
+        return
+    return client
+
+
+#====================MASTODON: ASYNC INSTANTIATE====================#
+async def async_instantiate(access_token, home_instance):
+    # NOTE: the asynchronous client is only meant for the delivery engine, the functions without the async prefix use Mastodon.py
+    if not (access_token and home_instance):
+        log_event(logger, "Mastodon not configured to be instantiated", level=logging.WARNING)
+        return
+    try:
+        # read access token from file if applicable, as done by Mastodon.py
+        if os.path.isfile(access_token):
+            with open(access_token, "r") as f:
+                access_token = f.readline().rstrip()
+        client = httpx.AsyncClient(
+            base_url=normalise_url(home_instance),
+            headers={"Authorization" : "Bearer %s" % access_token},
+        )
+        client.ratelimit = None
+
+        # keep the rate limit budget reported by the latest response
+        async def update_ratelimit(response):
+            client.ratelimit = parse_ratelimit(response.headers) or client.ratelimit
+
+        client.event_hooks = dict(response=[update_ratelimit])
+    except Exception as e:
+        log_except(logger, "Mastodon has failed to be instantiated", exception=e, object=access_token)
         return
     return client
 
 
+#====================MASTODON: GET RATE LIMIT====================#
+def get_ratelimit(client):
+    if isinstance(client, httpx.AsyncClient):
+        return getattr(client, "ratelimit", None)
+    # rate limit budget as tracked by Mastodon.py
+    return dict(
+        limit=getattr(client, "ratelimit_limit", None),
+        remaining=getattr(client, "ratelimit_remaining", None),
+        reset=getattr(client, "ratelimit_reset", None),
+    )
+
+
+#====================MASTODON: ASYNC CLOSE====================#
+async def async_close(client):
+    await client.aclose()
+
+
 #====================MASTODON: CLEAN VISIBILITY====================#
 def clean_visibility(visibility, **kwargs):
     default_visibility = kwargs.get("default_visibility", DEFAULT_VISIBILITY)
@@ -47,23 +106,33 @@ def prepare_post(title, tags, link):
     # set character limits
     char_limit = 500
     link_limit = sum((23, 2)) # additional 2 for newlines
-    # count characters
-    title_count = len(title)
-    tags_count = len(tags)
-    link_count = 0 if not link else (link_limit if sum((len(link), 2)) > link_limit else sum((len(link), 2)))
-    emoji_count, emoji_length = count_emoji(title + tags + link)
+    link = "\n\n%s" % link if link else link
+    # count characters of the whole post at once, with each emoji counted once and the link no longer than its shortened form
+    link_count = min(len(link), link_limit)
+    post = message("FEED_POST", title=title, tags=tags, link=link)
+    post_text = analyse_text(post)
     # prioritise removing tags, then limiting title to accommodate link
-    if sum((title_count, tags_count, link_count, emoji_count - emoji_length)) > char_limit:
-        tags = ""
-        emoji_count = count_emoji(title + tags + link)[0]
-        title = title[:char_limit - (link_count + emoji_count)]
+    if post_text["graphemes"] - len(link) + link_count > char_limit:
+        emoji_count = count_emoji(title + link)[0]
+        post = message("FEED_POST", title=title[:char_limit - (link_count + emoji_count)], tags="", link=link)
     # return post content
-    return message(
-        "FEED_POST",
-        title=title,
-        tags=tags,
-        link="\n\n%s" % link if link else link,
+    return post
+
+
+#====================MASTODON: BUILD POST PARAMS====================#
+def build_post_params(content, **kwargs):
+    receiver = kwargs.get("receiver")
+    visibility = kwargs.get("visibility")
+
+    if receiver:
+        content = "@%s %s" % (receiver.strip(), content)
+        if not visibility:
+            visibility = "direct"
+
+    params = dict(
+        visibility=clean_visibility(visibility),
     )
+    return content, params
 
 
 #====================MASTODON: SEND POST====================#
@@ -77,37 +146,74 @@ def send_post(content, **kwargs):
 
     # set up mastodon
     if not (mastodon or (mastodon := instantiate(access_token, api_base_url))):
-        log_message = message("LOG_EVENT", event="Mastodon has failed to be instantiated")
-        logger.warning(log_message)
+        log_event(logger, "Mastodon has failed to be instantiated", level=logging.WARNING)
         return
 
-    if receiver:
-        content = "@%s %s" % (receiver.strip(), content)
-        if not visibility:
-            visibility = "direct"
-
-    params = dict(
-        visibility=clean_visibility(visibility),
-    )
+    content, params = build_post_params(content, receiver=receiver, visibility=visibility)
 
     # send mastodon post
-    if not post_id:
-        post = mastodon.status_post(content, **params)
-    else:
-        post = mastodon.status_update(post_id, status=content)
+    with timer("status_post", host="mastodon"):
+        if not post_id:
+            post = mastodon.status_post(content, **params)
+        else:
+            post = mastodon.status_update(post_id, status=content)
 
     # return post id
     return post.get("id")
 
 
+#====================MASTODON: ASYNC SEND POST====================#
+async def async_send_post(content, **kwargs):
+    access_token = kwargs.get("access_token")
+    api_base_url = kwargs.get("api_base_url")
+    mastodon = kwargs.get("mastodon")
+    post_id = kwargs.get("post_id")
+    receiver = kwargs.get("receiver")
+    visibility = kwargs.get("visibility")
+    # close the client afterwards only if it is instantiated here
+    close = not mastodon
+
+    # set up mastodon
+    if not (mastodon or (mastodon := await async_instantiate(access_token, api_base_url))):
+        log_event(logger, "Mastodon has failed to be instantiated", level=logging.WARNING)
+        return
+
+    content, params = build_post_params(content, receiver=receiver, visibility=visibility)
+
+    try:
+        # send mastodon post
+        with timer("status_post", host="mastodon"):
+            if not post_id:
+                response = await mastodon.post("/api/v1/statuses", data=dict(status=content, **params))
+            else:
+                response = await mastodon.put("/api/v1/statuses/%s" % post_id, data=dict(status=content))
+    finally:
+        if close:
+            await async_close(mastodon)
+    response.raise_for_status()
+
+    # return post id
+    return response.json().get("id")
+
+
+#====================MASTODON: ASYNC VERIFY CREDENTIALS====================#
+async def async_verify_credentials(mastodon):
+    # check the access token without posting, as done by account_verify_credentials of Mastodon.py
+    with timer("verify", host="mastodon"):
+        response = await mastodon.get("/api/v1/accounts/verify_credentials")
+    response.raise_for_status()
+
+    # return account name
+    return response.json().get("acct")
+
+
 #====================MASTODON: CHECK HEALTH====================#
 def check_health(**kwargs):
     account_objects = kwargs.get("account_objects", get_active_accounts(host="mastodon"))
     visibility = "private"
 
     if not account_objects:
-        log_message = message("LOG_EVENT", event="No active account objects were found")
-        logger.info(log_message)
+        log_event(logger, "No active account objects were found")
         return
 
     for account in account_objects:
@@ -127,16 +233,53 @@ def check_health(**kwargs):
                 visibility=visibility
             )
         except Exception as e:
-            verbose_error = 'Test post to "%s" has failed to be sent' % account_id
-            log_error = message("LOG_EXCEPT", exception=e, verbose=verbose_error, object=content)
-            logger.error(log_error)
+            log_except(logger, 'Test post to "%s" has failed to be sent', account_id, exception=e, object=content)
         else:
-            log_message = message("LOG_EVENT", event='Test post to "%s" has been sent' % account_id)
-            logger.info(log_message)
+            log_event(logger, 'Test post to "%s" has been sent', account_id)
+
+
+#====================MASTODON: BUILD ACCOUNT PARAMS====================#
+def build_account_params(**kwargs):
+    fields = kwargs.pop("fields", None)
+    # flatten profile fields into form attributes, as done by account_update_credentials of Mastodon.py
+    if fields is not None:
+        if len(fields) > 4:
+            raise ValueError("A maximum of four fields are allowed")
+        for idx, (field_name, field_value) in enumerate(fields):
+            kwargs["fields_attributes[%s][name]" % idx] = field_name
+            kwargs["fields_attributes[%s][value]" % idx] = field_value
+    # send booleans as flags and leave out unset values
+    return {key: ("1" if value else "0") if isinstance(value, bool) else value for key, value in kwargs.items() if value is not None}
 
 
 #====================MASTODON: UPDATE ACCOUNT====================#
 def update_account(**kwargs):
+    access_token = kwargs.get("access_token")
+    api_base_url = kwargs.get("api_base_url")
+    mastodon = kwargs.get("mastodon")
+
+    # set up mastodon
+    if not (mastodon or (mastodon := instantiate(access_token, api_base_url))):
+        log_event(logger, "Mastodon has failed to be instantiated", level=logging.WARNING)
+        return
+
+    params = dict(
+        bot=kwargs.get("bot"),
+        discoverable=kwargs.get("discoverable"),
+        display_name=kwargs.get("display_name"),
+        fields=kwargs.get("fields"),
+        locked=kwargs.get("locked"),
+        note=kwargs.get("note"),
+    )
+
+    # update mastodon account
+    account = mastodon.account_update_credentials(**params)
+    log_account_update(account)
+    return account
+
+
+#====================MASTODON: ASYNC UPDATE ACCOUNT====================#
+async def async_update_account(**kwargs):
     access_token = kwargs.get("access_token")
     api_base_url = kwargs.get("api_base_url")
     bot = kwargs.get("bot")
@@ -146,14 +289,15 @@ def update_account(**kwargs):
     locked = kwargs.get("locked")
     mastodon = kwargs.get("mastodon")
     note = kwargs.get("note")
+    # close the client afterwards only if it is instantiated here
+    close = not mastodon
 
     # set up mastodon
-    if not (mastodon or (mastodon := instantiate(access_token, api_base_url))):
-        log_message = message("LOG_EVENT", event="Mastodon has failed to be instantiated")
-        logger.warning(log_message)
+    if not (mastodon or (mastodon := await async_instantiate(access_token, api_base_url))):
+        log_event(logger, "Mastodon has failed to be instantiated", level=logging.WARNING)
         return
 
-    params = dict(
+    params = build_account_params(
         bot=bot,
         discoverable=discoverable,
         display_name=display_name,
@@ -162,12 +306,22 @@ def update_account(**kwargs):
         note=note,
     )
 
-    # update mastodon account
-    account = mastodon.account_update_credentials(**params)
+    try:
+        # update mastodon account
+        response = await mastodon.patch("/api/v1/accounts/update_credentials", data=params)
+    finally:
+        if close:
+            await async_close(mastodon)
+    response.raise_for_status()
+    account = response.json()
+    log_account_update(account)
+    return account
+
+
+#====================MASTODON: LOG ACCOUNT UPDATE====================#
+def log_account_update(account):
     if account:
         url = account.get("url")
         username = account.get("username")
         account_id = "%s@%s" % (username, get_domain(url)) if url and username else None
-        log_message = message("LOG_EVENT", event='Mastodon account "%s" has been updated' % account_id)
-        logger.info(log_message)
-    return account
+        log_event(logger, 'Mastodon account "%s" has been updated', account_id)
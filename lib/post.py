@@ -1,12 +1,23 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import (
+    Exists,
+    OuterRef,
+    Q,
+)
 from base.methods import (
+    get_delivery_model,
     get_expired_date,
     get_post_model,
-    get_values_list,
+    iter_chunks,
 )
 from base.post import clean_data as _clean_data
+from lib.scheduler import bulk_schedule_post
+DeliveryModel = get_delivery_model()
 PostModel = get_post_model()
+# primary keys of model objects saved within a bulk ingest, if any
+INGESTED_OBJECTS = ContextVar("ingested_objects", default=None)
 
 
 #====================SETTINGS: GETATTR====================#
@@ -14,15 +25,51 @@ POST_DATE = getattr(settings, "POST_DATE")
 POST_EXPIRY = getattr(settings, "POST_EXPIRY")
 
 
-#====================POST: CLEAN DATA====================#
-def clean_data(**kwargs):
+#====================POST: GET CLEAN CANDIDATES====================#
+def get_clean_candidates():
+    expired_date = get_expired_date(POST_EXPIRY)
+    is_posted = Exists(DeliveryModel.objects.filter(subject=OuterRef("pk")))
+
     # populate deletion candidates with (model objects that have been posted and not currently scheduled) or (model objects that have been created past expiry date)
     deletion_candidates = PostModel.objects.filter(
-        (Q(post_id__isnull=False) & Q(postschedule__isnull=True)) |
-        Q(**{"%s__lte" % POST_DATE: get_expired_date(POST_EXPIRY)})
+        (Q(is_posted) & Q(postschedule__isnull=True)) |
+        Q(**{"%s__lte" % POST_DATE: expired_date})
     )
 
-    # populate schedule candidates with model objects that have neither been posted nor scheduled and not among the deletion candidates
-    schedule_candidates = PostModel.objects.filter(post_id__isnull=True, postschedule__isnull=True).exclude(pk__in=get_values_list("pk", queryset=deletion_candidates))
+    # populate schedule candidates with model objects that have neither been posted nor scheduled and not among the deletion candidates, i.e. not past expiry date
+    schedule_candidates = PostModel.objects.filter(~is_posted, postschedule__isnull=True, **{"%s__gt" % POST_DATE: expired_date})
+
+    return deletion_candidates, schedule_candidates
+
+
+#====================POST: CLEAN DATA====================#
+def clean_data(**kwargs):
+    return _clean_data(*get_clean_candidates(), **kwargs)
+
+
+#====================POST: SCHEDULE NEW POSTS====================#
+def schedule_new_posts(subject_objects, **kwargs):
+    # schedule model objects that have not been scheduled with a single query, leaving expiry to the callers that collect them
+    candidates = subject_objects.filter(postschedule__isnull=True)
+    return bulk_schedule_post(candidates, **kwargs)
+
+
+#====================POST: GET INGESTED OBJECTS====================#
+def get_ingested_objects():
+    return INGESTED_OBJECTS.get()
+
 
-    _clean_data(deletion_candidates, schedule_candidates, **kwargs)
+#====================POST: BULK INGEST====================#
+@contextmanager
+def bulk_ingest(**kwargs):
+    batch_size = kwargs.get("batch_size", 500)
+    # collect saved model objects instead of scheduling each of them as they are saved
+    ingested_objects = []
+    token = INGESTED_OBJECTS.set(ingested_objects)
+    try:
+        yield ingested_objects
+    finally:
+        INGESTED_OBJECTS.reset(token)
+    # schedule the model objects that have been saved only once the block has exited cleanly, discarding them after an error
+    for pks in iter_chunks(dict.fromkeys(ingested_objects), batch_size):
+        schedule_new_posts(PostModel.objects.filter(pk__in=pks), batch_size=batch_size)
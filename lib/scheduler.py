@@ -1,9 +1,24 @@
+import time
 from django.conf import settings
-from base.methods import get_schedule_model
+from django.db.models import (
+    Exists,
+    OuterRef,
+)
+from base.methods import (
+    get_delivery_model,
+    get_post_model,
+    get_schedule_model,
+)
+from base.metrics import COMMAND_LAST_SUCCESS
 from base.scheduler import (
+    backfill_deliveries as _backfill_deliveries,
+    bulk_schedule_post as _bulk_schedule_post,
+    get_queue_status as _get_queue_status,
     post_scheduler as _post_scheduler,
     schedule_post as _schedule_post,
 )
+DeliveryModel = get_delivery_model()
+PostModel = get_post_model()
 ScheduleModel = get_schedule_model()
 
 
@@ -16,11 +31,54 @@ def schedule_post(subject_object, **kwargs):
     _schedule_post(ScheduleModel, subject_object, **kwargs)
 
 
-#====================SCHEDULER: POST SCHEDULER====================#
-def post_scheduler(**kwargs):
+#====================SCHEDULER: BULK SCHEDULE POST====================#
+def bulk_schedule_post(subject_objects, **kwargs):
+    return _bulk_schedule_post(ScheduleModel, subject_objects, **kwargs)
+
+
+#====================SCHEDULER: BACKFILL DELIVERIES====================#
+def backfill_deliveries(**kwargs):
+    return _backfill_deliveries(DeliveryModel, PostModel.objects.all(), **kwargs)
+
+
+#====================SCHEDULER: GET LEGACY SUBJECTS====================#
+def get_legacy_subjects():
+    # scheduled PostModel objects without any deliveries, which may have been sent before deliveries were recorded
+    return PostModel.objects.filter(
+        Exists(ScheduleModel.objects.filter(subject=OuterRef("pk"))),
+        ~Exists(DeliveryModel.objects.filter(subject=OuterRef("pk"))),
+    )
+
+
+#====================SCHEDULER: GET PENDING QUERY====================#
+def get_pending_query():
+    # ScheduleModel objects that have not been delivered to any account are pending, the rest are updating
+    return ~Exists(DeliveryModel.objects.filter(subject=OuterRef("subject")))
+
+
+#====================SCHEDULER: GET SCHEDULE OBJECTS====================#
+def get_schedule_objects(**kwargs):
+    order = kwargs.get("order", POST_ORDER)
+    pending_query = get_pending_query()
     # get ScheduleModel objects that have not been posted, ordered by priority (ascending)
-    pending_objects = ScheduleModel.objects.filter(subject__post_id__isnull=True).order_by(POST_ORDER)
+    pending_objects = ScheduleModel.objects.filter(pending_query).order_by(order)
     # get ScheduleModel objects that have been posted, ordered by priority (ascending)
-    updating_objects = ScheduleModel.objects.filter(subject__post_id__isnull=False).order_by(POST_ORDER)
+    updating_objects = ScheduleModel.objects.filter(~pending_query).order_by(order)
+    return pending_objects, updating_objects
+
+
+#====================SCHEDULER: GET QUEUE STATUS====================#
+def get_queue_status():
+    return _get_queue_status(ScheduleModel.objects.all(), get_pending_query(), DeliveryModel.objects.all())
+
+
+#====================SCHEDULER: POST SCHEDULER====================#
+def post_scheduler(**kwargs):
+    # backfill the legacy post IDs of scheduled objects first so that they are not sent again as new posts
+    _backfill_deliveries(DeliveryModel, get_legacy_subjects())
 
-    _post_scheduler(pending_objects, updating_objects, **kwargs)
+    outcomes = _post_scheduler(*get_schedule_objects(), **kwargs)
+    # only count the run as a success if it has sent a post or none of its posts have failed
+    if outcomes["sent"] or not outcomes["failed"]:
+        COMMAND_LAST_SUCCESS.set(time.time(), command="post_scheduler")
+    return outcomes
@@ -1,4 +1,10 @@
 from .account import AccountObject
 from .feed import FeedObject
 from .post import PostItem
+# deliveries reference the post model, which has to be registered first
+from .delivery import PostDelivery
 from .schedule import PostSchedule
+from .sync import (
+    SyncRecord,
+    SyncSource,
+)
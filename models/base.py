@@ -22,7 +22,7 @@ class ObjectScheduleMeta(models.base.ModelBase):
                     null=False,
                     on_delete=models.CASCADE,
                     verbose_name=_("Subject"),
-                    help_text=_("Scheduled subject.")
+                    help_text=dct.get("SubjectHelpText", _("Scheduled subject."))
                 )
                 new_class.add_to_class("subject", subject_field)
         return new_class
@@ -45,6 +45,7 @@ class ObjectSchedule(models.Model, metaclass=ObjectScheduleMeta):
         blank=False,
         null=False,
         default=timezone.now,
+        db_index=True,
         verbose_name=_("Date scheduled"),
         help_text=_("Date when the task was scheduled.")
     )
@@ -56,6 +57,53 @@ class ObjectSchedule(models.Model, metaclass=ObjectScheduleMeta):
         return str(self.pk)
 
 
+#====================BASE: OBJECT DELIVERY====================#
+class ObjectDelivery(models.Model, metaclass=ObjectScheduleMeta):
+    class Meta:
+        abstract = True
+        unique_together = (("subject", "account_id"))
+
+    SubjectHelpText = _("Delivered subject.")
+
+    account_id = models.CharField(
+        blank=False,
+        null=False,
+        max_length=255,
+        verbose_name=_("Account ID"),
+        help_text=_("ID of the account the subject was delivered to.")
+    )
+
+    remote_id = models.CharField(
+        blank=False,
+        null=False,
+        max_length=255,
+        verbose_name=_("Remote ID"),
+        help_text=_("ID of the published post on the account.")
+    )
+
+    content_hash = models.CharField(
+        blank=True,
+        null=True,
+        max_length=64,
+        verbose_name=_("Content hash"),
+        help_text=_("Hash of the post content when it was last sent.")
+    )
+
+    sent_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_index=True,
+        verbose_name=_("Sent at"),
+        help_text=_("Date when the post was last sent.")
+    )
+
+    def __str__(self):
+        return str(self.pk)
+
+    def __unicode__(self):
+        return str(self.pk)
+
+
 #====================BASE: OBJECT ITEM====================#
 class ObjectItem(models.Model):
     class Meta:
@@ -65,7 +113,7 @@ class ObjectItem(models.Model):
         blank=True,
         null=True,
         verbose_name=_("Post ID"),
-        help_text=_("ID of the published object post.")
+        help_text=_("Legacy IDs of the published object post, superseded by deliveries.")
     )
 
     item_id = models.CharField(
@@ -103,6 +151,7 @@ class ObjectItem(models.Model):
         blank=False,
         null=False,
         default=timezone.now,
+        db_index=True,
         verbose_name=_("Date created"),
         help_text=_("Date when the object was created.")
     )
@@ -0,0 +1,13 @@
+from django.utils.translation import gettext_lazy as _
+from base.methods import get_post_model
+from base.models.base import ObjectDelivery
+PostModel = get_post_model()
+
+
+#====================DELIVERY: POST====================#
+class PostDelivery(ObjectDelivery):
+    class Meta(ObjectDelivery.Meta):
+        verbose_name = "Post Delivery"
+        verbose_name_plural = "post deliveries"
+
+    SubjectReference = PostModel
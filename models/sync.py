@@ -0,0 +1,109 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+#=====================SYNC: SOURCE====================#
+class SyncSource(models.Model):
+    class Meta:
+        verbose_name = "Sync source"
+        verbose_name_plural = "sync sources"
+
+    name = models.CharField(
+        blank=False,
+        null=False,
+        unique=True,
+        max_length=255,
+        verbose_name=_("Name"),
+        help_text=_("Key of the source in the sync configuration.")
+    )
+
+    path = models.TextField(
+        blank=False,
+        null=False,
+        verbose_name=_("Path"),
+        help_text=_("Path of the data file.")
+    )
+
+    mtime = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("Modification time"),
+        help_text=_("Modification time of the data file when it was last synced.")
+    )
+
+    size = models.BigIntegerField(
+        blank=True,
+        null=True,
+        verbose_name=_("Size"),
+        help_text=_("Size of the data file when it was last synced.")
+    )
+
+    config_digest = models.CharField(
+        blank=True,
+        null=True,
+        max_length=64,
+        verbose_name=_("Config digest"),
+        help_text=_("Hash of the sync configuration when it was last synced.")
+    )
+
+    digest = models.CharField(
+        blank=True,
+        null=True,
+        max_length=64,
+        verbose_name=_("Digest"),
+        help_text=_("Hash of the data file content and sync configuration when it was last synced.")
+    )
+
+    date_synced = models.DateTimeField(
+        blank=False,
+        null=False,
+        default=timezone.now,
+        verbose_name=_("Date synced"),
+        help_text=_("Date when the source was last synced.")
+    )
+
+    def __str__(self):
+        return str(self.pk)
+
+    def __unicode__(self):
+        return str(self.pk)
+
+
+#=====================SYNC: RECORD====================#
+class SyncRecord(models.Model):
+    class Meta:
+        verbose_name = "Sync record"
+        verbose_name_plural = "sync records"
+        unique_together = (("source", "identifier"))
+
+    source = models.ForeignKey(
+        SyncSource,
+        blank=False,
+        null=False,
+        on_delete=models.CASCADE,
+        verbose_name=_("Source"),
+        help_text=_("Source of the record.")
+    )
+
+    identifier = models.CharField(
+        blank=False,
+        null=False,
+        max_length=255,
+        verbose_name=_("Identifier"),
+        help_text=_("Unique identifier of the record within its source.")
+    )
+
+    digest = models.CharField(
+        blank=False,
+        null=False,
+        max_length=64,
+        verbose_name=_("Digest"),
+        help_text=_("Hash of the record content when it was last synced.")
+    )
+
+    def __str__(self):
+        return str(self.pk)
+
+    def __unicode__(self):
+        return str(self.pk)
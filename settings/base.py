@@ -8,15 +8,22 @@ from base.settings import *
 COMPULSORY_SETTINGS.extend([
     "ORGANIC_POSTS",
     "ACCOUNT_MODEL",
+    "DELIVERY_MODEL",
     "FEED_MODEL",
     "POST_MODEL",
     "SCHEDULE_MODEL",
     "SCHEDULER_TIMEZONE",
     "DEFAULT_VISIBILITY",
+    "CLEAN_CHUNK_SIZE",
+    "CLEAN_TIME_BUDGET",
     "POST_DATE",
+    "POST_ENGINE",
     "POST_EXPIRY",
+    "POST_FLUSH_INTERVAL",
+    "POST_FLUSH_SIZE",
     "POST_LIMIT",
     "POST_ORDER",
+    "POST_WORKERS",
     "RETRY_POST",
     "CELERY_BROKER_URL",
     "CELERY_RESULT_BACKEND",
@@ -24,10 +31,37 @@ COMPULSORY_SETTINGS.extend([
     "DATA_DIR",
     "ACCOUNTS_DATA_FILE",
     "FEEDS_DATA_FILE",
+    "SYNC_BATCH_SIZE",
+    "SYNC_BULK",
+    "SYNC_CHUNK_SIZE",
     "SYNC_CONFIG",
+    "SYNC_INCREMENTAL",
+    "BLUESKY_SESSION_DIR",
+    "BLOB_CACHE_TTL",
+    "CACHE_DIR",
+    "EMOJI_CACHE_SIZE",
+    "HANDLE_CACHE_NEGATIVE_TTL",
+    "HANDLE_CACHE_TTL",
+    "LINK_CACHE_SIZE",
+    "LINK_CACHE_TTL",
+    "THUMBNAIL_CACHE_SIZE",
+    "RATE_LIMIT_BURST",
+    "RATE_LIMIT_HOST_BURST",
+    "RATE_LIMIT_HOST_RATE",
+    "RATE_LIMIT_MAX_WAIT",
+    "RATE_LIMIT_RATE",
+    "METRICS_DIR",
+    "HEALTH_INTERVAL",
+    "HEALTH_TIMEOUT",
+    "HEALTH_VERIFY",
+    "LOG_MAX_ITEMS",
+    "LOG_MAX_LENGTH",
+    "LOG_QUEUE",
+    "LOG_QUEUE_ROOT",
 ])
 ORGANIC_POSTS = os.getenv("ORGANIC_POSTS", False) == "true"
 ACCOUNT_MODEL = os.getenv("ACCOUNT_MODEL", "base.AccountObject")
+DELIVERY_MODEL = os.getenv("DELIVERY_MODEL", "base.PostDelivery")
 FEED_MODEL = os.getenv("FEED_MODEL", "base.FeedObject")
 POST_MODEL = os.getenv("POST_MODEL", "base.PostItem")
 SCHEDULE_MODEL = os.getenv("SCHEDULE_MODEL", "base.PostSchedule")
@@ -39,10 +73,16 @@ SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE", "Asia/Kuala_Lumpur")
 ##################################################################
 
 DEFAULT_VISIBILITY = os.getenv("DEFAULT_VISIBILITY", "public")
+CLEAN_CHUNK_SIZE = int(os.getenv("CLEAN_CHUNK_SIZE", "500"))
+CLEAN_TIME_BUDGET = float(os.getenv("CLEAN_TIME_BUDGET", "0"))
 POST_DATE = os.getenv("POST_DATE", "date_created")
+POST_ENGINE = os.getenv("POST_ENGINE", "sync")
 POST_EXPIRY = int(os.getenv("POST_EXPIRY", "3"))
+POST_FLUSH_INTERVAL = int(os.getenv("POST_FLUSH_INTERVAL", "5"))
+POST_FLUSH_SIZE = int(os.getenv("POST_FLUSH_SIZE", "20"))
 POST_LIMIT = int(os.getenv("POST_LIMIT", "0"))
 POST_ORDER = os.getenv("POST_ORDER", "id")
+POST_WORKERS = int(os.getenv("POST_WORKERS", "1"))
 RETRY_POST = os.getenv("RETRY_POST", True) != "false"
 
 
@@ -62,6 +102,10 @@ CELERY_TIMEZONE = SCHEDULER_TIMEZONE
 DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
 ACCOUNTS_DATA_FILE = os.getenv("ACCOUNTS_DATA_FILE", os.path.join(DATA_DIR, "accounts.json"))
 FEEDS_DATA_FILE = os.getenv("FEEDS_DATA_FILE", os.path.join(DATA_DIR, "feeds.json"))
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+SYNC_BULK = os.getenv("SYNC_BULK", True) != "false"
+SYNC_CHUNK_SIZE = int(os.getenv("SYNC_CHUNK_SIZE", "5000"))
+SYNC_INCREMENTAL = os.getenv("SYNC_INCREMENTAL", True) != "false"
 SYNC_CONFIG = {
     "accounts" : {
         "model" : ACCOUNT_MODEL,
@@ -74,3 +118,61 @@ SYNC_CONFIG = {
         "object_id" : ("uid",),
     },
 }
+
+
+##################################################################
+# Session Settings
+##################################################################
+
+BLUESKY_SESSION_DIR = os.getenv("BLUESKY_SESSION_DIR", os.path.join(DATA_DIR, "sessions"))
+
+
+##################################################################
+# Cache Settings
+##################################################################
+
+BLOB_CACHE_TTL = int(os.getenv("BLOB_CACHE_TTL", "86400"))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+EMOJI_CACHE_SIZE = int(os.getenv("EMOJI_CACHE_SIZE", "1024"))
+HANDLE_CACHE_NEGATIVE_TTL = int(os.getenv("HANDLE_CACHE_NEGATIVE_TTL", "600"))
+HANDLE_CACHE_TTL = int(os.getenv("HANDLE_CACHE_TTL", "86400"))
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", "512"))
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", "86400"))
+THUMBNAIL_CACHE_SIZE = int(os.getenv("THUMBNAIL_CACHE_SIZE", "32"))
+
+
+##################################################################
+# Health Settings
+##################################################################
+
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "10"))
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "30"))
+HEALTH_VERIFY = os.getenv("HEALTH_VERIFY", False) == "true"
+
+
+##################################################################
+# Logging Settings
+##################################################################
+
+LOG_MAX_ITEMS = int(os.getenv("LOG_MAX_ITEMS", "20"))
+LOG_MAX_LENGTH = int(os.getenv("LOG_MAX_LENGTH", "2000"))
+LOG_QUEUE = os.getenv("LOG_QUEUE", True) != "false"
+LOG_QUEUE_ROOT = os.getenv("LOG_QUEUE_ROOT", False) == "true"
+
+
+##################################################################
+# Metrics Settings
+##################################################################
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(DATA_DIR, "metrics"))
+
+
+##################################################################
+# Rate Limit Settings
+##################################################################
+
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_HOST_BURST = int(os.getenv("RATE_LIMIT_HOST_BURST", "20"))
+RATE_LIMIT_HOST_RATE = float(os.getenv("RATE_LIMIT_HOST_RATE", "10"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "60"))
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "1"))